@@ -1,20 +1,45 @@
 #!/usr/bin/env python3
-'''Module for Home Assistant client.'''
+'''Module for Home Assistant client and in-memory state mirror.'''
+import asyncio
+import json
+import time
+
 import httpx
 
+from apis.httpclients import HOME_ASSISTANT, ClientPool, getSharedClientPool # pylint: disable=import-error
+
+try:
+    from websockets.asyncio.client import connect as websocketConnect
+    from websockets.exceptions import WebSocketException
+except ImportError: # websocket mode is optional
+    websocketConnect = None
+    WebSocketException = OSError
+
+STATE_MODES = ('single', 'bulk', 'websocket')
+
 class HomeAssistantClient:
     '''Client for Home Assistant REST API.'''
-    def __init__(self, baseUrl: str, token: str) -> None:
+    def __init__(self, baseUrl: str, token: str, clients: ClientPool = None) -> None:
         self.baseUrl = baseUrl.rstrip("/")
         self.headers = {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json",
         }
+        self.clients = clients if clients is not None else getSharedClientPool()
 
     def getStatus(self, entityId: str) -> httpx.Response:
         '''Get state of an entity from Home Assistant.'''
         url = f"{self.baseUrl}/api/states/{entityId}"
-        response = httpx.get(url, headers=self.headers, timeout=10)
+        client = self.clients.getClient(HOME_ASSISTANT)
+        response = client.get(url, headers=self.headers)
+        response.raise_for_status()
+        return response
+
+    async def getStatusAsync(self, entityId: str) -> httpx.Response:
+        '''Get state of an entity from Home Assistant without blocking the event loop.'''
+        url = f"{self.baseUrl}/api/states/{entityId}"
+        client = self.clients.getAsyncClient(HOME_ASSISTANT)
+        response = await client.get(url, headers=self.headers)
         response.raise_for_status()
         return response
 
@@ -25,28 +50,214 @@ class HomeAssistantClient:
             "entity_id": entityId,
             "temperature": temperature
         }
-        r = httpx.post(url, headers=self.headers, json=payload, timeout=10)
+        client = self.clients.getClient(HOME_ASSISTANT)
+        r = client.post(url, headers=self.headers, json=payload)
+        r.raise_for_status()
+        return r
+
+    async def getStatesAsync(self) -> list[dict]:
+        '''Get states of all entities from Home Assistant in one request.'''
+        url = f"{self.baseUrl}/api/states"
+        client = self.clients.getAsyncClient(HOME_ASSISTANT)
+        response = await client.get(url, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def setTemperatureAsync(self, entityId: str | list[str],
+                                  temperature: float) -> httpx.Response:
+        '''Set temperature of one or more climate entities without blocking the event loop.'''
+        url = f"{self.baseUrl}/api/services/climate/set_temperature"
+        payload = {
+            "entity_id": entityId,
+            "temperature": temperature
+        }
+        client = self.clients.getAsyncClient(HOME_ASSISTANT)
+        r = await client.post(url, headers=self.headers, json=payload)
         r.raise_for_status()
         return r
 
     def turnOn(self, entityId: str) -> None:
         '''Turn on a climate entity in Home Assistant.'''
         url = f"{self.baseUrl}/api/services/climate/turn_on"
-        r = httpx.post(
+        client = self.clients.getClient(HOME_ASSISTANT)
+        r = client.post(
             url,
             headers=self.headers,
-            json={"entity_id": entityId},
-            timeout=10
+            json={"entity_id": entityId}
         )
         r.raise_for_status()
 
     def turnOff(self, entityId: str) -> None:
         '''Turn off a climate entity in Home Assistant.'''
         url = f"{self.baseUrl}/api/services/climate/turn_off"
-        r = httpx.post(
+        client = self.clients.getClient(HOME_ASSISTANT)
+        r = client.post(
             url,
             headers=self.headers,
-            json={"entity_id": entityId},
-            timeout=10
+            json={"entity_id": entityId}
         )
         r.raise_for_status()
+
+class HomeAssistantStateMirror:
+    '''In-memory mirror of climate entity states. In bulk mode all states are fetched with one
+    /api/states request that is shared by every heat pump. In websocket mode the mirror is kept
+    up to date with subscribe_entities and reads need no network round trip. Temperature writes
+    with the same value are combined into one service call.'''
+
+    def __init__(self, client: HomeAssistantClient, maxAge: float = 30.0,
+                 batchWindow: float = 0.05, useWebsocket: bool = False,
+                 websocketUrl: str = None, reconnectDelay: float = 30.0) -> None:
+        self.client = client
+        self.maxAge = maxAge
+        self.batchWindow = batchWindow
+        self.useWebsocket = useWebsocket and websocketConnect is not None
+        if useWebsocket and websocketConnect is None:
+            print('websockets-pakettia ei ole asennettu, Home Assistantin tilat haetaan REST:llä.')
+        if websocketUrl is None:
+            websocketUrl = client.baseUrl.replace('http', 'ws', 1) + '/api/websocket'
+        self.websocketUrl = websocketUrl
+        self.reconnectDelay = reconnectDelay
+        self.states = {}
+        self.updated = float('-inf')
+        self.trackedEntities = set()
+        self.subscribed = False
+        self.refreshTask = None
+        self.subscriptionTask = None
+        self.pendingWrites = {}
+        self.writeTasks = set()
+
+    def track(self, entityId: str) -> None:
+        '''Add entity to websocket subscription.'''
+        if entityId in self.trackedEntities:
+            return
+        self.trackedEntities.add(entityId)
+        if self.subscriptionTask is not None:
+            # Subscription is restarted so that the new entity is included
+            self.subscriptionTask.cancel()
+            self.subscriptionTask = None
+            self.subscribed = False
+
+    def _isFresh(self) -> bool:
+        '''Check if mirrored states can be used without fetching.'''
+        return self.subscribed or time.monotonic() - self.updated < self.maxAge
+
+    async def _refreshAsync(self) -> None:
+        '''Fetch all climate entity states with one request.'''
+        states = await self.client.getStatesAsync()
+        for state in states:
+            if state['entity_id'].startswith('climate.'):
+                self.states[state['entity_id']] = state
+        self.updated = time.monotonic()
+
+    async def refreshAsync(self) -> None:
+        '''Fetch states, sharing the request with other callers that are already waiting.'''
+        if self.refreshTask is None or self.refreshTask.done():
+            self.refreshTask = asyncio.ensure_future(self._refreshAsync())
+        await asyncio.shield(self.refreshTask)
+
+    async def getStateAsync(self, entityId: str) -> dict:
+        '''Get mirrored state of entity. Returns None if entity is unknown.'''
+        if self.useWebsocket and self.subscriptionTask is None:
+            self.subscriptionTask = asyncio.ensure_future(self._runSubscription())
+        if not self._isFresh():
+            await self.refreshAsync()
+        return self.states.get(entityId)
+
+    def _applyEvent(self, event: dict) -> None:
+        '''Apply compressed subscribe_entities event to mirrored states.'''
+        for entityId, compressed in event.get('a', {}).items():
+            self.states[entityId] = {
+                'entity_id': entityId,
+                'state': compressed.get('s'),
+                'attributes': dict(compressed.get('a', {})),
+            }
+        for entityId, diff in event.get('c', {}).items():
+            state = self.states.setdefault(
+                entityId, {'entity_id': entityId, 'state': None, 'attributes': {}})
+            added = diff.get('+', {})
+            if 's' in added:
+                state['state'] = added['s']
+            state['attributes'].update(added.get('a', {}))
+            for attribute in diff.get('-', {}).get('a', []):
+                state['attributes'].pop(attribute, None)
+        for entityId in event.get('r', []):
+            self.states.pop(entityId, None)
+
+    async def _subscribeOnce(self) -> None:
+        '''Connect, authenticate and apply events until the connection closes.'''
+        token = self.client.headers['Authorization'].removeprefix('Bearer ')
+        async with websocketConnect(self.websocketUrl) as websocket:
+            message = json.loads(await websocket.recv())
+            if message.get('type') == 'auth_required':
+                await websocket.send(json.dumps({'type': 'auth', 'access_token': token}))
+                message = json.loads(await websocket.recv())
+            if message.get('type') != 'auth_ok':
+                raise WebSocketException(f'Home Assistant hylkäsi tunnistautumisen: {message}')
+            await websocket.send(json.dumps({'id': 1, 'type': 'subscribe_entities',
+                                             'entity_ids': sorted(self.trackedEntities)}))
+            async for rawMessage in websocket:
+                message = json.loads(rawMessage)
+                if message.get('type') == 'result' and not message.get('success'):
+                    raise WebSocketException(f'Tilausta ei hyväksytty: {message}')
+                if message.get('type') == 'event':
+                    self._applyEvent(message['event'])
+                    self.updated = time.monotonic()
+                    self.subscribed = True
+
+    async def _runSubscription(self) -> None:
+        '''Keep websocket subscription running. Reads fall back to REST while disconnected.'''
+        while True:
+            try:
+                await self._subscribeOnce()
+            except (OSError, WebSocketException, ValueError) as err:
+                print(f'Home Assistantin websocket-yhteys katkesi, virhe: {err}. ' \
+                      f'Yritetään {self.reconnectDelay} sekunnin päästä uudelleen.')
+            except Exception as err: # pylint: disable=broad-exception-caught
+                # An unexpected message must not end the subscription for good
+                print(f'Home Assistantin websocket-tilauksessa odottamaton virhe: {err!r}. ' \
+                      f'Yritetään {self.reconnectDelay} sekunnin päästä uudelleen.')
+            self.subscribed = False
+            await asyncio.sleep(self.reconnectDelay)
+
+    async def setTemperatureAsync(self, entityId: str, temperature: float) -> httpx.Response:
+        '''Set temperature of entity. Writes of the same temperature within the batch window
+        are sent as one service call.'''
+        loop = asyncio.get_running_loop()
+        batch = self.pendingWrites.get(temperature)
+        if batch is None:
+            batch = ([], loop.create_future())
+            self.pendingWrites[temperature] = batch
+            loop.call_later(self.batchWindow, self._flushWrites, temperature)
+        batch[0].append(entityId)
+        return await asyncio.shield(batch[1])
+
+    def _flushWrites(self, temperature: float) -> None:
+        '''Send batched temperature writes.'''
+        entityIds, future = self.pendingWrites.pop(temperature)
+        task = asyncio.ensure_future(self.client.setTemperatureAsync(entityIds, temperature))
+        self.writeTasks.add(task)
+
+        def done(task: asyncio.Task) -> None:
+            self.writeTasks.discard(task)
+            if task.cancelled():
+                future.cancel()
+                return
+            if task.exception() is not None:
+                future.set_exception(task.exception())
+                return
+            for writtenId in entityIds:
+                if writtenId in self.states:
+                    self.states[writtenId]['attributes']['temperature'] = temperature
+            future.set_result(task.result())
+        task.add_done_callback(done)
+
+_SHARED_MIRRORS = {}
+
+def getSharedStateMirror(client: HomeAssistantClient,
+                         useWebsocket: bool) -> HomeAssistantStateMirror:
+    '''Get process-wide state mirror for Home Assistant instance.'''
+    mirror = _SHARED_MIRRORS.get(client.baseUrl)
+    if mirror is None:
+        mirror = HomeAssistantStateMirror(client, useWebsocket=useWebsocket)
+        _SHARED_MIRRORS[client.baseUrl] = mirror
+    return mirror
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+'''Module for shared HTTP connection pools. Each host class (local devices, Home Assistant,
+api-spot-hinta.fi, weather forecasts) has one long-lived client with keep-alive so that
+requests do not pay for a new TCP connection and TLS handshake every time.'''
+
+import asyncio
+import importlib.util
+from dataclasses import dataclass, replace
+
+import httpx
+
+DEVICE = 'device'
+HOME_ASSISTANT = 'homeassistant'
+SPOT_HINTA = 'spothinta'
+WEATHER = 'weather'
+
+# HTTP/2 needs the optional h2 package, HTTP/1.1 keep-alive is used without it
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+@dataclass(frozen=True, slots=True)
+class ClientSettings:
+    '''Connection pool limits and timeout of one host class.'''
+    maxConnections: int
+    maxKeepalive: int
+    keepaliveExpiry: float
+    timeout: float
+    http2: bool
+
+DEFAULT_SETTINGS = {
+    # HeatIt devices speak plain HTTP/1.1 and keep only a few sockets open
+    DEVICE: ClientSettings(maxConnections=64, maxKeepalive=64, keepaliveExpiry=30.0,
+                           timeout=5.0, http2=False),
+    HOME_ASSISTANT: ClientSettings(maxConnections=16, maxKeepalive=8, keepaliveExpiry=120.0,
+                                   timeout=5.0, http2=True),
+    SPOT_HINTA: ClientSettings(maxConnections=4, maxKeepalive=4, keepaliveExpiry=120.0,
+                               timeout=20.0, http2=True),
+    WEATHER: ClientSettings(maxConnections=2, maxKeepalive=2, keepaliveExpiry=60.0,
+                            timeout=20.0, http2=True),
+}
+
+class ClientPool:
+    '''Long-lived sync and async httpx clients per host class.'''
+
+    def __init__(self, settings: dict[str, ClientSettings] = None) -> None:
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.clients = {}
+        self.asyncClients = {}
+        self.retiredClients = []
+        self.closingTasks = set()
+
+    def configure(self, hostClass: str, **changes) -> None:
+        '''Change limits or timeout of a host class. Existing clients are recreated on next use.'''
+        self.settings[hostClass] = replace(self.settings[hostClass], **changes)
+        client = self.clients.pop(hostClass, None)
+        if client is not None:
+            client.close()
+        entry = self.asyncClients.pop(hostClass, None)
+        if entry is not None:
+            self._retireAsyncClient(*entry)
+
+    def _retireAsyncClient(self, clientLoop: asyncio.AbstractEventLoop,
+                           client: httpx.AsyncClient) -> None:
+        '''Close async client in its own loop now if it is running, otherwise in closeAsync.
+        Requests already using the client finish before its connections are closed.'''
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if loop is not clientLoop:
+            self.retiredClients.append((clientLoop, client))
+            return
+        # Event loop keeps only weak references to tasks
+        task = loop.create_task(client.aclose())
+        self.closingTasks.add(task)
+        task.add_done_callback(self.closingTasks.discard)
+
+    def _getClientArguments(self, hostClass: str) -> dict:
+        '''Get keyword arguments for creating httpx client.'''
+        settings = self.settings[hostClass]
+        return {
+            'limits': httpx.Limits(max_connections=settings.maxConnections,
+                                   max_keepalive_connections=settings.maxKeepalive,
+                                   keepalive_expiry=settings.keepaliveExpiry),
+            'timeout': settings.timeout,
+            'http2': settings.http2 and HTTP2_AVAILABLE,
+        }
+
+    def getClient(self, hostClass: str) -> httpx.Client:
+        '''Get shared sync client for host class.'''
+        client = self.clients.get(hostClass)
+        if client is None:
+            client = httpx.Client(**self._getClientArguments(hostClass))
+            self.clients[hostClass] = client
+        return client
+
+    def getAsyncClient(self, hostClass: str) -> httpx.AsyncClient:
+        '''Get shared async client for host class. Connections belong to an event loop,
+        so a new client is created if the loop has changed.'''
+        loop = asyncio.get_running_loop()
+        entry = self.asyncClients.get(hostClass)
+        if entry is None or entry[0] is not loop:
+            entry = (loop, httpx.AsyncClient(**self._getClientArguments(hostClass)))
+            self.asyncClients[hostClass] = entry
+        return entry[1]
+
+    def close(self) -> None:
+        '''Close sync clients.'''
+        for client in self.clients.values():
+            client.close()
+        self.clients.clear()
+
+    async def closeAsync(self) -> None:
+        '''Close all clients.'''
+        self.close()
+        loop = asyncio.get_running_loop()
+        for clientLoop, client in [*self.asyncClients.values(), *self.retiredClients]:
+            if clientLoop is loop:
+                await client.aclose()
+        self.asyncClients.clear()
+        self.retiredClients.clear()
+        if self.closingTasks:
+            await asyncio.gather(*self.closingTasks)
+
+_SHARED_POOL = None
+
+def getSharedClientPool() -> ClientPool:
+    '''Get process-wide client pool.'''
+    global _SHARED_POOL # pylint: disable=global-statement
+    if _SHARED_POOL is None:
+        _SHARED_POOL = ClientPool()
+    return _SHARED_POOL
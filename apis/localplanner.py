@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+'''Module for local heating planner. Reproduces the SmartHeating selection of
+api-spot-hinta.fi from the configuration fields and cached spot prices, so that an outage
+or rate limit of the API does not force devices onto the static backup hours.'''
+
+import math
+import time
+from array import array
+from bisect import bisect_right
+from dataclasses import dataclass
+
+SLOT_MILLIS = 15 * 60 * 1000
+TEMPERATURE_BANDS = (
+    (30, 'HeatingPercentage_Plus30'),
+    (20, 'HeatingPercentage_Plus20'),
+    (10, 'HeatingPercentage_Plus10'),
+    (0, 'HeatingPercentage_Zero'),
+    (-10, 'HeatingPercentage_Minus10'),
+    (-20, 'HeatingPercentage_Minus20'),
+    (-30, 'HeatingPercentage_Minus30'),
+)
+
+@dataclass(frozen=True, slots=True)
+class PriceSeries:
+    '''Quarter hour spot prices of a region in c/kWh, sorted by slot start. Columns can be
+    arrays or memoryviews into the series store.'''
+    epochs: array | memoryview
+    prices: array | memoryview
+
+@dataclass(frozen=True, slots=True)
+class _Calendar:
+    '''Local time fields of every slot of a price series, computed once per series.'''
+    days: array
+    hours: array
+    months: array
+    weekdays: array
+
+    @classmethod
+    def fromSeries(cls, series: PriceSeries) -> '_Calendar':
+        '''Convert slot starts to local time fields.'''
+        fields = [time.localtime(epoch // 1000) for epoch in series.epochs]
+        return cls(array('l', (field.tm_year * 1000 + field.tm_yday for field in fields)),
+                   array('b', (field.tm_hour for field in fields)),
+                   array('b', (field.tm_mon for field in fields)),
+                   array('b', (field.tm_wday + 1 for field in fields)))
+
+def getHeatingPercentage(payload: dict, temperature: float) -> float:
+    '''Get heating percentage of the temperature band nearest to the average temperature.'''
+    temperature = min(30.0, max(-30.0, temperature))
+    _, field = min(TEMPERATURE_BANDS, key=lambda band: abs(band[0] - temperature))
+    return float(payload[field])
+
+class LocalPlanner:
+    '''Computes SmartHeating-like plans for many payloads in one pass over the cached
+    price series of their regions.'''
+
+    def __init__(self, validity: float = 3600.0) -> None:
+        self.validity = validity
+        self.series = {}
+        self.calendars = {}
+        self.groups = {}
+        self.temperatures = {}
+
+    def setPrices(self, region: str, series: PriceSeries) -> None:
+        '''Take price series of region into use.'''
+        self.series[region] = series
+        self.calendars[region] = _Calendar.fromSeries(series)
+        self.groups = {key: groups for key, groups in self.groups.items() if key[0] != region}
+
+    def setTemperature(self, region: str, temperature: float) -> None:
+        '''Set average outdoor temperature of region.'''
+        if temperature is not None:
+            self.temperatures[region] = float(temperature)
+
+    def getPrices(self, region: str, starts: list[int]) -> list[float]:
+        '''Get prices of slots starting at given epoch milliseconds. Returns None if any of
+        them is not covered by the cached series.'''
+        series = self.series.get(region)
+        if series is None or not len(series.epochs):
+            return None
+        prices = []
+        for start in starts:
+            index = bisect_right(series.epochs, start) - 1
+            if index < 0 or start - series.epochs[index] >= SLOT_MILLIS:
+                return None
+            prices.append(series.prices[index])
+        return prices
+
+    def _getAdjustedPrices(self, payload: dict, series: PriceSeries,
+                           calendar: _Calendar) -> array:
+        '''Apply PriceDifference to night hours on the configured months and weekdays.'''
+        difference = float(payload.get('PriceDifference', 0.0))
+        if difference == 0.0:
+            return series.prices
+        nightHours = set(payload.get('NightHours', ()))
+        months = set(payload.get('PriceDifference_Months', range(1, 13)))
+        weekdays = set(payload.get('PriceDifference_Days', range(1, 8)))
+        return array('d', (price + difference
+                           if hour in nightHours and month in months and weekday in weekdays
+                           else price
+                           for price, hour, month, weekday in zip(
+                               series.prices, calendar.hours, calendar.months,
+                               calendar.weekdays)))
+
+    def _getGroups(self, region: str, segments: int) -> list[list[int]]:
+        '''Get slot indexes of every segment of every day, cached per price series.'''
+        groups = self.groups.get((region, segments))
+        if groups is None:
+            calendar = self.calendars[region]
+            segmentHours = 24 / segments
+            grouped = {}
+            for index, (day, hour) in enumerate(zip(calendar.days, calendar.hours)):
+                grouped.setdefault((day, int(hour // segmentHours)), []).append(index)
+            groups = list(grouped.values())
+            self.groups[(region, segments)] = groups
+        return groups
+
+    def _getRanking(self, payload: dict, batchCache: dict) -> tuple[array, list[list[int]]]:
+        '''Get adjusted prices and slot indexes of every segment ordered from the cheapest.
+        Payloads with the same region and price adjustment share the ranking in a batch.'''
+        region = payload.get('Region')
+        segments = max(1, int(payload.get('HeatingSegments_PerDay', 1)))
+        cacheKey = (region, segments, payload.get('PriceDifference'),
+                    tuple(payload.get('NightHours', ())),
+                    tuple(payload.get('PriceDifference_Months', ())),
+                    tuple(payload.get('PriceDifference_Days', ())))
+        ranking = batchCache.get(cacheKey)
+        if ranking is None:
+            prices = self._getAdjustedPrices(payload, self.series[region], self.calendars[region])
+            ranking = (prices, [sorted(indexes, key=prices.__getitem__)
+                                for indexes in self._getGroups(region, segments)])
+            batchCache[cacheKey] = ranking
+        return ranking
+
+    def _selectSlots(self, payload: dict, getPercentage, batchCache: dict) -> bytearray:
+        '''Select cheapest slots of every segment of the day. getPercentage(day) gives the
+        heating percentage of a calendar day.'''
+        prices, ranking = self._getRanking(payload, batchCache)
+        days = self.calendars[payload.get('Region')].days
+        segments = max(1, int(payload.get('HeatingSegments_PerDay', 1)))
+        minimumSlots = math.ceil(int(payload.get('MinimumHeatingTime', 0)) / 15)
+        reductionPrice = float(payload.get('HeatingReductionPrice', math.inf))
+        reduction = float(payload.get('HeatingReductionPercentage', 0)) / 100
+        selected = bytearray(len(prices))
+        for ranked in ranking:
+            count = math.ceil(getPercentage(days[ranked[0]]) / 100 * round(96 / segments))
+            if count > 0:
+                count = max(count, minimumSlots)
+            heatingSlots = min(count, len(ranked))
+            if heatingSlots and prices[ranked[heatingSlots - 1]] > reductionPrice:
+                heatingSlots = round(heatingSlots * (1 - reduction))
+            for index in ranked[:heatingSlots]:
+                selected[index] = 1
+        return selected
+
+    def computeResponse(self, payload: dict, timestamp: float, batchCache: dict = None) -> dict:
+        '''Compute plan in the format of api-spot-hinta.fi response. Returns None if there
+        are no prices for the region of the payload.'''
+        region = payload.get('Region')
+        series = self.series.get(region)
+        timeMillis = int(timestamp * 1000)
+        if series is None or not series.epochs or series.epochs[-1] + SLOT_MILLIS <= timeMillis:
+            return None
+        temperature = self.temperatures.get(region, 0.0)
+        percentage = getHeatingPercentage(payload, temperature)
+        demand = self._getDemand(payload, lambda _day: percentage,
+                                 {} if batchCache is None else batchCache)
+        firstSlot = timeMillis // SLOT_MILLIS * SLOT_MILLIS
+        planAhead = [{'epochMs': epoch, 'result': bool(result)}
+                     for epoch, result in zip(series.epochs, demand) if epoch >= firstSlot]
+        expiration = min(series.epochs[-1] + SLOT_MILLIS, timeMillis + int(self.validity * 1000))
+        return {'PlanAhead': planAhead, 'EpochMsExpiration': expiration,
+                'AverageTemperature': temperature, 'Local': True}
+
+    def _getDemand(self, payload: dict, getPercentage, batchCache: dict) -> bytearray:
+        '''Get heating demand of every slot of the price series of the payload.'''
+        prices = self.series[payload.get('Region')].prices
+        selected = self._selectSlots(payload, getPercentage, batchCache)
+        alwaysAllowed = float(payload.get('PriceAlwaysAllowed', -math.inf))
+        inverted = bool(payload.get('Inverted', False))
+        return bytearray((bool(isSelected) or price <= alwaysAllowed) != inverted
+                         for price, isSelected in zip(prices, selected))
+
+    def computeDemand(self, payload: dict, dayTemperatures: dict[int, float],
+                      batchCache: dict = None) -> bytearray:
+        '''Compute heating demand of every slot of the cached price series so that each day
+        uses its own average outdoor temperature. Days are keys of the calendar of the
+        region; days without a temperature use the region average. Returns None if there
+        are no prices for the region of the payload.'''
+        region = payload.get('Region')
+        series = self.series.get(region)
+        if series is None or not series.epochs:
+            return None
+        default = self.temperatures.get(region, 0.0)
+        percentages = {}
+        def getPercentage(day: int) -> float:
+            if day not in percentages:
+                percentages[day] = getHeatingPercentage(payload,
+                                                        dayTemperatures.get(day, default))
+            return percentages[day]
+        return self._getDemand(payload, getPercentage, {} if batchCache is None else batchCache)
+
+    def computeResponses(self, payloads: dict[str, dict], timestamp: float) -> dict[str, dict]:
+        '''Compute plans for many payloads keyed by payload hash. Payloads without prices
+        are left out.'''
+        responses = {}
+        batchCache = {}
+        for key, payload in payloads.items():
+            response = self.computeResponse(payload, timestamp, batchCache)
+            if response is not None:
+                responses[key] = response
+        return responses
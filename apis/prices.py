@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+'''Module for bulk price and weather forecast updates. Day-ahead spot prices are fetched
+from api-spot-hinta.fi and outdoor temperature forecasts from open-meteo.com once per region,
+stored in the series store and handed to the local planner, instead of every device asking
+the remote API for its own data.'''
+
+import time
+from datetime import datetime
+
+import httpx
+
+from apis.httpclients import SPOT_HINTA, WEATHER, ClientPool, getSharedClientPool # pylint: disable=import-error
+from apis.localplanner import SLOT_MILLIS, LocalPlanner, PriceSeries # pylint: disable=import-error
+from apis.retry import RetryEngine, getSharedRetryEngine # pylint: disable=import-error
+from apis.smartheating import getSharedPlanCache # pylint: disable=import-error
+from storage.series import PRICE, TEMPERATURE, SeriesStore, getSharedSeriesStore # pylint: disable=import-error
+
+PRICES_URL = 'https://api.spot-hinta.fi/TodayAndDayForward'
+FORECAST_URL = 'https://api.open-meteo.com/v1/forecast'
+
+def parsePrices(responseJson: list) -> dict[int, float]:
+    '''Convert api-spot-hinta.fi price list to quarter hour prices in c/kWh with tax.
+    Hourly prices are spread over the four quarters of the hour.'''
+    starts = sorted((int(datetime.fromisoformat(item['DateTime']).timestamp() * 1000),
+                     float(item['PriceWithTax']) * 100) for item in responseJson)
+    points = {}
+    for index, (start, price) in enumerate(starts):
+        if index + 1 < len(starts):
+            end = starts[index + 1][0]
+        else:
+            end = start + (start - starts[index - 1][0] if index > 0 else SLOT_MILLIS)
+        for epoch in range(start, end, SLOT_MILLIS):
+            points[epoch] = price
+    return points
+
+def parseForecast(responseJson: dict) -> dict[int, float]:
+    '''Convert open-meteo hourly forecast to temperatures keyed by epoch milliseconds.'''
+    hourly = responseJson['hourly']
+    return {int(epoch) * 1000: float(temperature)
+            for epoch, temperature in zip(hourly['time'], hourly['temperature_2m'])
+            if temperature is not None}
+
+class SeriesUpdater:
+    '''Keeps price and forecast series of every region fresh and feeds them to the planner.'''
+
+    def __init__(self, store: SeriesStore = None, planner: LocalPlanner = None,
+                 clients: ClientPool = None, retries: RetryEngine = None,
+                 pricesUrl: str = PRICES_URL, forecastUrl: str = FORECAST_URL,
+                 minimumAhead: float = 12 * 3600.0, retryInterval: float = 3600.0) -> None:
+        self.store = store if store is not None else getSharedSeriesStore()
+        self.planner = planner if planner is not None else LocalPlanner()
+        self.clients = clients if clients is not None else getSharedClientPool()
+        self.retries = retries if retries is not None else getSharedRetryEngine()
+        self.pricesUrl = pricesUrl
+        self.forecastUrl = forecastUrl
+        self.minimumAhead = minimumAhead
+        self.retryInterval = retryInterval
+        self.lastAttempts = {}
+
+    def _needsFetch(self, kind: str, region: str, now: float) -> bool:
+        '''Series is fetched when it does not reach minimumAhead into the future, at most
+        once per retryInterval.'''
+        view = self.store.getSeries(kind, region)
+        lastEpoch = view.getLastEpoch() if view is not None else None
+        if lastEpoch is not None and lastEpoch >= (now + self.minimumAhead) * 1000:
+            return False
+        return now - self.lastAttempts.get((kind, region), -self.retryInterval) \
+            >= self.retryInterval
+
+    async def _getJsonAsync(self, hostClass: str, url: str, params: dict, label: str):
+        '''Get JSON with retries. Returns None on failure.'''
+        async def get() -> httpx.Response:
+            response = await self.clients.getAsyncClient(hostClass).get(url, params=params)
+            response.raise_for_status()
+            return response
+        try:
+            response = await self.retries.runAsync(hostClass, get, label,
+                                                   hostKey=httpx.URL(url).host)
+            return response.json()
+        except (httpx.RequestError, httpx.HTTPStatusError, ValueError) as err:
+            print(f'{label} ei vastannut, virhe: {err}')
+            return None
+
+    async def _updatePricesAsync(self, region: str, now: float) -> None:
+        '''Fetch prices of region if needed.'''
+        if not self._needsFetch(PRICE, region, now):
+            return
+        self.lastAttempts[(PRICE, region)] = now
+        responseJson = await self._getJsonAsync(SPOT_HINTA, self.pricesUrl,
+                                                {'region': region}, 'api-spot-hinta.fi')
+        if responseJson:
+            try:
+                self.store.write(PRICE, region, parsePrices(responseJson), now)
+            except (KeyError, TypeError, ValueError) as err:
+                print(f'Spot-hintoja ei voitu lukea, virhe: {err}')
+                return
+            print(f'Päivitettiin alueen {region} spot-hinnat.')
+
+    async def _updateForecastAsync(self, region: str, location: tuple, now: float) -> None:
+        '''Fetch temperature forecast of region if needed.'''
+        if location is None or not self._needsFetch(TEMPERATURE, region, now):
+            return
+        self.lastAttempts[(TEMPERATURE, region)] = now
+        latitude, longitude = location
+        responseJson = await self._getJsonAsync(
+            WEATHER, self.forecastUrl,
+            {'latitude': latitude, 'longitude': longitude, 'hourly': 'temperature_2m',
+             'timeformat': 'unixtime', 'forecast_days': 2}, 'open-meteo.com')
+        if responseJson:
+            try:
+                self.store.write(TEMPERATURE, region, parseForecast(responseJson), now)
+            except (KeyError, TypeError, ValueError) as err:
+                print(f'Säätiedotetta ei voitu lukea, virhe: {err}')
+
+    def _feedPlanner(self, region: str, now: float) -> None:
+        '''Give stored series of region to the local planner without copying.'''
+        prices = self.store.getSeries(PRICE, region)
+        current = self.planner.series.get(region)
+        if prices is not None and len(prices.epochs) \
+                and (current is None or current.epochs is not prices.epochs):
+            self.planner.setPrices(region, PriceSeries(prices.epochs, prices.values))
+        nowMillis = int(now * 1000)
+        _, temperatures = self.store.query(TEMPERATURE, region, nowMillis,
+                                           nowMillis + 86400_000)
+        if len(temperatures):
+            self.planner.setTemperature(region, sum(temperatures) / len(temperatures))
+
+    async def refreshAsync(self, regions: dict[str, tuple], now: float = None) -> None:
+        '''Update series of regions. Regions map to (latitude, longitude) of the forecast
+        location or None.'''
+        if now is None:
+            now = time.time()
+        for region, location in regions.items():
+            await self._updatePricesAsync(region, now)
+            await self._updateForecastAsync(region, location, now)
+            self._feedPlanner(region, now)
+
+_SHARED_UPDATER = None
+
+def getSharedSeriesUpdater() -> SeriesUpdater:
+    '''Get process-wide series updater feeding the planner of the shared plan cache.'''
+    global _SHARED_UPDATER # pylint: disable=global-statement
+    if _SHARED_UPDATER is None:
+        _SHARED_UPDATER = SeriesUpdater(planner=getSharedPlanCache().localPlanner)
+    return _SHARED_UPDATER
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+'''Module for shared retry engine. Failed requests are retried with jittered exponential
+backoff, and circuit breakers per device and per host stop probing hardware that is clearly
+offline. An open breaker is re-probed with a single request on a slowing cadence, so an
+offline device costs almost nothing. The number of requests in flight can be limited; a
+request waiting for its backoff does not hold a slot.'''
+
+import asyncio
+import contextlib
+import random
+import time
+from dataclasses import dataclass
+
+import httpx
+
+from apis.httpclients import DEVICE, HOME_ASSISTANT, SPOT_HINTA, WEATHER # pylint: disable=import-error
+from metrics.registry import MetricsRegistry, getSharedMetrics # pylint: disable=import-error
+
+RETRYABLE_ERRORS = (httpx.RequestError, httpx.HTTPStatusError)
+
+class CircuitOpenError(httpx.RequestError):
+    '''Raised without sending the request when the breaker of the device or host is open.'''
+
+@dataclass(frozen=True, slots=True)
+class RetryPolicy:
+    '''Number of attempts and backoff limits of one host class.'''
+    attempts: int
+    baseDelay: float
+    maxDelay: float
+
+    def getDelay(self, attempt: int, rng: random.Random) -> float:
+        '''Get full-jitter backoff delay after given failed attempt (0-based).'''
+        return rng.uniform(0.0, min(self.maxDelay, self.baseDelay * 2 ** attempt))
+
+    def getWorstCase(self, timeout: float) -> float:
+        '''Get longest possible duration of the whole retry sequence in seconds when every
+        attempt runs until the given request timeout.'''
+        delays = sum(min(self.maxDelay, self.baseDelay * 2 ** attempt)
+                     for attempt in range(self.attempts - 1))
+        return self.attempts * timeout + delays
+
+DEFAULT_POLICIES = {
+    # Control engine makes a status read and a setpoint write within the deadline of a device,
+    # so twice the worst case with the request timeout of the host class has to fit in it
+    DEVICE: RetryPolicy(attempts=3, baseDelay=1.0, maxDelay=4.0),
+    HOME_ASSISTANT: RetryPolicy(attempts=3, baseDelay=1.0, maxDelay=4.0),
+    SPOT_HINTA: RetryPolicy(attempts=3, baseDelay=2.0, maxDelay=30.0),
+    WEATHER: RetryPolicy(attempts=3, baseDelay=2.0, maxDelay=30.0),
+}
+
+class CircuitBreaker:
+    '''Breaker that opens after consecutive failures. After the open delay one probe is let
+    through. A failed probe doubles the open delay up to maxOpenDelay.'''
+
+    def __init__(self, failureThreshold: int = 3, openDelay: float = 60.0,
+                 maxOpenDelay: float = 1800.0, clock=time.monotonic) -> None:
+        self.failureThreshold = failureThreshold
+        self.openDelay = openDelay
+        self.maxOpenDelay = maxOpenDelay
+        self.clock = clock
+        self.failures = 0
+        self.currentOpenDelay = openDelay
+        self.openUntil = None
+        self.probing = False
+
+    def isOpen(self) -> bool:
+        '''Check if requests are currently refused.'''
+        return self.openUntil is not None and (self.probing or self.clock() < self.openUntil)
+
+    def allow(self) -> bool:
+        '''Check if request may be sent. Claims the probe when the open delay has passed.'''
+        if self.openUntil is None:
+            return True
+        if self.isOpen():
+            return False
+        self.probing = True
+        return True
+
+    def recordSuccess(self) -> None:
+        '''Close breaker.'''
+        self.failures = 0
+        self.currentOpenDelay = self.openDelay
+        self.openUntil = None
+        self.probing = False
+
+    def recordFailure(self) -> None:
+        '''Count failure and open breaker if threshold is reached or the probe failed.'''
+        self.failures += 1
+        if self.probing:
+            self.probing = False
+            self.currentOpenDelay = min(self.currentOpenDelay * 2, self.maxOpenDelay)
+            self.openUntil = self.clock() + self.currentOpenDelay
+        elif self.failures >= self.failureThreshold:
+            self.openUntil = self.clock() + self.currentOpenDelay
+
+    def releaseProbe(self) -> None:
+        '''Give probe back without result, for example when the request was cancelled.'''
+        self.probing = False
+
+    def getState(self, wallNow: float) -> dict:
+        '''Get state for persisting. Open time is stored as wall clock time because the
+        monotonic clock does not survive a restart.'''
+        openUntil = None if self.openUntil is None \
+            else wallNow + self.openUntil - self.clock()
+        return {'failures': self.failures, 'openDelay': self.currentOpenDelay,
+                'openUntil': openUntil}
+
+    def restoreState(self, state: dict, wallNow: float) -> None:
+        '''Restore state stored by getState.'''
+        self.failures = state['failures']
+        self.currentOpenDelay = state['openDelay']
+        openUntil = state['openUntil']
+        self.openUntil = None if openUntil is None else self.clock() + openUntil - wallNow
+        self.probing = False
+
+class RetryEngine:
+    '''Runs requests with retries and keeps circuit breakers per device and per host.'''
+
+    def __init__(self, policies: dict[str, RetryPolicy] = None, failureThreshold: int = 3,
+                 hostFailureThreshold: int = 10, openDelay: float = 60.0,
+                 maxOpenDelay: float = 1800.0, clock=time.monotonic,
+                 rng: random.Random = None, metrics: MetricsRegistry = None,
+                 maxConcurrency: int = None) -> None:
+        self.policies = dict(DEFAULT_POLICIES)
+        self.policies.update(policies or {})
+        self.failureThreshold = failureThreshold
+        self.hostFailureThreshold = hostFailureThreshold
+        self.openDelay = openDelay
+        self.maxOpenDelay = maxOpenDelay
+        self.clock = clock
+        self.rng = rng if rng is not None else random.Random()
+        self.metrics = metrics if metrics is not None else getSharedMetrics()
+        self.breakers = {}
+        self.persisted = {}
+        self.maxConcurrency = maxConcurrency
+        self.limiter = None
+
+    def limitConcurrency(self, maxConcurrency: int) -> None:
+        '''Limit number of attempts in flight at the same time.'''
+        self.maxConcurrency = maxConcurrency
+        self.limiter = None
+
+    def _getLimiter(self):
+        '''Get semaphore of the running event loop. Semaphores belong to a loop, so a new
+        one is created if the loop has changed.'''
+        if self.maxConcurrency is None:
+            return contextlib.nullcontext()
+        loop = asyncio.get_running_loop()
+        if self.limiter is None or self.limiter[0] is not loop:
+            self.limiter = (loop, asyncio.Semaphore(self.maxConcurrency))
+        return self.limiter[1]
+
+    def getBreaker(self, key: str, threshold: int = None) -> CircuitBreaker:
+        '''Get breaker by key, creating it on first use.'''
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(threshold or self.failureThreshold, self.openDelay,
+                                     self.maxOpenDelay, self.clock)
+            self.breakers[key] = breaker
+        return breaker
+
+    def getChangedBreakerStates(self, wallNow: float) -> dict[str, dict]:
+        '''Get state of breakers that changed after the previous call, for persisting.'''
+        changed = {}
+        for key, breaker in self.breakers.items():
+            snapshot = (breaker.failures, breaker.currentOpenDelay, breaker.openUntil)
+            if self.persisted.get(key) != snapshot:
+                self.persisted[key] = snapshot
+                changed[key] = breaker.getState(wallNow)
+        return changed
+
+    def restoreBreaker(self, key: str, state: dict, wallNow: float) -> None:
+        '''Restore persisted breaker state.'''
+        threshold = self.hostFailureThreshold if key.startswith('host:') else None
+        breaker = self.getBreaker(key, threshold)
+        breaker.restoreState(state, wallNow)
+        self.persisted[key] = (breaker.failures, breaker.currentOpenDelay, breaker.openUntil)
+
+    def _getBreakers(self, deviceKey: str, hostKey: str) -> list[CircuitBreaker]:
+        '''Get breakers that guard the request.'''
+        breakers = []
+        if deviceKey is not None:
+            breakers.append(self.getBreaker(f'device:{deviceKey}'))
+        if hostKey is not None and hostKey != deviceKey:
+            breakers.append(self.getBreaker(f'host:{hostKey}', self.hostFailureThreshold))
+        return breakers
+
+    def _claim(self, breakers: list[CircuitBreaker], label: str, target: str) -> None:
+        '''Check breakers before an attempt. Raises CircuitOpenError if any is open.'''
+        claimed = []
+        for breaker in breakers:
+            if not breaker.allow():
+                for claimedBreaker in claimed:
+                    claimedBreaker.releaseProbe()
+                self.metrics.circuitRejections.inc(target)
+                raise CircuitOpenError(f'{label}: katkaisija auki, ei yritetä')
+            claimed.append(breaker)
+
+    def _getAttempts(self, policy: RetryPolicy, breakers: list[CircuitBreaker]) -> int:
+        '''Probe of an open breaker is a single attempt.'''
+        return 1 if any(breaker.probing for breaker in breakers) else policy.attempts
+
+    def _recordFailure(self, breakers: list[CircuitBreaker], label: str, target: str,
+                       err: Exception, attempt: int, attempts: int,
+                       policy: RetryPolicy) -> float:
+        '''Record failed attempt. Returns delay before the next attempt or None if none.'''
+        for breaker in breakers:
+            breaker.recordFailure()
+        if isinstance(err, httpx.TimeoutException):
+            self.metrics.timeouts.inc(target)
+        if attempt + 1 >= attempts or any(breaker.isOpen() for breaker in breakers):
+            return None
+        self.metrics.retries.inc(target)
+        delay = policy.getDelay(attempt, self.rng)
+        print(f'{label} ei vastannut, virhe: {err}. Yritetään {delay:.1f} sekunnin päästä ' \
+              f'uudelleen. Yritys {attempt + 1} / {attempts}')
+        return delay
+
+    async def runAsync(self, hostClass: str, operation, label: str, deviceKey: str = None,
+                       hostKey: str = None):
+        '''Await operation() until it succeeds. Raises the last error when attempts run out
+        and CircuitOpenError when a breaker refuses the request. Only the attempt itself
+        holds a concurrency slot, so offline devices sleeping in backoff do not delay others.'''
+        policy = self.policies[hostClass]
+        breakers = self._getBreakers(deviceKey, hostKey)
+        target = deviceKey or hostKey or hostClass
+        limiter = self._getLimiter()
+        attempt = 0
+        while True:
+            self._claim(breakers, label, target)
+            attempts = self._getAttempts(policy, breakers)
+            try:
+                async with limiter:
+                    result = await operation()
+            except RETRYABLE_ERRORS as err:
+                delay = self._recordFailure(breakers, label, target, err, attempt, attempts,
+                                            policy)
+                if delay is None:
+                    raise
+            except BaseException:
+                for breaker in breakers:
+                    breaker.releaseProbe()
+                raise
+            else:
+                for breaker in breakers:
+                    breaker.recordSuccess()
+                return result
+            attempt += 1
+            await asyncio.sleep(delay)
+
+_SHARED_ENGINE = None
+
+def getSharedRetryEngine() -> RetryEngine:
+    '''Get process-wide retry engine.'''
+    global _SHARED_ENGINE # pylint: disable=global-statement
+    if _SHARED_ENGINE is None:
+        _SHARED_ENGINE = RetryEngine()
+    return _SHARED_ENGINE
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+'''Module for shared SmartHeating plan cache. Devices that send identical API parameters
+share one plan, concurrent requests for the same parameters are coalesced and plans are
+persisted to disk so that a restart does not fetch them again. Worker processes of the
+supervisor share the cache file: writes are merged under a file lock and a process reads
+the file again before fetching a plan that another process may already have fetched.'''
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from pathlib import Path
+
+import httpx
+
+try:
+    import fcntl
+except ImportError: # Windows has no flock, the cache file is then not shared safely
+    fcntl = None
+
+from apis.httpclients import SPOT_HINTA, ClientPool, getSharedClientPool # pylint: disable=import-error
+from apis.localplanner import LocalPlanner # pylint: disable=import-error
+from apis.retry import RetryEngine, getSharedRetryEngine # pylint: disable=import-error
+from metrics.registry import HIT, MISS, PLAN_FETCH, SHARED, MetricsRegistry, getSharedMetrics # pylint: disable=import-error
+
+SMART_HEATING_URL = 'https://api.spot-hinta.fi/SmartHeating'
+DEFAULT_CACHE_PATH = Path('cache/plans.json')
+
+logger = logging.getLogger(__name__)
+
+def _formatEpoch(epochMs: int) -> str:
+    '''Convert epoch milliseconds to local time string.'''
+    return time.strftime('%H:%M:%S (%a %d %b)', time.localtime(epochMs // 1000))
+
+@dataclass(frozen=True, slots=True)
+class HeatingPlan:
+    '''SmartHeating plan normalized into arrays sorted by slot start time.'''
+    epochs: array
+    results: array
+    nextChanges: array
+    expiration: int
+    averageTemperature: float
+
+    @classmethod
+    def fromResponse(cls, responseJson: dict) -> 'HeatingPlan':
+        '''Create plan from api-spot-hinta.fi response regardless of the order of the slots.'''
+        items = sorted((int(item['epochMs']), bool(item['result']))
+                       for item in responseJson['PlanAhead'])
+        epochs = array('q', (epoch for epoch, _ in items))
+        results = array('b', (result for _, result in items))
+        expiration = int(responseJson['EpochMsExpiration'])
+        # Start of the first later slot with a different result, expiration if there is none
+        nextChanges = array('q', [expiration]) * len(items)
+        for index in range(len(items) - 2, -1, -1):
+            if results[index + 1] != results[index]:
+                nextChanges[index] = epochs[index + 1]
+            else:
+                nextChanges[index] = nextChanges[index + 1]
+        return cls(epochs, results, nextChanges, expiration,
+                   responseJson.get('AverageTemperature'))
+
+    def toResponse(self) -> dict:
+        '''Convert plan back to the api-spot-hinta.fi response format for storing.'''
+        return {'PlanAhead': [{'epochMs': epoch, 'result': bool(result)}
+                              for epoch, result in zip(self.epochs, self.results)],
+                'EpochMsExpiration': self.expiration,
+                'AverageTemperature': self.averageTemperature}
+
+    def getActiveIndex(self, timeMillis: int) -> int:
+        '''Get index of the slot that has started before given time. Returns -1 if none.'''
+        if timeMillis > self.expiration:
+            return -1
+        return bisect_left(self.epochs, timeMillis) - 1
+
+    def getDemand(self, timeMillis: int) -> bool:
+        '''Get heating demand at given time. Returns None if no slot is active.'''
+        index = self.getActiveIndex(timeMillis)
+        if index < 0:
+            return None
+        return bool(self.results[index])
+
+    def getNextChange(self, timeMillis: int) -> int:
+        '''Get epoch milliseconds of the next change of heating demand after given time.
+        Returns start of the first slot if none is active yet and expiration if the demand
+        does not change before it.'''
+        index = self.getActiveIndex(timeMillis)
+        if index < 0:
+            return self.epochs[0] if self.epochs and timeMillis < self.epochs[0] \
+                else self.expiration
+        return self.nextChanges[index]
+
+    def logPlan(self, timeMillis: int) -> None:
+        '''Write whole plan to debug log.'''
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        activeIndex = self.getActiveIndex(timeMillis)
+        logger.debug('Tuleva suunnitelma, joka vanhenee %s:', _formatEpoch(self.expiration))
+        for index, (epoch, result) in enumerate(zip(self.epochs, self.results)):
+            logger.debug('Aika: %s, Lämmitystarve: %s%s', _formatEpoch(epoch), bool(result),
+                         ' (VOIMASSA NYT)' if index == activeIndex else '.')
+
+def getPayloadKey(payload: dict) -> str:
+    '''Get canonical hash of API payload.'''
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class PlanCache:
+    '''Process-wide cache of SmartHeating plans keyed by API payload hash.'''
+
+    def __init__(self, cachePath: Path = DEFAULT_CACHE_PATH, refreshMargin: float = 300.0,
+                 clients: ClientPool = None, url: str = SMART_HEATING_URL,
+                 retries: RetryEngine = None, localPlanner: LocalPlanner = None,
+                 metrics: MetricsRegistry = None) -> None:
+        self.clients = clients if clients is not None else getSharedClientPool()
+        self.retries = retries if retries is not None else getSharedRetryEngine()
+        self.localPlanner = localPlanner if localPlanner is not None else LocalPlanner()
+        self.metrics = metrics if metrics is not None else getSharedMetrics()
+        self.url = url
+        self.cachePath = Path(cachePath) if cachePath else None
+        self.refreshMargin = refreshMargin
+        self.plans = {}
+        self.normalized = {}
+        self.payloads = {}
+        self.inFlight = {}
+        self.fileStamp = None
+        self._load()
+
+    def _getFileStamp(self) -> tuple:
+        '''Get (mtime, size) of the cache file, None if it does not exist.'''
+        try:
+            stat = self.cachePath.stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _readFile(self) -> dict:
+        '''Read plans that are still valid from disk.'''
+        try:
+            with open(self.cachePath, 'r', encoding='utf-8') as jsonFile:
+                stored = json.load(jsonFile)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            print(f'Suunnitelmavälimuistia {self.cachePath} ei voitu lukea, virhe: {err}')
+            return {}
+        nowMillis = int(time.time() * 1000)
+        return {key: plan for key, plan in stored.items()
+                if plan.get('EpochMsExpiration', 0) > nowMillis}
+
+    def _merge(self, stored: dict) -> None:
+        '''Take plans of the file into use where they are newer than the ones in memory.'''
+        for key, plan in stored.items():
+            current = self.plans.get(key)
+            if current is None or current['EpochMsExpiration'] < plan['EpochMsExpiration']:
+                self.plans[key] = plan
+                self.normalized[key] = HeatingPlan.fromResponse(plan)
+
+    def _load(self) -> None:
+        '''Load plans that are still valid from disk.'''
+        if not self.cachePath:
+            return
+        self.fileStamp = self._getFileStamp()
+        if self.fileStamp is not None:
+            self._merge(self._readFile())
+
+    def _reloadIfChanged(self) -> None:
+        '''Read plans written by other processes since the previous read.'''
+        if self.cachePath and self._getFileStamp() != self.fileStamp:
+            self._load()
+
+    def _save(self) -> None:
+        '''Merge plans with the file and write it atomically under a lock.'''
+        if not self.cachePath:
+            return
+        try:
+            self.cachePath.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cachePath.with_suffix('.lock'), 'a', encoding='utf-8') as lockFile:
+                if fcntl is not None:
+                    fcntl.flock(lockFile, fcntl.LOCK_EX)
+                self._merge(self._readFile())
+                tmpPath = self.cachePath.with_suffix(f'.{os.getpid()}.tmp')
+                with open(tmpPath, 'w', encoding='utf-8') as jsonFile:
+                    json.dump(self.plans, jsonFile)
+                os.replace(tmpPath, self.cachePath)
+                self.fileStamp = self._getFileStamp()
+        except OSError as err:
+            print(f'Suunnitelmavälimuistia {self.cachePath} ei voitu tallentaa, virhe: {err}')
+
+    def _getValidPlan(self, key: str, timeMillis: int) -> HeatingPlan:
+        '''Get cached plan if it has not expired.'''
+        plan = self.normalized.get(key)
+        if plan and plan.expiration > timeMillis:
+            return plan
+        return None
+
+    def _needsRefresh(self, key: str, timeMillis: int) -> bool:
+        '''Check if cached plan is missing or about to expire.'''
+        plan = self.normalized.get(key)
+        if not plan:
+            return True
+        return plan.expiration - self.refreshMargin * 1000 <= timeMillis
+
+    def _storeResponse(self, key: str, response: httpx.Response) -> bool:
+        '''Store plan from api-spot-hinta.fi response. Returns True if plan was stored.
+        Malformed response is not stored, so the caller can fall back to local plans.'''
+        if response.status_code != 200:
+            print(f'Saatiin koodi {response.status_code}. Päättele siitä.')
+            return False
+        try:
+            responseJson = response.json()
+            plan = HeatingPlan.fromResponse(responseJson)
+        except (ValueError, KeyError, TypeError) as err:
+            print(f'api-spot-hinta.fi palautti virheellisen suunnitelman, virhe: {err!r}')
+            return False
+        self.normalized[key] = plan
+        self.plans[key] = responseJson
+        self._save()
+        if key in self.payloads:
+            self.localPlanner.setTemperature(self.payloads[key].get('Region'),
+                                             plan.averageTemperature)
+        expiration = _formatEpoch(plan.expiration)
+        print(f'Saatiin uusi suunnitelma, voimasssa {expiration} asti.\n' \
+              f'Vuorokauden keskilämpötila {plan.averageTemperature} C.')
+        return True
+
+    def _applyLocalPlans(self, timestamp: float) -> None:
+        '''Compute plans locally for every known payload whose plan is missing or about to
+        expire. Local plans are kept only in memory, so the API is asked again later.'''
+        timeMillis = int(timestamp * 1000)
+        missing = {key: payload for key, payload in self.payloads.items()
+                   if self._needsRefresh(key, timeMillis)}
+        responses = self.localPlanner.computeResponses(missing, timestamp)
+        for key, responseJson in responses.items():
+            self.normalized[key] = HeatingPlan.fromResponse(responseJson)
+        if responses:
+            self.metrics.localPlans.inc(amount=len(responses))
+            print(f'Laskettiin {len(responses)} suunnitelmaa paikallisesti välimuistissa ' \
+                  'olevista hinnoista.')
+
+    def restorePlan(self, payload: dict, plan: HeatingPlan) -> None:
+        '''Take plan restored from the state journal into use unless a later one is cached.'''
+        key = getPayloadKey(payload)
+        self.payloads[key] = payload
+        current = self.normalized.get(key)
+        if current is None or current.expiration < plan.expiration:
+            self.normalized[key] = plan
+
+    async def _fetchAsync(self, key: str, payload: dict, timestamp: float) -> None:
+        '''Fetch plan for payload and store it. Falls back to local plans on failure.'''
+        async def post() -> httpx.Response:
+            return await self.clients.getAsyncClient(SPOT_HINTA).post(self.url, json=payload)
+        stored = False
+        start = time.perf_counter()
+        try:
+            response = await self.retries.runAsync(SPOT_HINTA, post, 'api-spot-hinta.fi',
+                                                   hostKey=httpx.URL(self.url).host)
+            stored = self._storeResponse(key, response)
+        except (httpx.RequestError, httpx.HTTPStatusError) as err:
+            print(f'api-spot-hinta.fi ei vastannut, virhe: {err}')
+        self.metrics.phaseSeconds.observe(time.perf_counter() - start, PLAN_FETCH)
+        if not stored:
+            self._applyLocalPlans(timestamp)
+
+    async def getPlanAsync(self, payload: dict, timestamp: float = None) -> HeatingPlan:
+        '''Get plan for payload without blocking the event loop. Requests that are
+        already in flight for the same payload are shared.'''
+        if timestamp is None:
+            timestamp = time.time()
+        timeMillis = int(timestamp * 1000)
+        key = getPayloadKey(payload)
+        self.payloads[key] = payload
+        if self._needsRefresh(key, timeMillis) and key not in self.inFlight:
+            self._reloadIfChanged()
+        if not self._needsRefresh(key, timeMillis):
+            self.metrics.planLookups.inc(HIT)
+        else:
+            task = self.inFlight.get(key)
+            if task is None:
+                self.metrics.planLookups.inc(MISS)
+                task = asyncio.ensure_future(self._fetchAsync(key, payload, timestamp))
+                self.inFlight[key] = task
+                task.add_done_callback(lambda _: self.inFlight.pop(key, None))
+            else:
+                self.metrics.planLookups.inc(SHARED)
+            # Shield so that a device hitting its deadline does not cancel the shared fetch
+            await asyncio.shield(task)
+        return self._getValidPlan(key, timeMillis)
+
+_SHARED_CACHE = None
+
+def getSharedPlanCache() -> PlanCache:
+    '''Get process-wide plan cache.'''
+    global _SHARED_CACHE # pylint: disable=global-statement
+    if _SHARED_CACHE is None:
+        _SHARED_CACHE = PlanCache()
+    return _SHARED_CACHE
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+'''Module for unit test for Home Assistant bulk and websocket state modes.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s apis/tests -p "testHomeAssistant.py"
+'''
+
+import asyncio
+import dataclasses
+import os
+import unittest
+from unittest.mock import MagicMock, patch
+
+from apis.homeassistant import HomeAssistantClient, HomeAssistantStateMirror # pylint: disable=import-error
+from apis.httpclients import ClientPool # pylint: disable=import-error
+from devices.config import loadDeviceConfig # pylint: disable=import-error
+from devices.heatpump import HeatPump # pylint: disable=import-error
+from fakes.homeassistant import FakeHomeAssistant # pylint: disable=import-error
+
+ENTITIES = [f'climate.room_{index}' for index in range(12)]
+
+class TestHomeAssistantStateModes(unittest.IsolatedAsyncioTestCase):
+    '''Unit tests for bulk and websocket state modes.'''
+
+    def setUp(self):
+        self.fake = FakeHomeAssistant().start()
+        for entityId in ENTITIES:
+            self.fake.addClimate(entityId, temperature=19.0)
+        self.clients = ClientPool()
+
+    async def asyncTearDown(self):
+        await self.clients.closeAsync()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def _createHeatPumps(self, mode: str) -> list[HeatPump]:
+        '''Create heat pumps that share one state mirror.'''
+        config = loadDeviceConfig('devices/tests/test_config.json')
+        environment = {'HA_URL': self.fake.baseUrl, 'HA_TOKEN': self.fake.token,
+                       'HA_STATE_MODE': mode}
+        heatPumps = []
+        with patch.dict(os.environ, environment), \
+                patch('devices.heatpump.getSharedStateMirror') as mockShared:
+            client = HomeAssistantClient(self.fake.baseUrl, self.fake.token, self.clients)
+            mirror = HomeAssistantStateMirror(client, useWebsocket=mode == 'websocket',
+                                              websocketUrl=self.fake.websocketUrl)
+            mockShared.return_value = mirror
+            for entityId in ENTITIES:
+                heatPumps.append(HeatPump('test', dataclasses.replace(config, ip=entityId),
+                                          clients=self.clients, history=MagicMock()))
+        return heatPumps
+
+    @patch('builtins.print')
+    async def testBulkModeUsesOneRequest(self, _mockPrint):
+        '''Statuses of all heat pumps come from one /api/states request and writes of the
+        same temperature are combined into one service call.'''
+        heatPumps = self._createHeatPumps('bulk')
+        statuses = await asyncio.gather(*(pump.getCurrentStatusAsync() for pump in heatPumps))
+        self.assertTrue(all(status['attributes']['temperature'] == 19.0 for status in statuses))
+        results = await asyncio.gather(*(pump.adjustTempSetpointAsync(status, True)
+                                         for pump, status in zip(heatPumps, statuses)))
+        self.assertTrue(all(results))
+        self.assertEqual(self.fake.requests[('GET', '/api/states')], 1)
+        self.assertEqual(self.fake.requests[('GET', '/api/states/<entity_id>')], 0)
+        self.assertEqual(self.fake.requests[('POST', '/api/services/climate/set_temperature')], 1)
+        self.assertEqual(self.fake.states[ENTITIES[0]]['attributes']['temperature'], 22.0)
+
+    @patch('builtins.print')
+    async def testWebsocketModeMirrorsState(self, _mockPrint):
+        '''After subscription reads need no requests and out-of-band changes are mirrored.'''
+        heatPumps = self._createHeatPumps('websocket')
+        await heatPumps[0].getCurrentStatusAsync()
+        mirror = heatPumps[0].mirror
+        for _ in range(100):
+            if mirror.subscribed:
+                break
+            await asyncio.sleep(0.02)
+        self.assertTrue(mirror.subscribed)
+        restRequests = sum(self.fake.requests.values())
+
+        self.fake.setAttributes(ENTITIES[3], temperature=25.0)
+        for _ in range(100):
+            if mirror.states[ENTITIES[3]]['attributes']['temperature'] == 25.0:
+                break
+            await asyncio.sleep(0.02)
+        statuses = await asyncio.gather(*(pump.getCurrentStatusAsync() for pump in heatPumps))
+        self.assertEqual(statuses[3]['attributes']['temperature'], 25.0)
+        self.assertEqual(sum(self.fake.requests.values()), restRequests)
+        mirror.subscriptionTask.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await mirror.subscriptionTask
+
+    @patch('builtins.print')
+    async def testSubscriptionSurvivesUnexpectedError(self, mockPrint):
+        '''Unexpected error is reported and the subscription is connected again.'''
+        client = HomeAssistantClient(self.fake.baseUrl, self.fake.token, self.clients)
+        mirror = HomeAssistantStateMirror(client, useWebsocket=True, reconnectDelay=0.0)
+        calls = []
+
+        async def subscribeOnce():
+            calls.append(mirror.subscribed)
+            mirror.subscribed = True
+            if len(calls) == 1:
+                raise KeyError('event')
+            await asyncio.Event().wait()
+
+        with patch.object(mirror, '_subscribeOnce', subscribeOnce):
+            # pylint: disable-next=protected-access
+            task = asyncio.ensure_future(mirror._runSubscription())
+            for _ in range(100):
+                if len(calls) == 2:
+                    break
+                await asyncio.sleep(0.01)
+            task.cancel()
+        self.assertEqual(calls, [False, False])
+        self.assertIn("KeyError('event')", mockPrint.call_args.args[0])
+
+if __name__ == '__main__':
+    unittest.main()
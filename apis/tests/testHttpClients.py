@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+'''Module for unit test for ClientPool class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s apis/tests -p "testHttpClients.py"
+'''
+
+import asyncio
+import unittest
+
+from apis.httpclients import DEVICE, SPOT_HINTA, ClientPool # pylint: disable=import-error
+from devices.thermostat import Thermostat # pylint: disable=import-error
+
+class TestClientPool(unittest.TestCase):
+    '''Unit tests for ClientPool class.'''
+
+    def setUp(self):
+        self.pool = ClientPool()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def testClientsAreShared(self):
+        '''Same host class gets same client and devices share the pool.'''
+        self.assertIs(self.pool.getClient(DEVICE), self.pool.getClient(DEVICE))
+        self.assertIsNot(self.pool.getClient(DEVICE), self.pool.getClient(SPOT_HINTA))
+        first = Thermostat("devices/tests/test_config.json", clients=self.pool)
+        second = Thermostat("devices/tests/test_config.json", clients=self.pool)
+        self.assertIs(first.clients.getClient(DEVICE), second.clients.getClient(DEVICE))
+
+    def testConfigureRecreatesClient(self):
+        '''Changed timeout is taken into use.'''
+        client = self.pool.getClient(DEVICE)
+        self.pool.configure(DEVICE, timeout=3.0)
+        newClient = self.pool.getClient(DEVICE)
+        self.assertIsNot(client, newClient)
+        self.assertEqual(newClient.timeout.read, 3.0)
+
+    def testAsyncClientPerEventLoop(self):
+        '''Async client is reused within a loop and recreated for a new loop.'''
+        async def getClients():
+            return self.pool.getAsyncClient(DEVICE), self.pool.getAsyncClient(DEVICE)
+        first, second = asyncio.run(getClients())
+        third, _ = asyncio.run(getClients())
+        self.assertIs(first, second)
+        self.assertIsNot(first, third)
+
+    def testConfigureClosesAsyncClient(self):
+        '''Replaced async client is closed in its loop, at once or in closeAsync.'''
+        async def reconfigure():
+            client = self.pool.getAsyncClient(DEVICE)
+            self.pool.configure(DEVICE, timeout=3.0)
+            await asyncio.sleep(0)
+            return client, self.pool.getAsyncClient(DEVICE)
+        async def reconfigureLater():
+            client = self.pool.getAsyncClient(SPOT_HINTA)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, lambda: self.pool.configure(SPOT_HINTA, timeout=3.0))
+            self.assertFalse(client.is_closed)
+            await self.pool.closeAsync()
+            return client
+        client, newClient = asyncio.run(reconfigure())
+        self.assertTrue(client.is_closed)
+        self.assertFalse(newClient.is_closed)
+        self.assertTrue(asyncio.run(reconfigureLater()).is_closed)
+        self.assertEqual(self.pool.retiredClients, [])
+
+if __name__ == '__main__':
+    unittest.main()
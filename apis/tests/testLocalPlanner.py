@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+'''Module for unit test for LocalPlanner class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s apis/tests -p "testLocalPlanner.py"
+'''
+
+import random
+import time
+import unittest
+from array import array
+from unittest.mock import patch
+
+import httpx
+
+from apis.httpclients import SPOT_HINTA # pylint: disable=import-error
+from apis.localplanner import (LocalPlanner, PriceSeries, # pylint: disable=import-error
+                               getHeatingPercentage)
+from apis.retry import RetryEngine, RetryPolicy # pylint: disable=import-error
+from apis.smartheating import PlanCache # pylint: disable=import-error
+
+SLOT = 900_000
+
+def makePayload(**changes) -> dict:
+    '''Create API payload with simple defaults.'''
+    payload = {
+        'Region': 'FI',
+        'HeatingSegments_PerDay': 4,
+        'MinimumHeatingTime': 0,
+        'HeatingPercentage_Plus30': 0,
+        'HeatingPercentage_Plus20': 10,
+        'HeatingPercentage_Plus10': 20,
+        'HeatingPercentage_Zero': 25,
+        'HeatingPercentage_Minus10': 50,
+        'HeatingPercentage_Minus20': 75,
+        'HeatingPercentage_Minus30': 100,
+        'NightHours': [22, 23, 0, 1, 2, 3, 4, 5, 6],
+        'PriceDifference': 0,
+        'HeatingReductionPrice': '1000',
+        'HeatingReductionPercentage': 50,
+        'PriceAlwaysAllowed': -100,
+        'Inverted': False,
+    }
+    payload.update(changes)
+    return payload
+
+class TestLocalPlanner(unittest.TestCase):
+    '''Unit tests for LocalPlanner class.'''
+
+    def setUp(self):
+        # One local day of slots, prices rising within every six hour segment
+        midnight = time.mktime(time.strptime('2025-01-15', '%Y-%m-%d'))
+        self.start = int(midnight * 1000)
+        self.now = midnight + 1
+        self.planner = LocalPlanner(validity=86400)
+        self.planner.setPrices('FI', PriceSeries(
+            array('q', (self.start + index * SLOT for index in range(96))),
+            array('d', (float(index % 24) for index in range(96)))))
+        self.planner.setTemperature('FI', 2.0)
+
+    def _getResults(self, payload: dict) -> list[bool]:
+        response = self.planner.computeResponse(payload, self.now)
+        return [item['result'] for item in response['PlanAhead']]
+
+    def testHeatingPercentageBand(self):
+        '''Nearest temperature band is used and temperatures are clamped.'''
+        payload = makePayload()
+        self.assertEqual(getHeatingPercentage(payload, 2.0), 25)
+        self.assertEqual(getHeatingPercentage(payload, -8.0), 50)
+        self.assertEqual(getHeatingPercentage(payload, -45.0), 100)
+
+    def testCheapestSlotsPerSegment(self):
+        '''Quarter of every segment, the six cheapest slots, heats.'''
+        results = self._getResults(makePayload())
+        self.assertEqual(len(results), 96)
+        self.assertEqual(results, ([True] * 6 + [False] * 18) * 4)
+
+    def testMinimumTimeReductionAndAlwaysAllowed(self):
+        '''Minimum heating time raises the count, expensive segments are reduced and
+        cheap slots always heat.'''
+        results = self._getResults(makePayload(MinimumHeatingTime=120))
+        self.assertEqual(results[:24], [True] * 8 + [False] * 16)
+        results = self._getResults(makePayload(HeatingReductionPrice='4.5'))
+        self.assertEqual(results[:24], [True] * 3 + [False] * 21)
+        results = self._getResults(makePayload(PriceAlwaysAllowed=9))
+        self.assertEqual(results[:24], [True] * 10 + [False] * 14)
+
+    def testNightPriceDifference(self):
+        '''Night hours are cheaper by PriceDifference when ranking.'''
+        results = self._getResults(makePayload(PriceDifference=-100))
+        # First segment is 00-06, all of it night: ranking unchanged. 18-24 has 22 and 23.
+        self.assertEqual(results[:24], [True] * 6 + [False] * 18)
+        self.assertEqual(results[72:], [False] * 16 + [True] * 6 + [False] * 2)
+
+    def testNoPricesReturnsNone(self):
+        '''Region without prices cannot be planned.'''
+        self.assertIsNone(self.planner.computeResponse(makePayload(Region='SE3'), self.now))
+
+    def testBatchIsFast(self):
+        '''Plans for hundreds of payloads take well under a millisecond each.'''
+        rng = random.Random(1)
+        payloads = {str(index): makePayload(HeatingPercentage_Zero=rng.randint(0, 100),
+                                            PriceDifference=rng.choice([0, -1.43]))
+                    for index in range(500)}
+        begin = time.perf_counter()
+        responses = self.planner.computeResponses(payloads, self.now)
+        elapsed = time.perf_counter() - begin
+        self.assertEqual(len(responses), 500)
+        self.assertLess(elapsed / 500, 0.001)
+
+class TestPlanCacheFallback(unittest.IsolatedAsyncioTestCase):
+    '''PlanCache uses local plans when api-spot-hinta.fi does not give a usable plan.'''
+
+    def setUp(self):
+        self.now = time.time()
+        self.start = int(self.now * 1000) // SLOT * SLOT
+        self.planner = LocalPlanner()
+        self.planner.setPrices('FI', PriceSeries(
+            array('q', (self.start + index * SLOT for index in range(96))),
+            array('d', (float(index) for index in range(96)))))
+        self.retries = RetryEngine({SPOT_HINTA: RetryPolicy(attempts=1, baseDelay=0,
+                                                            maxDelay=0)})
+
+    @patch('builtins.print')
+    async def testFallbackToLocalPlan(self, _mockPrint):
+        '''Failed fetch gives a local plan instead of no plan.'''
+        cache = PlanCache(None, retries=self.retries, localPlanner=self.planner)
+        with patch('httpx.AsyncClient.post', side_effect=httpx.ConnectError('ei yhteyttä')):
+            plan = await cache.getPlanAsync(makePayload(), self.now)
+        self.assertIsNotNone(plan)
+        self.assertEqual(plan.expiration, int(self.now * 1000) + 3600_000)
+        self.assertEqual(cache.plans, {})
+
+    @patch('builtins.print')
+    async def testFallbackOnMalformedResponse(self, _mockPrint):
+        '''Malformed 200 response gives a local plan instead of an exception.'''
+        for response in (httpx.Response(200, text='<html>huolto</html>'),
+                         httpx.Response(200, json={'PlanAhead': None}),
+                         httpx.Response(200, json={'PlanAhead': [{'epochMs': self.start}]})):
+            with self.subTest(body=response.text):
+                cache = PlanCache(None, retries=self.retries, localPlanner=self.planner)
+                with patch('httpx.AsyncClient.post', return_value=response):
+                    plan = await cache.getPlanAsync(makePayload(), self.now)
+                self.assertIsNotNone(plan)
+                self.assertEqual(plan.expiration, int(self.now * 1000) + 3600_000)
+                self.assertEqual(cache.plans, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+'''Module for unit test for PlanCache class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s apis/tests -p "testPlanCache.py"
+'''
+
+import asyncio
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+from apis.smartheating import HeatingPlan, PlanCache, getPayloadKey # pylint: disable=import-error
+
+def makeResponse(expiration: int) -> MagicMock:
+    '''Create fake api-spot-hinta.fi response.'''
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {
+        'PlanAhead': [{'epochMs': expiration - 3600_000, 'result': True}],
+        'EpochMsExpiration': expiration,
+        'AverageTemperature': -5.0
+    }
+    return response
+
+class TestPlanCache(unittest.IsolatedAsyncioTestCase):
+    '''Unit tests for PlanCache class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.cachePath = Path(self.tmpDir.name) / 'plans.json'
+        self.expiration = int(time.time() * 1000) + 3600_000
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def testPayloadKeyIsCanonical(self):
+        '''Key does not depend on field order.'''
+        self.assertEqual(getPayloadKey({'a': 1, 'b': [1, 2]}),
+                         getPayloadKey({'b': [1, 2], 'a': 1}))
+        self.assertNotEqual(getPayloadKey({'a': 1}), getPayloadKey({'a': 2}))
+
+    @patch('builtins.print')
+    async def testConcurrentRequestsAreCoalesced(self, _mockPrint):
+        '''Many devices with same parameters cause only one API call.'''
+        cache = PlanCache(self.cachePath)
+
+        async def slowPost(*_args, **_kwargs):
+            await asyncio.sleep(0.05)
+            return makeResponse(self.expiration)
+
+        with patch('httpx.AsyncClient.post', side_effect=slowPost) as mockPost:
+            plans = await asyncio.gather(*(cache.getPlanAsync({'Region': 'FI'})
+                                           for _ in range(10)))
+            await cache.getPlanAsync({'Region': 'FI'})
+        self.assertEqual(mockPost.call_count, 1)
+        self.assertTrue(all(plan.expiration == self.expiration for plan in plans))
+
+    @patch('builtins.print')
+    async def testPlansSurviveRestart(self, _mockPrint):
+        '''Plan stored on disk is used by a new cache without API call.'''
+        with patch('httpx.AsyncClient.post', return_value=makeResponse(self.expiration)):
+            await PlanCache(self.cachePath).getPlanAsync({'Region': 'FI'})
+        with patch('httpx.AsyncClient.post') as mockPost:
+            plan = await PlanCache(self.cachePath).getPlanAsync({'Region': 'FI'})
+        mockPost.assert_not_called()
+        self.assertEqual(plan.expiration, self.expiration)
+
+    @patch('builtins.print')
+    async def testCacheFileIsSharedBetweenProcesses(self, _mockPrint):
+        '''Plan fetched by another process is read from the file and both plans are kept.'''
+        first = PlanCache(self.cachePath)
+        second = PlanCache(self.cachePath)
+        with patch('httpx.AsyncClient.post', return_value=makeResponse(self.expiration)):
+            await first.getPlanAsync({'Region': 'FI'})
+            await second.getPlanAsync({'Region': 'SE1'})
+        with patch('httpx.AsyncClient.post') as mockPost:
+            plan = await second.getPlanAsync({'Region': 'FI'})
+        mockPost.assert_not_called()
+        self.assertEqual(plan.expiration, self.expiration)
+        self.assertEqual(len(PlanCache(self.cachePath).plans), 2)
+
+    @patch('builtins.print')
+    async def testRefreshBeforeExpiration(self, _mockPrint):
+        '''Plan is refreshed when it is within the refresh margin of expiring.'''
+        cache = PlanCache(self.cachePath, refreshMargin=7200)
+        with patch('httpx.AsyncClient.post',
+                   return_value=makeResponse(self.expiration)) as mockPost:
+            await cache.getPlanAsync({'Region': 'FI'})
+            await cache.getPlanAsync({'Region': 'FI'})
+        self.assertEqual(mockPost.call_count, 2)
+
+class TestHeatingPlan(unittest.TestCase):
+    '''Unit tests for HeatingPlan class.'''
+
+    def setUp(self):
+        # Slots every 15 minutes in reverse order: off, off, on, on, off
+        slot = 900_000
+        results = [False, False, True, True, False]
+        self.start = 1_700_000_000_000
+        self.slot = slot
+        self.plan = HeatingPlan.fromResponse({
+            'PlanAhead': [{'epochMs': self.start + index * slot, 'result': result}
+                          for index, result in reversed(list(enumerate(results)))],
+            'EpochMsExpiration': self.start + 5 * slot,
+            'AverageTemperature': 0.0
+        })
+
+    def testLookupIsOrderIndependent(self):
+        '''Active slot is the latest slot that started before given time.'''
+        self.assertIsNone(self.plan.getDemand(self.start))
+        self.assertFalse(self.plan.getDemand(self.start + 1))
+        self.assertTrue(self.plan.getDemand(self.start + 2 * self.slot + 1))
+        self.assertTrue(self.plan.getDemand(self.start + 4 * self.slot))
+        self.assertFalse(self.plan.getDemand(self.start + 4 * self.slot + 1))
+        self.assertIsNone(self.plan.getDemand(self.start + 5 * self.slot + 1))
+
+    def testNextChange(self):
+        '''Next change skips slots with the same result.'''
+        self.assertEqual(self.plan.getNextChange(self.start + 1), self.start + 2 * self.slot)
+        self.assertEqual(self.plan.getNextChange(self.start + 2 * self.slot + 1),
+                         self.start + 4 * self.slot)
+        self.assertEqual(self.plan.getNextChange(self.start + 4 * self.slot + 1),
+                         self.start + 5 * self.slot)
+        self.assertEqual(self.plan.getNextChange(self.start - 10), self.start)
+
+if __name__ == '__main__':
+    unittest.main()
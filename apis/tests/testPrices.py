@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+'''Module for unit test for SeriesUpdater class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s apis/tests -p "testPrices.py"
+'''
+
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import httpx
+
+from apis.localplanner import LocalPlanner # pylint: disable=import-error
+from apis.prices import SeriesUpdater, parsePrices # pylint: disable=import-error
+from storage.series import SeriesStore # pylint: disable=import-error
+
+class TestSeriesUpdater(unittest.IsolatedAsyncioTestCase):
+    '''Unit tests for SeriesUpdater class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.store = SeriesStore(Path(self.tmpDir.name))
+        self.planner = LocalPlanner()
+        self.updater = SeriesUpdater(self.store, self.planner)
+        self.now = time.time()
+        self.hourStart = int(self.now) // 3600 * 3600
+
+    def tearDown(self):
+        self.planner.series.clear()
+        self.store.views.clear()
+        self.tmpDir.cleanup()
+
+    def _respond(self, url, params=None):
+        '''Answer price and forecast requests for the next two days.'''
+        request = httpx.Request('GET', url, params=params)
+        if 'spot-hinta' in str(url):
+            body = [{'DateTime': time.strftime('%Y-%m-%dT%H:%M:%S+00:00',
+                                               time.gmtime(self.hourStart + hour * 3600)),
+                     'PriceWithTax': hour / 100} for hour in range(48)]
+        else:
+            body = {'hourly': {'time': [self.hourStart + hour * 3600 for hour in range(48)],
+                               'temperature_2m': [-4.0] * 48}}
+        return httpx.Response(200, json=body, request=request)
+
+    def testHourlyPricesAreSpreadToQuarters(self):
+        '''Hourly price covers four quarter hour slots, the last one like the previous.'''
+        points = parsePrices([{'DateTime': '2025-01-15T00:00:00+00:00', 'PriceWithTax': 0.05},
+                              {'DateTime': '2025-01-15T01:00:00+00:00', 'PriceWithTax': 0.1}])
+        self.assertEqual(len(points), 8)
+        self.assertEqual(sorted(set(points.values())), [5.0, 10.0])
+
+    @patch('builtins.print')
+    async def testFetchOncePerRegionAndFeedPlanner(self, _mockPrint):
+        '''Series are fetched once and given to the planner. Next refresh uses the store.'''
+        regions = {'FI': ('60.0', '24.0')}
+        with patch('httpx.AsyncClient.get', side_effect=self._respond) as mockGet:
+            await self.updater.refreshAsync(regions, self.now)
+            await self.updater.refreshAsync(regions, self.now + 60)
+        self.assertEqual(mockGet.call_count, 2)
+        self.assertEqual(len(self.planner.series['FI'].prices), 192)
+        self.assertEqual(self.planner.temperatures['FI'], -4.0)
+        # A restart reads the stored series without fetching
+        updater = SeriesUpdater(SeriesStore(Path(self.tmpDir.name)), LocalPlanner())
+        with patch('httpx.AsyncClient.get', side_effect=self._respond) as mockGet:
+            await updater.refreshAsync(regions, self.now)
+        mockGet.assert_not_called()
+        updater.store.views.clear()
+        updater.planner.series.clear()
+
+if __name__ == '__main__':
+    unittest.main()
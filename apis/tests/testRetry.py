@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+'''Module for unit test for RetryEngine and CircuitBreaker classes.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s apis/tests -p "testRetry.py"
+'''
+
+import asyncio
+import random
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from apis.httpclients import DEVICE # pylint: disable=import-error
+from apis.retry import (CircuitBreaker, CircuitOpenError, RetryEngine, # pylint: disable=import-error
+                        RetryPolicy)
+
+class FakeClock:
+    '''Manually advanced monotonic clock.'''
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class TestCircuitBreaker(unittest.TestCase):
+    '''Unit tests for CircuitBreaker class.'''
+
+    def testOpensAndProbesWithGrowingDelay(self):
+        '''Breaker opens at threshold, lets one probe through and slows down after failures.'''
+        clock = FakeClock()
+        breaker = CircuitBreaker(failureThreshold=2, openDelay=60, maxOpenDelay=200, clock=clock)
+        breaker.recordFailure()
+        self.assertTrue(breaker.allow())
+        breaker.recordFailure()
+        self.assertFalse(breaker.allow())
+        clock.now = 60
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.recordFailure()
+        clock.now = 179
+        self.assertFalse(breaker.allow())
+        clock.now = 180
+        self.assertTrue(breaker.allow())
+        breaker.recordFailure()
+        self.assertEqual(breaker.currentOpenDelay, 200)
+        clock.now = 380
+        self.assertTrue(breaker.allow())
+        breaker.recordSuccess()
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.currentOpenDelay, 60)
+
+class TestRetryEngine(unittest.IsolatedAsyncioTestCase):
+    '''Unit tests for RetryEngine class.'''
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.engine = RetryEngine({DEVICE: RetryPolicy(attempts=3, baseDelay=0.01, maxDelay=0.02)},
+                                  failureThreshold=3, hostFailureThreshold=5, clock=self.clock,
+                                  rng=random.Random(1))
+        self.calls = 0
+
+    def _getOperation(self, failures: int):
+        '''Get operation that fails given number of times before succeeding.'''
+        async def operation() -> str:
+            self.calls += 1
+            if self.calls <= failures:
+                raise httpx.ConnectError('ei yhteyttä')
+            return 'ok'
+        return operation
+
+    @patch('builtins.print')
+    async def testRetriesUntilSuccess(self, _mockPrint):
+        '''Failed attempts are retried and success resets the breaker.'''
+        result = await self.engine.runAsync(DEVICE, self._getOperation(2), 'Laite', 'a', 'host')
+        self.assertEqual((result, self.calls), ('ok', 3))
+        self.assertEqual(self.engine.getBreaker('device:a').failures, 0)
+
+    @patch('builtins.print')
+    async def testOpenBreakerSkipsRequests(self, _mockPrint):
+        '''Offline device is not contacted again until the open delay has passed,
+        and then it is probed with a single attempt.'''
+        with self.assertRaises(httpx.ConnectError):
+            await self.engine.runAsync(DEVICE, self._getOperation(100), 'Laite', 'a', 'host')
+        self.assertEqual(self.calls, 3)
+        with self.assertRaises(CircuitOpenError):
+            await self.engine.runAsync(DEVICE, self._getOperation(100), 'Laite', 'a', 'host')
+        self.assertEqual(self.calls, 3)
+        self.clock.now = 60
+        with self.assertRaises(httpx.ConnectError):
+            await self.engine.runAsync(DEVICE, self._getOperation(100), 'Laite', 'a', 'host')
+        self.assertEqual(self.calls, 4)
+        # Other device behind the same host is still tried
+        result = await self.engine.runAsync(DEVICE, self._getOperation(0), 'Laite', 'b', 'host')
+        self.assertEqual(result, 'ok')
+
+    async def testCancelledProbeIsReleased(self):
+        '''Probe cancelled by a deadline does not leave the breaker stuck.'''
+        breaker = self.engine.getBreaker('device:a')
+        breaker.openUntil = 0.0
+
+        async def hang() -> None:
+            await asyncio.sleep(10)
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.engine.runAsync(DEVICE, hang, 'Laite', 'a'), 0.05)
+        self.assertFalse(breaker.probing)
+        self.assertTrue(breaker.allow())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+'''Module for control loop benchmark. Runs the control engine against local fake HeatIt
+devices, Home Assistant and SmartHeating servers and reports tick latency percentiles,
+requests per tick, CPU time and memory for growing device counts.
+Run with command in the main directory of the project:
+python3 -m benchmarks.benchmark --devices 1 10 100 500
+'''
+
+import argparse
+import asyncio
+import contextlib
+import json
+import math
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from apis.httpclients import DEVICE, HOME_ASSISTANT, ClientPool # pylint: disable=import-error
+from apis.retry import RetryEngine # pylint: disable=import-error
+from apis.smartheating import PlanCache # pylint: disable=import-error
+from control.engine import DEVICE_DEADLINE, SLOT_SECONDS, ControlEngine # pylint: disable=import-error
+from devices.config import parseDeviceConfig # pylint: disable=import-error
+from devices.device import Device # pylint: disable=import-error
+from devices.registry import getSharedDriverRegistry # pylint: disable=import-error
+from fakes.heatit import FakeHeatItServer # pylint: disable=import-error
+from fakes.homeassistant import FakeHomeAssistant # pylint: disable=import-error
+from fakes.server import FaultProfile # pylint: disable=import-error
+from fakes.smartheating import FakeSmartHeating # pylint: disable=import-error
+from storage.history import HistoryStore # pylint: disable=import-error
+
+API_TEMPLATE = {
+    'Region': 'FI',
+    'RelayName': 'benchmark',
+    'RelayNumbers': [0],
+    'Inverted': False,
+    'PostalCode': '02210',
+    'Latitude': '60.000',
+    'Longitude': '24.000',
+    'HeatingSegments_PerDay': 4,
+    'MinimumHeatingTime': 30,
+    'HeatingPercentage_Plus30': 0,
+    'HeatingPercentage_Plus20': 10,
+    'HeatingPercentage_Plus10': 20,
+    'HeatingPercentage_Zero': 40,
+    'HeatingPercentage_Minus10': 60,
+    'HeatingPercentage_Minus20': 80,
+    'HeatingPercentage_Minus30': 80,
+    'HeatingReductionPrice': '15.0',
+    'HeatingReductionPercentage': 50,
+    'NightHours': [22, 23, 0, 1, 2, 3, 4, 5, 6],
+    'PriceDifference': -1.43,
+    'PriceDifference_Months': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12],
+    'PriceDifference_Days': [1, 2, 3, 4, 5, 6, 7],
+    'PriceAlwaysAllowed': 1,
+    'BackupHours': [0, 1, 2, 3, 4, 5, 6, 21, 22, 23],
+}
+
+def getPercentile(values: list[float], percentile: float) -> float:
+    '''Get nearest-rank percentile of values. Returns NaN for empty list.'''
+    if not values:
+        return math.nan
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percentile / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+class Fakes:
+    '''Fake servers used by one benchmark run.'''
+
+    def __init__(self, faults: FaultProfile, seed: int = 0) -> None:
+        self.heatIt = FakeHeatItServer(faults, seed)
+        self.homeAssistant = FakeHomeAssistant(faults=faults, seed=seed)
+        self.smartHeating = FakeSmartHeating(seed=seed)
+
+    def start(self) -> 'Fakes':
+        '''Start all servers.'''
+        self.heatIt.start()
+        self.homeAssistant.start()
+        self.smartHeating.start()
+        return self
+
+    def stop(self) -> None:
+        '''Stop all servers.'''
+        self.heatIt.stop()
+        self.homeAssistant.stop()
+        self.smartHeating.stop()
+
+    def getRequestCount(self) -> int:
+        '''Get number of requests served by all servers.'''
+        heatIt = self.heatIt.requests['GET'] + self.heatIt.requests['POST']
+        homeAssistant = sum(count for (method, _), count
+                            in list(self.homeAssistant.requests.items())
+                            if method in ('GET', 'POST', 'WS'))
+        return heatIt + homeAssistant + self.smartHeating.requests['plan']
+
+def createDevices(fakes: Fakes, count: int, workDir: Path, heatPumpShare: float,
+                  distinctPlans: int, planCache: PlanCache, clients: ClientPool,
+                  history: HistoryStore, retries: RetryEngine) -> list[Device]:
+    '''Create devices that point to the fake servers.'''
+    devices = []
+    heatPumps = round(count * heatPumpShare)
+    for index in range(count):
+        if index < heatPumps:
+            deviceType, ip = 'heatpump', f'climate.benchmark_{index}'
+            fakes.homeAssistant.addClimate(ip, temperature=18.0, currentTemperature=21.0)
+        else:
+            deviceType = 'thermostat' if index % 2 == 0 else 'panel'
+            ip = fakes.heatIt.getDeviceIp(f'dev{index}')
+        api = dict(API_TEMPLATE, RelayName=f'benchmark{index % max(1, distinctPlans)}')
+        path = workDir / f'dev{index}.json'
+        config = parseDeviceConfig([{'tempLow': 18.0, 'tempHigh': 22.0,
+                                     'name': f'dev{index}', 'type': deviceType,
+                                     'sensorMode': 2, 'ip': ip}, api], path)
+        deviceClass = getSharedDriverRegistry().getDriver(deviceType)
+        devices.append(deviceClass(path, config, planCache, clients, history, retries))
+    return devices
+
+async def runTicks(engine: ControlEngine, fakes: Fakes, ticks: int, start: float) -> dict:
+    '''Run ticks one simulated quarter hour apart and measure each of them.'''
+    deviceLatencies = []
+    controlDevice = engine.controlDevice
+
+    async def timedControlDevice(target: Device, timestamp: float,
+                                 forceReadback: bool = False, heating: bool = None) -> bool:
+        begin = time.perf_counter()
+        try:
+            return await controlDevice(target, timestamp, forceReadback, heating)
+        finally:
+            deviceLatencies.append(time.perf_counter() - begin)
+
+    engine.controlDevice = timedControlDevice
+    measured = []
+    for tick in range(ticks):
+        deviceLatencies.clear()
+        requestsBefore = fakes.getRequestCount()
+        cpuBefore = time.thread_time()
+        begin = time.perf_counter()
+        results = await engine.runTick(start + tick * SLOT_SECONDS)
+        measured.append({
+            'latency': time.perf_counter() - begin,
+            'cpu': time.thread_time() - cpuBefore,
+            'requests': fakes.getRequestCount() - requestsBefore,
+            'failures': sum(not result for result in results.values()),
+            'deviceLatencies': list(deviceLatencies),
+        })
+    return measured
+
+async def _runAndClose(engine: ControlEngine, fakes: Fakes, ticks: int, start: float,
+                       clients: ClientPool) -> list[dict]:
+    '''Run ticks and close async clients in the same event loop.'''
+    try:
+        return await runTicks(engine, fakes, ticks, start)
+    finally:
+        await clients.closeAsync()
+
+def runBenchmark(deviceCount: int, ticks: int = 8, faults: FaultProfile = None,
+                 heatPumpShare: float = 0.1, distinctPlans: int = 4,
+                 readbackInterval: float = 3600.0, clientTimeout: float = 2.0,
+                 maxConcurrency: int = 32, deviceDeadline: float = DEVICE_DEADLINE,
+                 traceMemory: bool = False) -> dict:
+    '''Run benchmark for given number of devices. First tick is cold (plans are fetched and
+    every device is read), the others are steady state. Returns summary of the run.'''
+    faults = faults if faults is not None else FaultProfile()
+    fakes = Fakes(faults).start()
+    environment = {name: os.environ.get(name) for name in ('HA_URL', 'HA_TOKEN', 'HA_STATE_MODE')}
+    os.environ.update({'HA_URL': fakes.homeAssistant.baseUrl,
+                       'HA_TOKEN': fakes.homeAssistant.token,
+                       'HA_STATE_MODE': environment['HA_STATE_MODE'] or 'bulk'})
+    if traceMemory:
+        tracemalloc.start()
+    try:
+        with tempfile.TemporaryDirectory() as workDir, \
+                open(os.devnull, 'w', encoding='utf-8') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            clients = ClientPool()
+            for hostClass in (DEVICE, HOME_ASSISTANT):
+                clients.configure(hostClass, timeout=clientTimeout,
+                                  maxConnections=max(maxConcurrency, 16))
+            retries = RetryEngine()
+            planCache = PlanCache(cachePath=None, clients=clients,
+                                  url=fakes.smartHeating.url, retries=retries)
+            history = HistoryStore(Path(workDir) / 'history')
+            devices = createDevices(fakes, deviceCount, Path(workDir), heatPumpShare,
+                                    distinctPlans, planCache, clients, history, retries)
+            engine = ControlEngine(devices, maxConcurrency=maxConcurrency,
+                                   deviceDeadline=deviceDeadline,
+                                   readbackInterval=readbackInterval)
+            measured = asyncio.run(_runAndClose(engine, fakes, ticks, time.time(), clients))
+            clients.close()
+        peakMemory = tracemalloc.get_traced_memory()[1] if traceMemory else None
+    finally:
+        if traceMemory:
+            tracemalloc.stop()
+        for name, value in environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        fakes.stop()
+    warm = measured[1:] or measured
+    tickLatencies = [tick['latency'] for tick in warm]
+    deviceLatencies = [latency for tick in warm for latency in tick['deviceLatencies']]
+    return {
+        'devices': deviceCount,
+        'ticks': ticks,
+        'coldTick': measured[0]['latency'],
+        'coldRequests': measured[0]['requests'],
+        'tickP50': getPercentile(tickLatencies, 50),
+        'tickP95': getPercentile(tickLatencies, 95),
+        'tickP99': getPercentile(tickLatencies, 99),
+        'deviceP50': getPercentile(deviceLatencies, 50),
+        'deviceP99': getPercentile(deviceLatencies, 99),
+        'requestsPerTick': sum(tick['requests'] for tick in warm) / len(warm),
+        'cpuPerTick': sum(tick['cpu'] for tick in warm) / len(warm),
+        'failures': sum(tick['failures'] for tick in measured),
+        'maxRssKb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peakTracedBytes': peakMemory,
+    }
+
+def formatResult(result: dict) -> str:
+    '''Format one result as a table row.'''
+    traced = result['peakTracedBytes']
+    return (f'{result['devices']:>7} {result['coldTick'] * 1000:>9.1f} '
+            f'{result['tickP50'] * 1000:>9.1f} {result['tickP95'] * 1000:>9.1f} '
+            f'{result['tickP99'] * 1000:>9.1f} {result['deviceP50'] * 1000:>9.2f} '
+            f'{result['deviceP99'] * 1000:>9.2f} {result['coldRequests']:>8} '
+            f'{result['requestsPerTick']:>8.1f} {result['cpuPerTick'] * 1000:>9.1f} '
+            f'{result['maxRssKb'] / 1024:>8.1f} '
+            f'{'-' if traced is None else f'{traced / 1048576:.1f}':>8} {result['failures']:>6}')
+
+HEADER = (f'{'laitteet':>7} {'kylmä ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} '
+          f'{'lait p50':>9} {'lait p99':>9} {'kylmä rq':>8} {'rq/tick':>8} {'cpu ms':>9} '
+          f'{'rss MB':>8} {'heap MB':>8} {'virheet':>6}')
+
+def main() -> None:
+    '''Parse arguments, run benchmark for every device count and print results.'''
+    parser = argparse.ArgumentParser(description='Ohjaussilmukan suorituskykytesti')
+    parser.add_argument('--devices', type=int, nargs='+', default=[1, 10, 50, 100, 250, 500])
+    parser.add_argument('--ticks', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02,
+                        help='vastausviive sekunteina')
+    parser.add_argument('--jitter', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-delay', type=float, default=30.0)
+    parser.add_argument('--client-timeout', type=float, default=2.0)
+    parser.add_argument('--heatpump-share', type=float, default=0.1)
+    parser.add_argument('--distinct-plans', type=int, default=4)
+    parser.add_argument('--readback-interval', type=float, default=3600.0)
+    parser.add_argument('--max-concurrency', type=int, default=32)
+    parser.add_argument('--device-deadline', type=float, default=DEVICE_DEADLINE)
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='mittaa Python-keon huippu tracemallocilla (hidastaa)')
+    parser.add_argument('--json', type=Path, help='tallenna tulokset JSON-tiedostoon')
+    args = parser.parse_args()
+
+    faults = FaultProfile(latency=args.latency, jitter=args.jitter, errorRate=args.error_rate,
+                          timeoutRate=args.timeout_rate, timeoutDelay=args.timeout_delay)
+    print(HEADER)
+    results = []
+    for deviceCount in args.devices:
+        result = runBenchmark(deviceCount, args.ticks, faults, args.heatpump_share,
+                              args.distinct_plans, args.readback_interval,
+                              args.client_timeout, args.max_concurrency,
+                              args.device_deadline, args.trace_memory)
+        results.append(result)
+        print(formatResult(result), flush=True)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+'''Module for smoke test of the benchmark harness and the fake servers.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s benchmarks/tests -p "testBenchmark.py"
+'''
+
+import math
+import unittest
+
+from benchmarks.benchmark import getPercentile, runBenchmark # pylint: disable=import-error
+from fakes.server import FaultProfile # pylint: disable=import-error
+
+class TestBenchmark(unittest.TestCase):
+    '''Unit tests for benchmark harness.'''
+
+    def testGetPercentile(self):
+        '''Nearest-rank percentile.'''
+        values = [float(value) for value in range(1, 101)]
+        self.assertEqual(getPercentile(values, 50), 50.0)
+        self.assertEqual(getPercentile(values, 99), 99.0)
+        self.assertEqual(getPercentile([3.0], 95), 3.0)
+        self.assertTrue(math.isnan(getPercentile([], 50)))
+
+    def testSmallRun(self):
+        '''Cold tick reads every device and fetches each distinct plan once.'''
+        result = runBenchmark(4, ticks=2, heatPumpShare=0.25, distinctPlans=2)
+        self.assertEqual(result['failures'], 0)
+        # 3 HeatIt status reads, 1 bulk HA read, 2 plans and at least one setpoint write
+        self.assertGreaterEqual(result['coldRequests'], 7)
+        self.assertGreater(result['tickP50'], 0)
+
+    def testErrorsAreCounted(self):
+        '''Devices that always answer with an error fail every tick.'''
+        result = runBenchmark(2, ticks=2, faults=FaultProfile(errorRate=1.0), heatPumpShare=0)
+        self.assertEqual(result['failures'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
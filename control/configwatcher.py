@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+'''Module for hot reload of the configs directory. Changes are detected with inotify on
+Linux and by polling file stamps elsewhere, and only the added, removed or changed files
+are applied. Devices whose files did not change keep their objects, caches and schedule.'''
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+import time
+from pathlib import Path
+
+from control.scheduler import EventScheduler # pylint: disable=import-error
+from devices.config import ConfigError, loadDeviceConfig # pylint: disable=import-error
+
+DEFAULT_CONFIG_PATH = Path('configs')
+SKIPPED_FILES = ('default.json',)
+
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+    | IN_DELETE_SELF | IN_MODIFY
+EVENT_HEADER = struct.Struct('iIII')
+
+def scanConfigs(root: Path, accept=None) -> dict[Path, tuple]:
+    '''Get stamp (inode, mtime, size) of every configuration file under root. Optional
+    accept(path) selects the files of one shard.'''
+    stamps = {}
+    for path in Path(root).rglob('*.json'):
+        if path.name in SKIPPED_FILES or (accept is not None and not accept(path)):
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        stamps[path] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    return stamps
+
+class Inotify:
+    '''Minimal inotify binding with ctypes. Raises OSError where inotify is not available.'''
+
+    def __init__(self) -> None:
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify on saatavilla vain Linuxissa')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 epäonnistui')
+        self.watches = {}
+
+    def addWatch(self, directory: Path) -> None:
+        '''Watch directory and its subdirectories.'''
+        for path in [Path(directory), *(path for path in Path(directory).rglob('*')
+                                        if path.is_dir())]:
+            descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if descriptor < 0:
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch {path} epäonnistui')
+            self.watches[descriptor] = path
+
+    def readEvents(self) -> list[tuple[Path, int]]:
+        '''Read pending events. Returns changed paths with their event masks.'''
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            directory = self.watches.get(descriptor)
+            if directory is None:
+                continue
+            path = directory / os.fsdecode(name) if name else directory
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.addWatch(path)
+            events.append((path, mask))
+        return events
+
+    def close(self) -> None:
+        '''Close inotify descriptor.'''
+        os.close(self.fd)
+
+class ConfigWatcher:
+    '''Applies configuration changes to the running engine and scheduler.'''
+
+    def __init__(self, scheduler: EventScheduler, createDevice, root: Path = DEFAULT_CONFIG_PATH,
+                 pollInterval: float = 10.0, settleDelay: float = 0.5, accept=None) -> None:
+        self.scheduler = scheduler
+        self.createDevice = createDevice
+        self.root = Path(root)
+        self.pollInterval = pollInterval
+        self.settleDelay = settleDelay
+        self.accept = accept
+        self.stamps = scanConfigs(self.root, accept)
+        self.devices = {Path(device.configPath): device for device in scheduler.engine.devices}
+
+    def _getStamp(self, path: Path) -> tuple:
+        '''Get stamp of file, None if it does not exist.'''
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _removeDevice(self, path: Path) -> None:
+        '''Stop controlling device of removed file.'''
+        device = self.devices.pop(path, None)
+        if device is None:
+            return
+        self.scheduler.engine.devices.remove(device)
+        self.scheduler.removeDevice(device)
+        print(f'Konfiguraatio {path} poistettiin, laitetta {device.getName()} ei enää ohjata.')
+
+    def _addDevice(self, path: Path, now: float) -> None:
+        '''Create device for new file and control it right away.'''
+        try:
+            device = self.createDevice(path)
+        except ConfigError as err:
+            print(f'Uutta konfiguraatiota ei otettu käyttöön: {err}')
+            return
+        if device is None:
+            return
+        self.devices[path] = device
+        self.scheduler.engine.devices.append(device)
+        self.scheduler.addDevice(device, now)
+        print(f'Löytyi uusi konfiguraatio {path}, ohjataan laitetta {device.getName()}.')
+
+    def _updateDevice(self, path: Path, now: float) -> None:
+        '''Reload changed file into existing device. Changed device type needs a new object.'''
+        device = self.devices[path]
+        try:
+            config = loadDeviceConfig(path)
+        except ConfigError as err:
+            print(f'Muutettua konfiguraatiota ei otettu käyttöön: {err}')
+            return
+        if config.type != device.config.type:
+            self._removeDevice(path)
+            self._addDevice(path, now)
+            return
+        if device.reloadConfig(config):
+            # New limits or API parameters are applied on the next round
+            self.scheduler.addDevice(device, now)
+            print(f'Laitteen {device.getName()} konfiguraatio päivitettiin.')
+
+    def applyChanges(self, paths: set[Path], now: float) -> int:
+        '''Apply changes of given files. Returns number of files that changed.'''
+        changed = 0
+        for path in sorted(paths):
+            if path.suffix != '.json' or path.name in SKIPPED_FILES:
+                continue
+            # File that moved to another shard is handled like a removed one
+            stamp = self._getStamp(path) if self.accept is None or self.accept(path) else None
+            if stamp == self.stamps.get(path):
+                continue
+            changed += 1
+            if stamp is None:
+                self.stamps.pop(path, None)
+                self._removeDevice(path)
+            elif path in self.devices:
+                self.stamps[path] = stamp
+                self._updateDevice(path, now)
+            else:
+                self.stamps[path] = stamp
+                self._addDevice(path, now)
+        return changed
+
+    def pollOnce(self, now: float) -> int:
+        '''Compare file stamps with the previous scan and apply differences.'''
+        current = scanConfigs(self.root, self.accept)
+        paths = {path for path in current.keys() | self.stamps.keys()
+                 if current.get(path) != self.stamps.get(path)}
+        return self.applyChanges(paths, now)
+
+    async def _watchInotify(self, inotify: Inotify) -> None:
+        '''Apply changes reported by inotify, waiting for writes to settle.'''
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(inotify.fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                await asyncio.sleep(self.settleDelay)
+                ready.clear()
+                paths = set()
+                while events := inotify.readEvents():
+                    for path, mask in events:
+                        if mask & (IN_DELETE_SELF | IN_ISDIR):
+                            # Whole directory moved or removed, compare everything
+                            paths.update(self.stamps.keys()
+                                         | scanConfigs(self.root, self.accept).keys())
+                        else:
+                            paths.add(path)
+                self.applyChanges(paths, time.time())
+        finally:
+            loop.remove_reader(inotify.fd)
+            inotify.close()
+
+    async def _watchPolling(self) -> None:
+        '''Poll file stamps.'''
+        while True:
+            await asyncio.sleep(self.pollInterval)
+            self.pollOnce(time.time())
+
+    async def runForever(self) -> None:
+        '''Watch configs directory with inotify, or by polling if it is not available.'''
+        try:
+            inotify = Inotify()
+            inotify.addWatch(self.root)
+        except (OSError, AttributeError) as err:
+            print(f'inotify ei ole käytettävissä ({err}), konfiguraatioita tarkistetaan ' \
+                  f'{self.pollInterval} sekunnin välein.')
+            await self._watchPolling()
+            return
+        # Changes made between the startup scan and the watch are picked up by one poll
+        self.pollOnce(time.time())
+        await self._watchInotify(inotify)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+'''Module for asyncio control engine. Runs the status -> demand -> setpoint cycle
+for all devices concurrently so that one unreachable device does not delay the others.'''
+
+import asyncio
+import logging
+import time
+from dataclasses import asdict
+
+from apis.smartheating import HeatingPlan # pylint: disable=import-error
+from control.loadbalancer import BalanceEntry, LoadBalancer # pylint: disable=import-error
+from devices.device import Device # pylint: disable=import-error
+from devices.state import SetpointState # pylint: disable=import-error
+from metrics.registry import CONTROL, MetricsRegistry, getSharedMetrics # pylint: disable=import-error
+from storage.journal import BREAKER, DEVICE, StateJournal # pylint: disable=import-error
+
+SLOT_SECONDS = 15 * 60
+DEVICE_DEADLINE = 45.0
+
+logger = logging.getLogger(__name__)
+
+def getNextSlotStart(now: float) -> float:
+    '''Get epoch seconds of the next quarter hour boundary (:00, :15, :30, :45).'''
+    return (now // SLOT_SECONDS + 1) * SLOT_SECONDS
+
+class ControlEngine:
+    '''Concurrent control loop with bounded concurrency and per-device deadlines.'''
+
+    def __init__(self, devices: list[Device], maxConcurrency: int = 32,
+                 deviceDeadline: float = DEVICE_DEADLINE, planLead: float = 60.0,
+                 slotOffset: float = 1.0, readbackInterval: float = 3600.0,
+                 loadBalancer: LoadBalancer = None, metrics: MetricsRegistry = None,
+                 journal: StateJournal = None) -> None:
+        self.devices = devices
+        self.journal = journal
+        self.journaledPlans = {}
+        self.loadBalancer = loadBalancer
+        self.maxConcurrency = maxConcurrency
+        self.deviceDeadline = deviceDeadline
+        self.planLead = planLead
+        self.slotOffset = slotOffset
+        self.readbackInterval = readbackInterval
+        self.metrics = metrics if metrics is not None else getSharedMetrics()
+        # Limit is taken per request attempt rather than per device, so devices that wait
+        # in backoff do not keep healthy devices waiting
+        for retries in self._getRetryEngines():
+            retries.limitConcurrency(maxConcurrency)
+
+    def _getRetryEngines(self) -> list:
+        '''Get distinct retry engines of the devices.'''
+        return list({id(device.retries): device.retries for device in self.devices}.values())
+
+    def restoreState(self, now: float = None) -> int:
+        '''Restore plans, confirmed setpoints and circuit breakers from the state journal so
+        that the first cycle after a restart neither reads nor writes devices whose state is
+        still valid. Returns number of restored devices.'''
+        if self.journal is None:
+            return 0
+        if now is None:
+            now = time.time()
+        restored = 0
+        for device in self.devices:
+            value = self.journal.get(DEVICE, device.getName())
+            if not value:
+                continue
+            device.setpointState = SetpointState(**value['setpoint'])
+            if value.get('thermal'):
+                device.thermal.restoreState(value['thermal'])
+                # Room temperature of an old reading would mislead pre-heating
+                last = device.thermal.last
+                if last is not None and now - last[0] <= self.readbackInterval:
+                    device.roomTemperature = last[1]
+            planJson = value.get('plan')
+            if planJson and planJson['EpochMsExpiration'] > now * 1000:
+                device.plan = HeatingPlan.fromResponse(planJson)
+                device.planCache.restorePlan(device.apiPayload, device.plan)
+                self.journaledPlans[device.getName()] = device.plan
+            restored += 1
+        breakers = self.journal.getAll(BREAKER)
+        for retries in self._getRetryEngines():
+            for key, state in breakers.items():
+                retries.restoreBreaker(key, state, now)
+        return restored
+
+    def recordState(self, devices: list[Device], now: float = None) -> None:
+        '''Append changed device and breaker state to the state journal.'''
+        if self.journal is None:
+            return
+        if now is None:
+            now = time.time()
+        for device in devices:
+            name = device.getName()
+            previous = self.journal.get(DEVICE, name)
+            plan = device.plan
+            if previous is not None and plan is self.journaledPlans.get(name):
+                # Plan is serialized only when the device got a new one
+                planJson = previous.get('plan')
+            else:
+                planJson = plan.toResponse() if plan is not None else None
+                self.journaledPlans[name] = plan
+            self.journal.record(DEVICE, name, {'setpoint': asdict(device.setpointState),
+                                               'plan': planJson,
+                                               'thermal': device.thermal.getState()})
+        for retries in self._getRetryEngines():
+            for key, state in retries.getChangedBreakerStates(now).items():
+                self.journal.record(BREAKER, key, state)
+
+    def forgetState(self, device: Device) -> None:
+        '''Drop journaled state of device that is no longer controlled.'''
+        self.journaledPlans.pop(device.getName(), None)
+        if self.journal is not None:
+            self.journal.record(DEVICE, device.getName(), None)
+
+    async def controlDevice(self, target: Device, timestamp: float,
+                            forceReadback: bool = False, heating: bool = None) -> bool:
+        '''Run one status -> demand -> setpoint cycle for a single device. Status is read
+        from the device only when the cached setpoint cannot be trusted. Heating decided by
+        the load balancer replaces the demand of the plan.'''
+        name = target.getName()
+        strTime = time.strftime('%H:%M:%S (%a %d %b)', time.localtime(timestamp))
+        print(f'Kello on {strTime}. Asetetaan säädöt kohteeseen: {name}')
+
+        status = None
+        if forceReadback or target.setpointState.needsReadback(timestamp, self.readbackInterval):
+            status = await target.getCurrentStatusAsync()
+            if not status:
+                target.setpointState.invalidate()
+                print(f'Laitteeseen {name} ei saatu yhteyttä ja säätöä ei jatketa. ' \
+                      'Yritetään seuraavalla vuorolla uudelleen.')
+                return False
+
+        if heating is None:
+            heating = await target.getHeatingDemandAsync(timestamp)
+        successful = await target.adjustTempSetpointAsync(status, heating, timestamp)
+        if not successful:
+            print(f'Lämpötilan asettaminen laitteeseen {name} epäonnistui.')
+            return False
+        if self.loadBalancer is not None:
+            self.loadBalancer.recordApplied(target, heating)
+        target.plotHistory()
+        return True
+
+    async def _runBounded(self, target: Device, coroutine, deadline: float) -> bool:
+        '''Run coroutine for device within the deadline.'''
+        try:
+            return await asyncio.wait_for(coroutine, deadline)
+        except asyncio.TimeoutError:
+            self.metrics.timeouts.inc(target.getName())
+            print(f'Laitteen {target.getName()} käsittely ei valmistunut ' \
+                  f'{deadline} sekunnissa, keskeytetään.')
+        except Exception as err: # pylint: disable=broad-exception-caught
+            print(f'Laitteen {target.getName()} käsittely epäonnistui, virhe: {err}')
+        return False
+
+    async def _controlMeasured(self, target: Device, timestamp: float, forceReadback: bool,
+                               heating: bool = None) -> bool:
+        '''Run controlDevice and record its duration and result.'''
+        start = time.perf_counter()
+        successful = False
+        try:
+            successful = await self.controlDevice(target, timestamp, forceReadback, heating)
+            return successful
+        finally:
+            elapsed = time.perf_counter() - start
+            result = 'ok' if successful else 'failed'
+            self.metrics.phaseSeconds.observe(elapsed, CONTROL)
+            self.metrics.controlResults.inc(target.getName(), result)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('control cycle', extra={
+                    'device': target.getName(), 'result': result, 'heating': heating,
+                    'seconds': round(elapsed, 4)})
+
+    async def prepareTick(self, slotStart: float,
+                          devices: list[Device] = None) -> dict[str, bool]:
+        '''Fetch plans that expire before the coming slot so that the tick does not wait.'''
+        devices = self.devices if devices is None else devices
+        results = await asyncio.gather(*(
+            self._runBounded(device, device.refreshPlanAsync(slotStart), self.planLead)
+            for device in devices))
+        return {device.getName(): result for device, result in zip(devices, results)}
+
+    async def balanceLoad(self, devices: list[Device], timestamp: float) -> dict[str, bool]:
+        '''Refresh plans of given devices and decide heating of every device of the site in
+        one balancing round.'''
+        await self.prepareTick(timestamp, devices)
+        return self.loadBalancer.balance([
+            BalanceEntry(device, device.getPower(), device.getPlannedDemand(timestamp),
+                         device.getHeatingFlexibility(timestamp))
+            for device in self.devices], timestamp - timestamp % SLOT_SECONDS)
+
+    async def runCycle(self, devices: list[Device], timestamp: float,
+                       forceReadback: bool = False) -> list[bool]:
+        '''Run control cycle for given devices concurrently. Returns success per device.
+        With load balancing, other devices whose balanced heating changed are adjusted too.'''
+        if self.loadBalancer is None:
+            results = await asyncio.gather(*(
+                self._runBounded(device,
+                                 self._controlMeasured(device, timestamp, forceReadback),
+                                 self.deviceDeadline)
+                for device in devices))
+            self.recordState(devices)
+            return results
+        decisions = await self.balanceLoad(devices, timestamp)
+        included = {id(device) for device in devices}
+        changed = [device for device in self.devices if id(device) not in included
+                   and self.loadBalancer.needsUpdate(device, decisions[device.getName()])]
+        results = await asyncio.gather(*(
+            self._runBounded(device,
+                             self._controlMeasured(device, timestamp, forceReadback,
+                                                   decisions[device.getName()]),
+                             self.deviceDeadline)
+            for device in devices + changed))
+        self.recordState(devices + changed)
+        return results[:len(devices)]
+
+    async def runTick(self, timestamp: float = None,
+                      devices: list[Device] = None) -> dict[str, bool]:
+        '''Run control cycle for all devices concurrently. Returns success per device name.'''
+        if timestamp is None:
+            timestamp = time.time()
+        devices = self.devices if devices is None else devices
+        results = await self.runCycle(devices, timestamp)
+        return {device.getName(): result for device, result in zip(devices, results)}
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+'''Module for site level load balancing. Devices with identical plans would all switch to
+the high setpoint at the same quarter hour. The balancer decides heating of every device in
+one pass per tick so that the configured power of heating devices stays under the site cap.
+Devices whose plan has the most room to move heating are deferred first, and deferred slots
+are made up in later slots where the plan is off and there is capacity left. Decisions are
+made once per slot, later rounds in the same slot reuse them. Worker processes share the cap
+through a SharedPowerBudget.'''
+
+from dataclasses import dataclass
+from typing import Any
+
+from devices.device import Device # pylint: disable=import-error
+
+@dataclass(slots=True)
+class BalanceEntry:
+    '''Input of one device for a balancing round.'''
+    device: Device
+    power: float
+    wanted: bool
+    flexibility: int
+
+class SharedPowerBudget:
+    '''Site power cap shared by worker processes. Every worker reserves the power of the
+    devices it heats in the current slot, and a worker may use the cap minus the reservations
+    that the other workers have made for the same slot. Reservations are kept in a shared
+    array of doubles with two items, slot start and power, per worker.'''
+
+    def __init__(self, reservations: Any, index: int) -> None:
+        self.reservations = reservations
+        self.index = index
+
+    def getLock(self) -> Any:
+        '''Get lock that must be held while reading and reserving.'''
+        return self.reservations.get_lock()
+
+    def getReservedByOthers(self, slotStart: float) -> float:
+        '''Get power reserved by other workers for the slot.'''
+        return sum(self.reservations[2 * worker + 1]
+                   for worker in range(len(self.reservations) // 2)
+                   if worker != self.index and self.reservations[2 * worker] == slotStart)
+
+    def reserve(self, slotStart: float, power: float) -> None:
+        '''Set power reserved by this worker for the slot.'''
+        self.reservations[2 * self.index] = slotStart
+        self.reservations[2 * self.index + 1] = power
+
+    def release(self) -> None:
+        '''Drop reservation of a worker that is restarted or retired.'''
+        with self.getLock():
+            self.reservations[2 * self.index + 1] = 0.0
+
+class LoadBalancer:
+    '''Keeps the heating power of the site under powerCap watts.'''
+
+    def __init__(self, powerCap: float, maxDebt: int = 8,
+                 budget: SharedPowerBudget = None) -> None:
+        self.powerCap = powerCap
+        self.maxDebt = maxDebt
+        self.budget = budget
+        self.debts = {}
+        self.applied = {}
+        self.rounds = 0
+        self.slotStart = None
+        self.slotDecisions = {}
+
+    def getDebt(self, device: Device) -> int:
+        '''Get number of deferred heating slots of device that are not yet made up.'''
+        return self.debts.get(device.getName(), 0)
+
+    def _getPriority(self, entry: BalanceEntry, deviceCount: int) -> tuple:
+        '''Wanted heating first, least flexible first, then largest debt. Ties rotate
+        between slots so that the same device is not always deferred.'''
+        name = entry.device.getName()
+        rotation = (sum(name.encode('utf-8')) + self.rounds) % max(1, deviceCount)
+        return (not entry.wanted, entry.flexibility if entry.wanted else 0,
+                -self.debts.get(name, 0), rotation)
+
+    def balance(self, entries: list[BalanceEntry], slotStart: float) -> dict[str, bool]:
+        '''Decide heating of all devices for the slot that starts at slotStart. Returns
+        heating per name. Control cycles run also in the middle of a slot, so debts and
+        rotation change only when the slot changes. Devices decided earlier in the slot keep
+        their decision and new devices get the capacity that is left.'''
+        if slotStart != self.slotStart:
+            self.slotStart = slotStart
+            self.slotDecisions = {}
+            self.rounds += 1
+        if self.budget is None:
+            return self._decide(entries, self.powerCap)[0]
+        with self.budget.getLock():
+            powerCap = self.powerCap - self.budget.getReservedByOthers(slotStart)
+            decisions, load = self._decide(entries, powerCap)
+            self.budget.reserve(slotStart, load)
+        return decisions
+
+    def _decide(self, entries: list[BalanceEntry],
+                powerCap: float) -> tuple[dict[str, bool], float]:
+        '''Decide heating of devices not yet decided in the slot. Returns heating per name
+        and the power of heating devices.'''
+        decisions = {}
+        load = 0.0
+        candidates = []
+        for entry in entries:
+            name = entry.device.getName()
+            if name in self.slotDecisions:
+                decisions[name] = self.slotDecisions[name]
+                if decisions[name] and entry.power > 0:
+                    load += entry.power
+            elif entry.power <= 0:
+                # Devices without configured power follow their plan
+                decisions[name] = entry.wanted
+            elif entry.wanted or self.debts.get(name, 0) > 0:
+                candidates.append(entry)
+            else:
+                decisions[name] = False
+        candidateCount = len(candidates)
+        candidates.sort(key=lambda entry: self._getPriority(entry, candidateCount))
+        for entry in candidates:
+            name = entry.device.getName()
+            allowed = load + entry.power <= powerCap
+            if allowed:
+                load += entry.power
+            decisions[name] = allowed
+            if entry.wanted and not allowed:
+                self.debts[name] = min(self.maxDebt, self.debts.get(name, 0) + 1)
+            elif not entry.wanted and allowed:
+                self.debts[name] -= 1
+        self.slotDecisions.update(decisions)
+        return decisions, load
+
+    def forget(self, device: Device) -> None:
+        '''Drop state of device that is no longer controlled.'''
+        self.debts.pop(device.getName(), None)
+        self.applied.pop(device.getName(), None)
+        self.slotDecisions.pop(device.getName(), None)
+
+    def recordApplied(self, device: Device, heating: bool) -> None:
+        '''Remember heating state that was written to the device.'''
+        self.applied[device.getName()] = heating
+
+    def needsUpdate(self, device: Device, heating: bool) -> bool:
+        '''Check if decision differs from the state that was last written to the device.'''
+        return self.applied.get(device.getName()) != heating
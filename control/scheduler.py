@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+'''Module for event driven scheduler. Instead of running every device on a fixed 15 minute
+grid, the scheduler keeps a heap of the next plan change and plan refresh of every device
+and sleeps until the earliest of them.'''
+
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+
+from apis.prices import SeriesUpdater # pylint: disable=import-error
+from control.engine import ControlEngine, getNextSlotStart # pylint: disable=import-error
+from devices.device import Device # pylint: disable=import-error
+
+PLAN_CHANGE = 'change'
+PLAN_REFRESH = 'refresh'
+VERIFY = 'verify'
+
+@dataclass(order=True, slots=True)
+class ScheduledEvent:
+    '''Event in the scheduler heap, ordered by time.'''
+    when: float
+    sequence: int
+    kind: str = field(compare=False)
+    device: Device = field(compare=False, default=None)
+    generation: int = field(compare=False, default=0)
+
+class EventScheduler:
+    '''Wakes the control engine only when a plan changes, a plan has to be refreshed or
+    the periodic verification sweep is due.'''
+
+    def __init__(self, engine: ControlEngine, verifyInterval: float = 3600.0,
+                 retryInterval: float = 300.0, coalesceWindow: float = 1.0,
+                 series: SeriesUpdater = None) -> None:
+        self.engine = engine
+        self.series = series
+        self.seriesTask = None
+        self.verifyInterval = verifyInterval
+        self.retryInterval = retryInterval
+        self.coalesceWindow = coalesceWindow
+        self.heap = []
+        self.sequence = itertools.count()
+        self.generations = {}
+        self.wakeup = None
+
+    def _push(self, when: float, kind: str, device: Device = None) -> None:
+        '''Add event to the heap.'''
+        generation = self.generations.get(id(device), 0)
+        heapq.heappush(self.heap, ScheduledEvent(when, next(self.sequence), kind,
+                                                 device, generation))
+
+    def _isStale(self, event: ScheduledEvent) -> bool:
+        '''Check if device has been rescheduled after the event was added.'''
+        return event.device is not None \
+            and event.generation != self.generations.get(id(event.device), 0)
+
+    def scheduleDevice(self, device: Device, now: float) -> None:
+        '''Replace pending events of device with its next plan change and plan refresh.'''
+        self.generations[id(device)] = self.generations.get(id(device), 0) + 1
+        plan = device.plan
+        if plan is None or plan.expiration <= now * 1000:
+            # Backup hours are in use, they can change on every slot boundary
+            self._push(getNextSlotStart(now) + self.engine.slotOffset, PLAN_CHANGE, device)
+            self._push(now + self.retryInterval, PLAN_REFRESH, device)
+            return
+        nextChange = device.getNextPlanChange(now)
+        balancer = self.engine.loadBalancer
+        if balancer is not None and (balancer.getDebt(device) > 0
+                                     or balancer.needsUpdate(device, device.getPlannedDemand(now))):
+            # Deferred heating is made up and the plan is returned to in the following slots
+            nextChange = min(nextChange, getNextSlotStart(now))
+        self._push(nextChange + self.engine.slotOffset, PLAN_CHANGE, device)
+        refreshAt = plan.expiration / 1000 - device.planCache.refreshMargin
+        if refreshAt <= now:
+            refreshAt = now + self.retryInterval
+        self._push(refreshAt, PLAN_REFRESH, device)
+
+    def addDevice(self, device: Device, now: float) -> None:
+        '''Control added or reconfigured device right away and wake the scheduler.'''
+        self.generations[id(device)] = self.generations.get(id(device), 0) + 1
+        self._push(now, PLAN_REFRESH, device)
+        self._push(now, PLAN_CHANGE, device)
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def removeDevice(self, device: Device) -> None:
+        '''Drop pending events of device that is no longer controlled.'''
+        self.generations[id(device)] = self.generations.get(id(device), 0) + 1
+        if self.engine.loadBalancer is not None:
+            self.engine.loadBalancer.forget(device)
+        self.engine.forgetState(device)
+
+    def getNextWakeup(self) -> float:
+        '''Get epoch seconds of the earliest pending event. Returns None if heap is empty.'''
+        while self.heap and self._isStale(self.heap[0]):
+            heapq.heappop(self.heap)
+        return self.heap[0].when if self.heap else None
+
+    def _popDue(self, now: float) -> list[ScheduledEvent]:
+        '''Pop events that are due now or within the coalesce window.'''
+        due = []
+        while self.heap and self.heap[0].when <= now + self.coalesceWindow:
+            event = heapq.heappop(self.heap)
+            if not self._isStale(event):
+                due.append(event)
+        return due
+
+    def _startSeriesRefresh(self, now: float) -> None:
+        '''Update price and forecast series of all regions in the background.'''
+        if self.series is None or (self.seriesTask is not None and not self.seriesTask.done()):
+            return
+        regions = {}
+        for device in self.engine.devices:
+            payload = device.apiPayload
+            location = (payload['Latitude'], payload['Longitude']) \
+                if 'Latitude' in payload and 'Longitude' in payload else None
+            if regions.get(payload.get('Region')) is None:
+                regions[payload.get('Region')] = location
+        self.seriesTask = asyncio.ensure_future(self.series.refreshAsync(regions, now))
+
+    async def verifyAll(self, now: float) -> None:
+        '''Reload changed configurations and run full control cycle for every device.'''
+        # Devices may be added or removed by the configuration watcher during the cycle
+        devices = list(self.engine.devices)
+        for device in devices:
+            device.reloadConfig()
+        self._startSeriesRefresh(now)
+        results = await self.engine.runCycle(devices, now)
+        for device, successful in zip(devices, results):
+            self.scheduleDevice(device, now)
+            if not successful:
+                self._push(now + self.retryInterval, PLAN_CHANGE, device)
+
+    async def runDue(self, now: float) -> None:
+        '''Handle events that are due.'''
+        events = self._popDue(now)
+        if any(event.kind == VERIFY for event in events):
+            await self.verifyAll(now)
+            self._push(now + self.verifyInterval, VERIFY)
+            return
+        refresh = list({id(event.device): event.device for event in events
+                        if event.kind == PLAN_REFRESH}.values())
+        change = list({id(event.device): event.device for event in events
+                       if event.kind == PLAN_CHANGE}.values())
+        if refresh:
+            await self.engine.prepareTick(now, refresh)
+        results = await self.engine.runCycle(change, now) if change else []
+        now = time.time()
+        rescheduled = refresh + change
+        if self.engine.loadBalancer is not None and change:
+            # Balancing round may have deferred or released any device of the site
+            rescheduled = self.engine.devices
+        current = {id(device) for device in self.engine.devices}
+        for device in {id(device): device for device in rescheduled}.values():
+            if id(device) not in current:
+                continue
+            self.scheduleDevice(device, now)
+        for device, successful in zip(change, results):
+            if not successful and id(device) in current:
+                self._push(now + self.retryInterval, PLAN_CHANGE, device)
+
+    async def runForever(self) -> None:
+        '''Run control cycle for all devices at start and then only when events are due.'''
+        self.wakeup = asyncio.Event()
+        now = time.time()
+        await self.verifyAll(now)
+        self._push(now + self.verifyInterval, VERIFY)
+        while True:
+            self.wakeup.clear()
+            wakeup = self.getNextWakeup()
+            delay = wakeup - time.time()
+            if delay > 0:
+                try:
+                    # Added devices wake the scheduler before the earliest pending event
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            await self.runDue(time.time())
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+'''Module for multi-process operation. The supervisor shards device configurations across
+worker processes by site (subfolder of configs/) or by file, and every worker runs its own
+engine, scheduler and configuration watcher for its shard. Shards are assigned with
+rendezvous hashing over the live workers, so when a worker is retired only its devices
+move. Liveness, heartbeats and the power reservations of the site cap are kept in shared
+memory. Plans are shared through the plan cache file and prices through the memory-mapped
+series store.'''
+
+import asyncio
+import multiprocessing
+import signal
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from control.configwatcher import DEFAULT_CONFIG_PATH, ConfigWatcher # pylint: disable=import-error
+from control.loadbalancer import SharedPowerBudget # pylint: disable=import-error
+
+SHARD_BY_SITE = 'site'
+SHARD_BY_HASH = 'hash'
+SHARD_MODES = (SHARD_BY_SITE, SHARD_BY_HASH)
+
+def getShardKey(path: Path, root: Path, mode: str) -> str:
+    '''Get key that decides the shard of configuration file. In site mode the devices of
+    one subfolder of configs/ stay together; files directly in configs/ are sharded one by
+    one.'''
+    relative = Path(path).relative_to(root)
+    if mode == SHARD_BY_SITE and len(relative.parts) > 1:
+        return relative.parts[0]
+    return relative.as_posix()
+
+def getOwner(key: str, workers: list[int]) -> int:
+    '''Pick worker for key with rendezvous hashing. Removing a worker moves only its keys.'''
+    return max(workers, key=lambda worker: zlib.crc32(f'{worker}:{key}'.encode('utf-8')))
+
+@dataclass
+class WorkerContext:
+    '''Shard of one worker and the shared memory it uses to talk with the supervisor.'''
+    index: int
+    root: Path
+    mode: str
+    live: Any
+    version: Any
+    heartbeat: Any
+    reservations: Any = None
+
+    def getLiveWorkers(self) -> list[int]:
+        '''Get indexes of workers that have not been retired.'''
+        return [index for index, alive in enumerate(self.live) if alive]
+
+    def owns(self, path: Path) -> bool:
+        '''Check if configuration file belongs to this worker.'''
+        return getOwner(getShardKey(path, self.root, self.mode),
+                        self.getLiveWorkers()) == self.index
+
+    def getPowerBudget(self) -> SharedPowerBudget:
+        '''Get share of the site power cap of this worker.'''
+        return SharedPowerBudget(self.reservations, self.index)
+
+    def beat(self) -> None:
+        '''Tell supervisor that the event loop of the worker is running.'''
+        self.heartbeat.value = time.monotonic()
+
+    async def runHeartbeat(self, watcher: ConfigWatcher, interval: float = 5.0) -> None:
+        '''Beat periodically and take over devices when the set of live workers changes.'''
+        version = self.version.value
+        while True:
+            self.beat()
+            if self.version.value != version:
+                version = self.version.value
+                changed = watcher.pollOnce(time.time())
+                print(f'Työprosessien jako muuttui, prosessi {self.index} otti käyttöön ' \
+                      f'{changed} muuttunutta konfiguraatiota.')
+            await asyncio.sleep(interval)
+
+class Supervisor:
+    '''Starts worker processes, restarts crashed or wedged ones and rebalances their devices
+    to the other workers when a worker keeps failing.'''
+
+    def __init__(self, workerCount: int, target, root: Path = DEFAULT_CONFIG_PATH,
+                 mode: str = SHARD_BY_SITE, wedgeTimeout: float = 120.0,
+                 maxRestarts: int = 3, restartWindow: float = 600.0,
+                 checkInterval: float = 5.0, context=None) -> None:
+        if mode not in SHARD_MODES:
+            raise ValueError(f'Tuntematon jakotapa {mode}, sallitut: {", ".join(SHARD_MODES)}')
+        self.context = context if context is not None else multiprocessing.get_context('spawn')
+        self.target = target
+        self.root = Path(root)
+        self.mode = mode
+        self.wedgeTimeout = wedgeTimeout
+        self.maxRestarts = maxRestarts
+        self.restartWindow = restartWindow
+        self.checkInterval = checkInterval
+        self.live = self.context.Array('b', [1] * workerCount)
+        self.version = self.context.Value('i', 0)
+        self.heartbeats = [self.context.Value('d', 0.0) for _ in range(workerCount)]
+        self.reservations = self.context.Array('d', 2 * workerCount)
+        self.processes = [None] * workerCount
+        self.restarts = [[] for _ in range(workerCount)]
+        self.running = False
+
+    def getContext(self, index: int) -> WorkerContext:
+        '''Get context passed to worker process.'''
+        return WorkerContext(index, self.root, self.mode, self.live, self.version,
+                             self.heartbeats[index], self.reservations)
+
+    def _spawn(self, index: int) -> None:
+        '''Start worker process.'''
+        self.heartbeats[index].value = time.monotonic()
+        # Restored worker reserves its power again on its first balancing round
+        self.getContext(index).getPowerBudget().release()
+        process = self.context.Process(target=self.target, args=(self.getContext(index),),
+                                       name=f'heating-worker-{index}', daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def start(self) -> None:
+        '''Start all workers.'''
+        self.running = True
+        for index in range(len(self.processes)):
+            self._spawn(index)
+
+    def _retire(self, index: int) -> None:
+        '''Stop using worker. Live workers take over its devices on their next heartbeat.'''
+        self.live[index] = 0
+        self.getContext(index).getPowerBudget().release()
+        with self.version.get_lock():
+            self.version.value += 1
+        print(f'Työprosessi {index} kaatui {self.maxRestarts} kertaa ' \
+              f'{self.restartWindow:.0f} sekunnissa, sen laitteet jaetaan muille prosesseille.')
+
+    def checkWorkers(self, now: float = None) -> list[int]:
+        '''Restart dead or wedged workers. Returns indexes of workers that were handled.'''
+        if now is None:
+            now = time.monotonic()
+        handled = []
+        for index, process in enumerate(self.processes):
+            if not self.live[index] or process is None:
+                continue
+            wedged = process.is_alive() and now - self.heartbeats[index].value > self.wedgeTimeout
+            if process.is_alive() and not wedged:
+                continue
+            if wedged:
+                print(f'Työprosessi {index} ei ole vastannut {self.wedgeTimeout:.0f} ' \
+                      'sekuntiin, se pysäytetään.')
+                process.kill()
+            process.join(1.0)
+            handled.append(index)
+            self.restarts[index] = [moment for moment in self.restarts[index]
+                                    if now - moment < self.restartWindow] + [now]
+            if len(self.restarts[index]) >= self.maxRestarts and sum(self.live) > 1:
+                self._retire(index)
+                self.processes[index] = None
+            else:
+                print(f'Työprosessi {index} käynnistetään uudelleen.')
+                self._spawn(index)
+        return handled
+
+    def stop(self) -> None:
+        '''Stop all workers.'''
+        self.running = False
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join(5.0)
+                if process.is_alive():
+                    process.kill()
+
+    def runForever(self) -> None:
+        '''Start workers and supervise them until SIGTERM or Ctrl-C.'''
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        self.start()
+        try:
+            while self.running:
+                time.sleep(self.checkInterval)
+                if self.running:
+                    self.checkWorkers()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
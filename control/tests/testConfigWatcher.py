@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''Module for unit test for ConfigWatcher class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s control/tests -p "testConfigWatcher.py"
+'''
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from control.configwatcher import ConfigWatcher, Inotify # pylint: disable=import-error
+from control.engine import ControlEngine # pylint: disable=import-error
+from control.scheduler import PLAN_CHANGE, EventScheduler # pylint: disable=import-error
+from devices.config import loadDeviceConfig # pylint: disable=import-error
+from devices.thermostat import Thermostat # pylint: disable=import-error
+
+with open('devices/tests/test_config.json', 'r', encoding='utf-8') as templateFile:
+    TEMPLATE = json.load(templateFile)
+
+def createDevice(path: Path) -> Thermostat:
+    '''Create thermostat with mocked shared components.'''
+    return Thermostat(path, loadDeviceConfig(path), planCache=MagicMock(), history=MagicMock())
+
+class TestConfigWatcher(unittest.TestCase):
+    '''Unit tests for ConfigWatcher class.'''
+
+    def _writeConfig(self, name: str, tempHigh: float = 22.0, deviceType: str = 'thermostat'):
+        path = self.root / f'{name}.json'
+        data = json.loads(json.dumps(TEMPLATE))
+        data[0].update({'name': name, 'tempHigh': tempHigh, 'type': deviceType})
+        path.write_text(json.dumps(data), encoding='utf-8')
+        # Stamps must differ even on file systems with coarse timestamps
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + next(self.counter) * 1_000_000))
+        return path
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.root = Path(self.directory.name)
+        self.counter = iter(range(1, 1000))
+        self.paths = [self._writeConfig(f'huone{index}') for index in range(3)]
+        self.devices = [createDevice(path) for path in self.paths]
+        self.scheduler = EventScheduler(ControlEngine(list(self.devices)))
+        self.watcher = ConfigWatcher(self.scheduler, createDevice, self.root)
+        self.now = time.time()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _pendingDevices(self) -> set:
+        return {event.device.getName() for event in self.scheduler.heap
+                if event.kind == PLAN_CHANGE and not self.scheduler._isStale(event)} # pylint: disable=protected-access
+
+    @patch('builtins.print')
+    def testOnlyChangedFilesAreApplied(self, _mockPrint):
+        '''Unchanged devices keep their objects and new one is controlled right away.'''
+        for device in self.devices:
+            self.scheduler.scheduleDevice(device, self.now)
+        pending = {id(event) for event in self.scheduler.heap}
+        self._writeConfig('huone1', tempHigh=23.0)
+        newPath = self._writeConfig('huone3')
+        self.assertEqual(self.watcher.pollOnce(self.now), 2)
+        engineDevices = self.scheduler.engine.devices
+        self.assertEqual(engineDevices[:3], self.devices)
+        self.assertEqual(self.devices[1].config.tempHigh, 23.0)
+        self.assertEqual(engineDevices[3].configPath, newPath)
+        # Events of the untouched devices are still valid
+        self.assertTrue(all(not self.scheduler._isStale(event) for event in self.scheduler.heap # pylint: disable=protected-access
+                            if id(event) in pending and event.device is not self.devices[1]))
+        self.assertLessEqual({'huone1', 'huone3'}, self._pendingDevices())
+        self.assertEqual(self.watcher.pollOnce(self.now), 0)
+
+    @patch('builtins.print')
+    def testRemovedAndInvalidFiles(self, _mockPrint):
+        '''Removed device is dropped, invalid change keeps the old configuration.'''
+        self.scheduler.scheduleDevice(self.devices[0], self.now)
+        self.paths[0].unlink()
+        self.paths[2].write_text('{', encoding='utf-8')
+        self.watcher.pollOnce(self.now)
+        self.assertEqual(self.scheduler.engine.devices, self.devices[1:])
+        self.assertEqual(self.scheduler.getNextWakeup(), None)
+        self.assertEqual(self.devices[2].config.tempHigh, 22.0)
+
+    @patch('builtins.print')
+    def testChangedTypeCreatesNewObject(self, _mockPrint):
+        '''Device object is replaced when the device type changes.'''
+        self._writeConfig('huone0', deviceType='panel')
+        created = []
+        self.watcher.createDevice = lambda path: created.append(path) or createDevice(path)
+        self.watcher.pollOnce(self.now)
+        self.assertEqual(created, [self.paths[0]])
+        self.assertNotIn(self.devices[0], self.scheduler.engine.devices)
+
+class TestInotify(unittest.IsolatedAsyncioTestCase):
+    '''Changes are seen through inotify without polling.'''
+
+    @patch('builtins.print')
+    async def testInotifyReportsNewFile(self, _mockPrint):
+        '''New file in watched directory is applied within the settle delay.'''
+        try:
+            Inotify().close()
+        except OSError:
+            self.skipTest('inotify ei ole käytettävissä')
+        with tempfile.TemporaryDirectory() as directory:
+            scheduler = EventScheduler(ControlEngine([]))
+            watcher = ConfigWatcher(scheduler, createDevice, Path(directory),
+                                    pollInterval=3600, settleDelay=0.05)
+            task = asyncio.create_task(watcher.runForever())
+            await asyncio.sleep(0.1)
+            data = json.loads(json.dumps(TEMPLATE))
+            (Path(directory) / 'uusi.json').write_text(json.dumps(data), encoding='utf-8')
+            for _ in range(50):
+                await asyncio.sleep(0.05)
+                if scheduler.engine.devices:
+                    break
+            task.cancel()
+            self.assertEqual([device.getName() for device in scheduler.engine.devices],
+                             ['default'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+'''Module for unit test for ControlEngine class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s control/tests -p "testEngine.py"
+'''
+
+import asyncio
+import dataclasses
+import random
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+from apis.httpclients import DEFAULT_SETTINGS, DEVICE, HOME_ASSISTANT # pylint: disable=import-error
+from apis.retry import DEFAULT_POLICIES, RetryEngine, RetryPolicy # pylint: disable=import-error
+from apis.smartheating import HeatingPlan # pylint: disable=import-error
+from control.engine import DEVICE_DEADLINE, ControlEngine, getNextSlotStart # pylint: disable=import-error
+from devices.thermostat import Thermostat # pylint: disable=import-error
+from storage.journal import StateJournal # pylint: disable=import-error
+
+class FakeThermostat(Thermostat):
+    '''Thermostat that answers after given delay without network traffic.'''
+
+    def __init__(self, delay: float, fail: bool = False):
+        super().__init__(configPath="devices/tests/test_config.json", history=MagicMock())
+        self.delay = delay
+        self.fail = fail
+        self.written = []
+
+    async def getCurrentStatusAsync(self) -> dict:
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError('laite rikki')
+        return {'parameters': {'heatingSetpoint': 18.0}}
+
+    async def getHeatingDemandAsync(self, timestamp: float = None) -> bool:
+        return True
+
+    async def _setTempAsync(self, newTemp: float, oldTemp: float) -> bool:
+        self.written.append(newTemp)
+        return True
+
+    def plotHistory(self) -> None:
+        pass
+
+class CountingThermostat(Thermostat):
+    '''Thermostat that counts status reads and setpoint writes.'''
+
+    def __init__(self):
+        super().__init__(configPath="devices/tests/test_config.json", history=MagicMock())
+        self.setpoint = 18.0
+        self.reads = 0
+        self.writes = 0
+        self.writeStatus = 200
+
+    async def getCurrentStatusAsync(self) -> dict:
+        self.reads += 1
+        return {'parameters': {'heatingSetpoint': self.setpoint}}
+
+    async def getHeatingDemandAsync(self, timestamp: float = None) -> bool:
+        return True
+
+    async def sendTempToDeviceAsync(self, newTemp: float) -> httpx.Response:
+        self.writes += 1
+        if self.writeStatus == 200:
+            self.setpoint = newTemp
+        return httpx.Response(self.writeStatus)
+
+    def plotHistory(self) -> None:
+        pass
+
+class NetworkThermostat(Thermostat):
+    '''Thermostat whose requests go through retries, offline one times out every attempt.'''
+
+    def __init__(self, name: str, retries: RetryEngine, offline: bool):
+        super().__init__(configPath="devices/tests/test_config.json", history=MagicMock(),
+                         retries=retries)
+        self._applyConfig(dataclasses.replace(self.config, name=name, ip=name))
+        self.offline = offline
+        self.writeTime = None
+
+    async def _getStatusResponseAsync(self) -> httpx.Response:
+        if self.offline:
+            await asyncio.sleep(0.2)
+            raise httpx.ConnectTimeout('aikakatkaisu')
+        return httpx.Response(200, json={'parameters': {'heatingSetpoint': 18.0},
+                                         'internalTemperature': 20.0,
+                                         'floorTemperature': 22.0})
+
+    async def getHeatingDemandAsync(self, timestamp: float = None) -> bool:
+        return True
+
+    async def sendTempToDeviceAsync(self, newTemp: float) -> httpx.Response:
+        self.writeTime = time.monotonic()
+        return httpx.Response(200)
+
+    def plotHistory(self) -> None:
+        pass
+
+class TestControlEngine(unittest.IsolatedAsyncioTestCase):
+    '''Unit tests for ControlEngine class.'''
+
+    def testGetNextSlotStart(self):
+        '''Next slot is always the following quarter hour boundary.'''
+        self.assertEqual(getNextSlotStart(0), 900)
+        self.assertEqual(getNextSlotStart(899.9), 900)
+        self.assertEqual(getNextSlotStart(900), 1800)
+
+    def testRetriesFitInDeadline(self):
+        '''Status read and setpoint write with all retries fit in the default deadline.'''
+        for hostClass in (DEVICE, HOME_ASSISTANT):
+            worstCase = DEFAULT_POLICIES[hostClass].getWorstCase(
+                DEFAULT_SETTINGS[hostClass].timeout)
+            self.assertLessEqual(2 * worstCase, DEVICE_DEADLINE)
+
+    @patch('builtins.print')
+    async def testDevicesRunConcurrently(self, _mockPrint):
+        '''Ten slow devices take about as long as one.'''
+        devices = [FakeThermostat(0.1) for _ in range(10)]
+        engine = ControlEngine(devices, maxConcurrency=10)
+        start = time.monotonic()
+        await engine.runTick()
+        self.assertLess(time.monotonic() - start, 0.5)
+        for device in devices:
+            self.assertEqual(device.written, [22.0])
+
+    @patch('builtins.print')
+    async def testDeadlineAndErrorsDoNotBlockOthers(self, _mockPrint):
+        '''Hanging or failing device is abandoned and others still get setpoints.'''
+        hanging = FakeThermostat(10)
+        broken = FakeThermostat(0, fail=True)
+        healthy = FakeThermostat(0)
+        engine = ControlEngine([hanging, broken, healthy], deviceDeadline=0.2)
+        start = time.monotonic()
+        await engine.runTick()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(hanging.written, [])
+        self.assertEqual(broken.written, [])
+        self.assertEqual(healthy.written, [22.0])
+
+    @patch('builtins.print')
+    async def testBackoffDoesNotHoldConcurrencySlot(self, _mockPrint):
+        '''Offline devices sleeping in backoff do not delay the write of a healthy device.'''
+        retries = RetryEngine(policies={DEVICE: RetryPolicy(attempts=4, baseDelay=1.0,
+                                                            maxDelay=1.0)},
+                              failureThreshold=10, rng=random.Random(1), metrics=MagicMock())
+        offline = [NetworkThermostat(f'offline{i}', retries, True) for i in range(4)]
+        healthy = NetworkThermostat('healthy', retries, False)
+        engine = ControlEngine(offline + [healthy], maxConcurrency=2, deviceDeadline=10)
+        start = time.monotonic()
+        await engine.runTick()
+        self.assertIsNotNone(healthy.writeTime)
+        self.assertLess(healthy.writeTime - start, 1.5)
+
+    @patch('builtins.print')
+    async def testSteadyStateSkipsReadAndWrite(self, _mockPrint):
+        '''Cached setpoint skips status read and write until readback is due or suspected.'''
+        device = CountingThermostat()
+        engine = ControlEngine([device], readbackInterval=3600)
+        now = time.time()
+        await engine.controlDevice(device, now)
+        self.assertEqual((device.reads, device.writes), (1, 1))
+        await engine.controlDevice(device, now + 900)
+        self.assertEqual((device.reads, device.writes), (1, 1))
+        await engine.controlDevice(device, now + 3600)
+        self.assertEqual((device.reads, device.writes), (2, 1))
+
+        device.setpointState.setpoint = 18.0
+        device.writeStatus = 500
+        await engine.controlDevice(device, now + 3600)
+        self.assertEqual((device.reads, device.writes), (2, 2))
+        self.assertTrue(device.setpointState.suspect)
+        await engine.controlDevice(device, now + 3700)
+        self.assertEqual(device.reads, 3)
+
+    @patch('builtins.print')
+    async def testWarmRestartResumesWithoutRequests(self, _mockPrint):
+        '''Restarted engine restores setpoint, plan and breakers from the journal.'''
+        now = time.time()
+        plan = HeatingPlan.fromResponse({
+            'PlanAhead': [{'epochMs': int(now * 1000), 'result': True}],
+            'EpochMsExpiration': int((now + 3600) * 1000), 'AverageTemperature': 1.5})
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = Path(tmpDir) / 'state.journal'
+            device = CountingThermostat()
+            device.planCache = MagicMock()
+            device.retries = RetryEngine()
+            device.plan = plan
+            for _ in range(3):
+                device.retries.getBreaker('host:laite').recordFailure()
+            engine = ControlEngine([device], journal=StateJournal(path))
+            await engine.runCycle([device], now)
+            engine.journal.close()
+
+            restarted = CountingThermostat()
+            restarted.setpoint = device.setpoint
+            restarted.planCache = MagicMock()
+            restarted.retries = RetryEngine()
+            engine = ControlEngine([restarted], journal=StateJournal(path))
+            self.assertEqual(engine.restoreState(now + 1), 1)
+            await engine.runCycle([restarted], now + 1)
+            engine.journal.close()
+        self.assertEqual((restarted.reads, restarted.writes), (0, 0))
+        self.assertEqual(list(restarted.plan.epochs), list(plan.epochs))
+        restarted.planCache.restorePlan.assert_called_once()
+        self.assertTrue(restarted.retries.getBreaker('host:laite').isOpen())
+
+    def testRestoredRoomTemperatureMustBeRecent(self):
+        '''Room temperature of the journal is used only if it was read recently.'''
+        now = time.time()
+        with tempfile.TemporaryDirectory() as tmpDir:
+            path = Path(tmpDir) / 'state.journal'
+            device = CountingThermostat()
+            device.thermal.addSample(now, 20.5, 22.0, 0.0)
+            engine = ControlEngine([device], journal=StateJournal(path))
+            engine.recordState([device], now)
+            engine.journal.close()
+            temperatures = []
+            for restartTime in (now + 600, now + 7200):
+                restarted = CountingThermostat()
+                engine = ControlEngine([restarted], journal=StateJournal(path))
+                engine.restoreState(restartTime)
+                engine.journal.close()
+                temperatures.append(restarted.roomTemperature)
+        self.assertEqual(temperatures, [20.5, None])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+'''Module for unit test for LoadBalancer class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s control/tests -p "testLoadBalancer.py"
+'''
+
+import dataclasses
+import multiprocessing
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+from control.engine import ControlEngine # pylint: disable=import-error
+from control.loadbalancer import (BalanceEntry, LoadBalancer, # pylint: disable=import-error
+                                  SharedPowerBudget)
+from devices.thermostat import Thermostat # pylint: disable=import-error
+
+class PlannedThermostat(Thermostat):
+    '''Thermostat with fixed demand that records written setpoints.'''
+
+    def __init__(self, name: str, power: float, demand: bool, flexibility: int = 0):
+        super().__init__(configPath="devices/tests/test_config.json", history=MagicMock())
+        self._applyConfig(dataclasses.replace(self.config, name=name, power=power))
+        self.demand = demand
+        self.flexibility = flexibility
+        self.written = []
+
+    def getPlannedDemand(self, timestamp: float) -> bool:
+        return self.demand
+
+    def getHeatingFlexibility(self, timestamp: float) -> int:
+        return self.flexibility
+
+    async def refreshPlanAsync(self, timestamp: float) -> bool:
+        return True
+
+    async def getCurrentStatusAsync(self) -> dict:
+        return {'parameters': {'heatingSetpoint': 18.0}}
+
+    async def sendTempToDeviceAsync(self, newTemp: float) -> httpx.Response:
+        self.written.append(newTemp)
+        return httpx.Response(200)
+
+    def plotHistory(self) -> None:
+        pass
+
+class TestLoadBalancer(unittest.TestCase):
+    '''Unit tests for LoadBalancer class.'''
+
+    def _makeEntries(self, wanted: list[bool], flexibilities: list[int]) -> list[BalanceEntry]:
+        return [BalanceEntry(self.devices[index], 1000.0, wanted[index], flexibilities[index])
+                for index in range(len(wanted))]
+
+    def setUp(self):
+        self.devices = [PlannedThermostat(f'huone{index}', 1000.0, True) for index in range(4)]
+        self.balancer = LoadBalancer(2500.0)
+
+    def testLeastFlexibleHeatFirstAndDebtIsMadeUp(self):
+        '''Devices that cannot move heating get the capacity and deferred ones catch up.'''
+        decisions = self.balancer.balance(self._makeEntries([True] * 4, [5, 0, 9, 1]), 0.0)
+        self.assertEqual(decisions, {'huone0': False, 'huone1': True,
+                                     'huone2': False, 'huone3': True})
+        self.assertEqual(self.balancer.getDebt(self.devices[0]), 1)
+        decisions = self.balancer.balance(self._makeEntries([False] * 4, [0] * 4), 900.0)
+        self.assertEqual(decisions, {'huone0': True, 'huone1': False,
+                                     'huone2': True, 'huone3': False})
+        self.assertEqual(self.balancer.getDebt(self.devices[0]), 0)
+
+    def testEqualDevicesRotate(self):
+        '''Same device is not deferred on consecutive rounds when all are equal.'''
+        entries = self._makeEntries([True, True, True, False], [2, 2, 2, 0])
+        self.balancer.maxDebt = 0
+        first = self.balancer.balance(entries, 0.0)
+        second = self.balancer.balance(entries, 900.0)
+        self.assertEqual(sum(first.values()), 2)
+        self.assertNotEqual(first, second)
+
+    def testDevicesWithoutPowerFollowPlan(self):
+        '''Unconfigured power is not limited.'''
+        entries = [BalanceEntry(device, 0.0, True, 0) for device in self.devices]
+        self.assertTrue(all(self.balancer.balance(entries, 0.0).values()))
+
+    def testSameSlotReusesDecisions(self):
+        '''Rounds in the middle of a slot change neither decisions nor debts.'''
+        entries = self._makeEntries([True, True, True, False], [2, 2, 2, 0])
+        first = self.balancer.balance(entries, 0.0)
+        debts = dict(self.balancer.debts)
+        for _ in range(3):
+            self.assertEqual(self.balancer.balance(entries, 0.0), first)
+        self.assertEqual(self.balancer.debts, debts)
+        self.assertEqual(self.balancer.rounds, 1)
+
+    def testNewDeviceGetsCapacityThatIsLeft(self):
+        '''Device added in the middle of a slot does not displace decided devices.'''
+        entries = self._makeEntries([True, True, False, False], [2, 2, 0, 0])
+        self.assertEqual(sum(self.balancer.balance(entries[:3], 0.0).values()), 2)
+        decisions = self.balancer.balance(entries, 0.0)
+        self.assertEqual(decisions, {'huone0': True, 'huone1': True,
+                                     'huone2': False, 'huone3': False})
+        entries[3].wanted = True
+        self.balancer.forget(self.devices[3])
+        self.assertFalse(self.balancer.balance(entries, 0.0)['huone3'])
+        self.assertEqual(self.balancer.getDebt(self.devices[3]), 1)
+
+class TestSharedPowerBudget(unittest.TestCase):
+    '''Unit tests for power cap shared by worker processes.'''
+
+    def setUp(self):
+        reservations = multiprocessing.get_context('spawn').Array('d', 4)
+        self.budgets = [SharedPowerBudget(reservations, index) for index in range(2)]
+        self.balancers = [LoadBalancer(2500.0, budget=budget) for budget in self.budgets]
+        self.workers = [[PlannedThermostat(f'talo{worker}_{index}', 1000.0, True)
+                         for index in range(2)] for worker in range(2)]
+
+    def _balance(self, worker: int, slotStart: float) -> int:
+        entries = [BalanceEntry(device, 1000.0, True, 0) for device in self.workers[worker]]
+        return sum(self.balancers[worker].balance(entries, slotStart).values())
+
+    def testWorkersShareCap(self):
+        '''Second worker gets what the first one left and old slots do not count.'''
+        self.assertEqual((self._balance(0, 0.0), self._balance(1, 0.0)), (2, 0))
+        self.assertEqual(self.budgets[1].getReservedByOthers(0.0), 2000.0)
+        self.assertEqual((self._balance(1, 900.0), self._balance(0, 900.0)), (2, 0))
+        self.assertEqual(self._balance(0, 900.0), 0)
+        self.budgets[1].release()
+        self.assertEqual(self.budgets[0].getReservedByOthers(900.0), 0.0)
+
+class TestBalancedEngine(unittest.IsolatedAsyncioTestCase):
+    '''ControlEngine with load balancing.'''
+
+    @patch('builtins.print')
+    async def testOtherDevicesAreAdjustedInSameRound(self, _mockPrint):
+        '''Cycle of one device also releases a deferred device that got capacity.'''
+        first = PlannedThermostat('huone1', 1000.0, True, flexibility=0)
+        second = PlannedThermostat('huone2', 1000.0, True, flexibility=4)
+        engine = ControlEngine([first, second], loadBalancer=LoadBalancer(1500.0))
+        now = time.time()
+        self.assertEqual(await engine.runCycle([first, second], now), [True, True])
+        self.assertEqual((first.written, second.written), ([22.0], []))
+        first.demand = False
+        self.assertEqual(await engine.runCycle([first], now + 900), [True])
+        self.assertEqual((first.written, second.written), ([22.0, 18.0], [22.0]))
+
+if __name__ == '__main__':
+    unittest.main()
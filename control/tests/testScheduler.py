@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''Module for unit test for EventScheduler class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s control/tests -p "testScheduler.py"
+'''
+
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from apis.smartheating import HeatingPlan # pylint: disable=import-error
+from control.engine import ControlEngine # pylint: disable=import-error
+from control.scheduler import PLAN_CHANGE, PLAN_REFRESH, EventScheduler # pylint: disable=import-error
+from devices.thermostat import Thermostat # pylint: disable=import-error
+
+def makePlan(start: float, results: list[bool]) -> HeatingPlan:
+    '''Create plan with 15 minute slots starting at given epoch seconds.'''
+    startMs = int(start * 1000)
+    return HeatingPlan.fromResponse({
+        'PlanAhead': [{'epochMs': startMs + index * 900_000, 'result': result}
+                      for index, result in enumerate(results)],
+        'EpochMsExpiration': startMs + len(results) * 900_000,
+        'AverageTemperature': 0.0
+    })
+
+class FakeEngine(ControlEngine):
+    '''Engine that records which devices were run.'''
+
+    def __init__(self, devices):
+        super().__init__(devices)
+        self.cycles = []
+        self.prepared = []
+
+    async def runCycle(self, devices, timestamp, forceReadback=False):
+        self.cycles.append(list(devices))
+        return [True] * len(devices)
+
+    async def prepareTick(self, slotStart, devices=None):
+        self.prepared.append(list(devices))
+        return {}
+
+class TestEventScheduler(unittest.IsolatedAsyncioTestCase):
+    '''Unit tests for EventScheduler class.'''
+
+    def setUp(self):
+        self.now = float(int(time.time()))
+        self.start = self.now - 60
+        self.device = Thermostat("devices/tests/test_config.json", planCache=MagicMock(),
+                                 history=MagicMock())
+        self.device.planCache.refreshMargin = 300
+        # Heating is on for four hours and then off for four hours
+        self.device.plan = makePlan(self.start, [True] * 16 + [False] * 16)
+        self.engine = FakeEngine([self.device])
+        self.scheduler = EventScheduler(self.engine)
+
+    def testScheduleAtPlanChangeAndRefresh(self):
+        '''Device wakes only when the plan changes and before it expires.'''
+        self.scheduler.scheduleDevice(self.device, self.now)
+        events = sorted((event.when, event.kind) for event in self.scheduler.heap)
+        self.assertEqual(events, [
+            (self.start + 16 * 900 + self.engine.slotOffset, PLAN_CHANGE),
+            (self.start + 32 * 900 - 300, PLAN_REFRESH),
+        ])
+
+    def testRescheduleDropsOldEvents(self):
+        '''Old events of a rescheduled device are ignored.'''
+        self.scheduler.scheduleDevice(self.device, self.now)
+        self.device.plan = makePlan(self.start, [True] * 4 + [False] * 28)
+        self.scheduler.scheduleDevice(self.device, self.now)
+        self.assertEqual(self.scheduler.getNextWakeup(),
+                         self.start + 4 * 900 + self.engine.slotOffset)
+        self.assertEqual(len(self.scheduler._popDue(self.start + 32 * 900)), 2) # pylint: disable=protected-access
+
+    async def testRunDueOnlyRunsDueDevices(self):
+        '''Nothing is run before the change and the device is run at the change.'''
+        self.scheduler.scheduleDevice(self.device, self.now)
+        await self.scheduler.runDue(self.now)
+        self.assertEqual(self.engine.cycles, [])
+        await self.scheduler.runDue(self.start + 16 * 900 + self.engine.slotOffset)
+        self.assertEqual(self.engine.cycles, [[self.device]])
+        self.assertEqual(self.engine.prepared, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+'''Module for unit test for Supervisor class and shard assignment.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s control/tests -p "testSupervisor.py"
+'''
+
+import multiprocessing
+import time
+import unittest
+from collections import Counter
+from pathlib import Path
+from unittest.mock import patch
+
+from control.supervisor import (SHARD_BY_HASH, SHARD_BY_SITE, Supervisor, # pylint: disable=import-error
+                                WorkerContext, getOwner, getShardKey)
+
+ROOT = Path('configs')
+
+def flakyWorker(worker: WorkerContext) -> None:
+    '''Worker 0 crashes at once, others keep beating.'''
+    if worker.index == 0:
+        raise SystemExit(1)
+    while True:
+        worker.beat()
+        time.sleep(0.05)
+
+def wedgedWorker(worker: WorkerContext) -> None:
+    '''Worker whose event loop never beats.'''
+    time.sleep(30)
+
+class TestSharding(unittest.TestCase):
+    '''Unit tests for shard assignment.'''
+
+    def testShardKeys(self):
+        '''Devices of one site share a key, files in configs/ are sharded one by one.'''
+        self.assertEqual(getShardKey(ROOT / 'talo1' / 'olohuone.json', ROOT, SHARD_BY_SITE),
+                         'talo1')
+        self.assertEqual(getShardKey(ROOT / 'sauna.json', ROOT, SHARD_BY_SITE), 'sauna.json')
+        self.assertEqual(getShardKey(ROOT / 'talo1' / 'olohuone.json', ROOT, SHARD_BY_HASH),
+                         'talo1/olohuone.json')
+
+    def testRetiringWorkerMovesOnlyItsKeys(self):
+        '''Rendezvous hashing spreads keys and keeps keys of surviving workers in place.'''
+        keys = [f'talo{index}' for index in range(400)]
+        before = {key: getOwner(key, [0, 1, 2, 3]) for key in keys}
+        after = {key: getOwner(key, [0, 1, 3]) for key in keys}
+        self.assertTrue(all(count > 60 for count in Counter(before.values()).values()))
+        moved = [key for key in keys if before[key] != after[key]]
+        self.assertTrue(moved)
+        self.assertTrue(all(before[key] == 2 for key in moved))
+
+    def testEveryFileHasOneOwner(self):
+        '''Workers partition the configuration files.'''
+        context = multiprocessing.get_context('spawn')
+        live = context.Array('b', [1, 0, 1])
+        workers = [WorkerContext(index, ROOT, SHARD_BY_HASH, live, None, None)
+                   for index in range(3)]
+        paths = [ROOT / f'huone{index}.json' for index in range(50)]
+        owners = [[worker.index for worker in workers if worker.owns(path)] for path in paths]
+        self.assertTrue(all(len(owner) == 1 and owner[0] != 1 for owner in owners))
+
+class TestSupervisor(unittest.TestCase):
+    '''Unit tests for Supervisor class with real worker processes.'''
+
+    @patch('builtins.print')
+    def testCrashingWorkerIsRestartedAndThenRetired(self, _mockPrint):
+        '''Worker that keeps crashing is retired and the others are told to rebalance.'''
+        supervisor = Supervisor(2, flakyWorker, ROOT, maxRestarts=2)
+        supervisor.start()
+        try:
+            supervisor.processes[0].join(30)
+            self.assertEqual(supervisor.checkWorkers(), [0])
+            self.assertEqual(list(supervisor.live), [1, 1])
+            supervisor.processes[0].join(30)
+            self.assertEqual(supervisor.checkWorkers(), [0])
+            self.assertEqual(list(supervisor.live), [0, 1])
+            self.assertEqual(supervisor.version.value, 1)
+            self.assertTrue(supervisor.processes[1].is_alive())
+        finally:
+            supervisor.stop()
+
+    @patch('builtins.print')
+    def testWedgedWorkerIsReplaced(self, _mockPrint):
+        '''Worker without heartbeat is killed and started again; the last worker is never
+        retired.'''
+        supervisor = Supervisor(1, wedgedWorker, ROOT, wedgeTimeout=0.5, maxRestarts=1)
+        supervisor.start()
+        try:
+            first = supervisor.processes[0]
+            self.assertEqual(supervisor.checkWorkers(time.monotonic() + 1), [0])
+            self.assertFalse(first.is_alive())
+            self.assertIsNot(supervisor.processes[0], first)
+            self.assertEqual(list(supervisor.live), [1])
+        finally:
+            supervisor.stop()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+'''Module for device configuration. Configuration files are parsed and validated once
+into immutable objects so that the control loop does not touch the file system.'''
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+
+HEATING_PERCENTAGE_FIELDS = (
+    'HeatingPercentage_Plus30', 'HeatingPercentage_Plus20', 'HeatingPercentage_Plus10',
+    'HeatingPercentage_Zero', 'HeatingPercentage_Minus10', 'HeatingPercentage_Minus20',
+    'HeatingPercentage_Minus30'
+)
+
+class ConfigError(ValueError):
+    '''Raised when configuration file is missing fields or has invalid values.'''
+
+def _freeze(value):
+    '''Convert lists to tuples so that configuration values cannot be modified.'''
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+def _thaw(value):
+    '''Convert tuples back to lists for the API payload.'''
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+def _require(section: dict, field: str, types: tuple, path: Path):
+    '''Get field from configuration section and check its type.'''
+    if field not in section:
+        raise ConfigError(f'{path}: kenttä {field} puuttuu')
+    value = section[field]
+    if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+        raise ConfigError(f'{path}: kentän {field} arvo {value!r} on väärää tyyppiä')
+    return value
+
+def _requireHours(section: dict, field: str, path: Path) -> tuple[int, ...]:
+    '''Get list of hours 0-23 from configuration section.'''
+    hours = _require(section, field, (list,), path)
+    if not all(isinstance(hour, int) and 0 <= hour <= 23 for hour in hours):
+        raise ConfigError(f'{path}: kentässä {field} on virheellisiä tunteja {hours}')
+    return tuple(hours)
+
+@dataclass(frozen=True, slots=True)
+class DeviceConfig:
+    '''Validated configuration of one device.'''
+    path: Path
+    mtime: float
+    name: str
+    ip: str
+    type: str
+    tempLow: float
+    tempHigh: float
+    sensorMode: int | bool | None
+    backupHours: tuple[int, ...]
+    apiItems: tuple[tuple[str, object], ...]
+    power: float = 0.0
+    maxPreheat: int = 0
+
+    def getApiPayload(self) -> dict:
+        '''Get second part of configuration as payload for api-spot-hinta.fi.'''
+        return {field: _thaw(value) for field, value in self.apiItems}
+
+    def getApiValue(self, field: str, default=None):
+        '''Get single field from second part of configuration.'''
+        for key, value in self.apiItems:
+            if key == field:
+                return _thaw(value)
+        return default
+
+def parseDeviceConfig(parsedData: list, path: Path, mtime: float = 0.0) -> DeviceConfig:
+    '''Validate parsed JSON data and create configuration object.'''
+    if not isinstance(parsedData, list) or len(parsedData) < 2 \
+            or not all(isinstance(section, dict) for section in parsedData[:2]):
+        raise ConfigError(f'{path}: tiedostossa pitää olla kaksi objektia listassa')
+    device, api = parsedData[0], parsedData[1]
+    tempLow = float(_require(device, 'tempLow', (int, float), path))
+    tempHigh = float(_require(device, 'tempHigh', (int, float), path))
+    if tempLow > tempHigh:
+        raise ConfigError(f'{path}: tempLow {tempLow} on suurempi kuin tempHigh {tempHigh}')
+    name = _require(device, 'name', (str,), path)
+    ip = _require(device, 'ip', (str,), path)
+    if not name or not ip:
+        raise ConfigError(f'{path}: kentät name ja ip eivät saa olla tyhjiä')
+    _require(api, 'Region', (str,), path)
+    _require(api, 'HeatingSegments_PerDay', (int,), path)
+    _require(api, 'MinimumHeatingTime', (int,), path)
+    for field in HEATING_PERCENTAGE_FIELDS:
+        percentage = _require(api, field, (int, float), path)
+        if not 0 <= percentage <= 100:
+            raise ConfigError(f'{path}: kentän {field} arvo {percentage} ei ole välillä 0-100')
+    _requireHours(api, 'NightHours', path)
+    power = float(_require(device, 'power', (int, float), path)) if 'power' in device else 0.0
+    if power < 0:
+        raise ConfigError(f'{path}: kentän power arvo {power} on negatiivinen')
+    deviceType = _require(device, 'type', (str,), path)
+    # Only thermostats send sensorMode to the device, panels and heat pumps ignore it
+    if deviceType == 'thermostat':
+        sensorMode = _require(device, 'sensorMode', (int,), path)
+    else:
+        sensorMode = _require(device, 'sensorMode', (int, bool), path) \
+            if device.get('sensorMode') is not None else None
+    maxPreheat = _require(device, 'maxPreheat', (int,), path) if 'maxPreheat' in device else 0
+    if maxPreheat < 0:
+        raise ConfigError(f'{path}: kentän maxPreheat arvo {maxPreheat} on negatiivinen')
+    return DeviceConfig(
+        path=path,
+        mtime=mtime,
+        name=name,
+        ip=ip,
+        type=deviceType,
+        tempLow=tempLow,
+        tempHigh=tempHigh,
+        sensorMode=sensorMode,
+        backupHours=_requireHours(api, 'BackupHours', path),
+        apiItems=tuple((field, _freeze(value)) for field, value in api.items()),
+        power=power,
+        maxPreheat=maxPreheat
+    )
+
+def loadDeviceConfig(path: os.PathLike) -> DeviceConfig:
+    '''Read and validate configuration file.'''
+    path = Path(path)
+    try:
+        mtime = path.stat().st_mtime
+        with open(path, 'r', encoding='utf-8') as jsonFile:
+            parsedData = json.load(jsonFile)
+    except (OSError, ValueError) as err:
+        raise ConfigError(f'{path}: tiedostoa ei voitu lukea, virhe: {err}') from err
+    return parseDeviceConfig(parsedData, path, mtime)
+
+def reloadIfChanged(config: DeviceConfig) -> DeviceConfig:
+    '''Reload configuration if the file has been modified. Returns the same object if not.'''
+    try:
+        mtime = config.path.stat().st_mtime
+    except OSError:
+        return config
+    if mtime == config.mtime:
+        return config
+    return loadDeviceConfig(config.path)
@@ -1,193 +1,324 @@
 #!/usr/bin/env python3
 '''Module for Device base class.'''
 
-import json
+import math
 import time
 from collections import namedtuple
 from pathlib import Path
 
 import httpx
 
+from apis.httpclients import DEVICE, ClientPool, getSharedClientPool # pylint: disable=import-error
+from apis.localplanner import SLOT_MILLIS # pylint: disable=import-error
+from apis.retry import RetryEngine, getSharedRetryEngine # pylint: disable=import-error
+from apis.smartheating import HeatingPlan, PlanCache, getSharedPlanCache # pylint: disable=import-error
+from devices.config import ConfigError, DeviceConfig, loadDeviceConfig, reloadIfChanged # pylint: disable=import-error
+from devices.state import SetpointState # pylint: disable=import-error
+from devices.thermal import SLOT_HOURS, ThermalModel, selectPreheatSlots # pylint: disable=import-error
+from metrics.registry import SETPOINT_WRITE, STATUS_READ, MetricsRegistry, getSharedMetrics # pylint: disable=import-error
+from storage.history import HistoryStore, getSharedHistoryStore # pylint: disable=import-error
+
+Temp = namedtuple('Temp', 'low high')
+
 class Device:
     '''This provides the base class for the heating devices.'''
 
-    def __init__(self, configPath: Path):
+    def __init__(self, configPath: Path, config: DeviceConfig = None,
+                 planCache: PlanCache = None, clients: ClientPool = None,
+                 history: HistoryStore = None, retries: RetryEngine = None,
+                 metrics: MetricsRegistry = None):
         self.configPath = configPath
-        self.name = '' # This will be set in getConfiguration
-        self.ipAddress = '' # This will be set in getConfiguration
-        self.futurePlan = []
-        self.planExpiration = 0
-        self.sensorMode = None
+        self.planCache = planCache if planCache is not None else getSharedPlanCache()
+        self.clients = clients if clients is not None else getSharedClientPool()
+        self.history = history if history is not None else getSharedHistoryStore()
+        self.retries = retries if retries is not None else getSharedRetryEngine()
+        self.metrics = metrics if metrics is not None else getSharedMetrics()
+        self.plan = None
+        self.setpointState = SetpointState()
+        self.thermal = ThermalModel()
+        self.roomTemperature = None
+        self._applyConfig(config if config is not None else loadDeviceConfig(configPath))
+
+    def _applyConfig(self, config: DeviceConfig) -> None:
+        '''Take validated configuration into use.'''
+        self.config = config
+        self.name = config.name
+        self.ipAddress = config.ip
+        self.sensorMode = config.sensorMode
+        self.apiPayload = config.getApiPayload()
+
+    def reloadConfig(self, config: DeviceConfig = None) -> bool:
+        '''Reload configuration if the file has changed. Returns True if it was reloaded.
+        Invalid file keeps the previous configuration in use. Already loaded configuration
+        of the same file can be given to avoid reading it again.'''
+        if config is not None:
+            if config == self.config:
+                return False
+            self._applyConfig(config)
+            return True
+        try:
+            config = reloadIfChanged(self.config)
+        except ConfigError as err:
+            print(f'Muutettua konfiguraatiota ei otettu käyttöön: {err}')
+            return False
+        if config is self.config:
+            return False
+        self._applyConfig(config)
+        return True
 
     def getName(self) -> str:
         '''Get name of the device from configuration.'''
-        if not self.name:
-            self._getConfiguration()
         return self.name
 
     def _getTemps(self) -> tuple[float, float]:
         '''Get low and high temperature settings from configuration.'''
-        Temp = namedtuple('Temp', 'low high')
-        data = self._getConfiguration()
-        return Temp(data['tempLow'], data['tempHigh'])
+        return Temp(self.config.tempLow, self.config.tempHigh)
 
     def getIpAddress(self) -> str:
         '''Get IP address.'''
-        if not self.ipAddress:
-            self._getConfiguration()
         return self.ipAddress
 
+    def getPower(self) -> float:
+        '''Get heating power in watts from configuration, 0 if not configured.'''
+        return self.config.power
+
+    def _getHostClass(self) -> str:
+        '''Get host class of the requests, selects retry policy.'''
+        return DEVICE
 
-    def _getConfiguration(self) -> dict:
-        '''Read first part of configuration from file.'''
-        with open(self.configPath, 'r', encoding='utf-8') as jsonFile:
-            data = jsonFile.read()
-        parsedData = json.loads(data)
-        self.name = parsedData[0]['name']
-        self.sensorMode = parsedData[0]['sensorMode']
-        self.ipAddress = parsedData[0]['ip']
-        return parsedData[0]
-
-    def _getApiConfiguration(self) -> dict:
-        '''Read second part of configuration from file.'''
-        with open(self.configPath, 'r', encoding='utf-8') as jsonFile:
-            data = jsonFile.read()
-        parsedData = json.loads(data)
-        return parsedData[1]
-
-    def _getLocalTimeFromEpoch(self, epoch: int) -> str:
-        '''Convert epoch milliseconds to local time string.'''
-        epochToLocal = time.localtime(epoch // 1000)
-        strTimeLocal = time.strftime('%H:%M:%S (%a %d %b)', epochToLocal)
-        return strTimeLocal
+    def _getHostKey(self) -> str:
+        '''Get key of the host that answers the requests of the device.'''
+        return self.getIpAddress().split('/')[0]
+
+    async def _runWithRetriesAsync(self, operation) -> httpx.Response:
+        '''Run request with retries and circuit breakers of the device and its host.'''
+        return await self.retries.runAsync(self._getHostClass(), operation,
+                                           f'Laite {self.getName()}', self.getName(),
+                                           self._getHostKey())
 
     def _getHeatingValuesFromFuturePlan(self, epoch: int) -> bool:
         '''Get heating values from future plan.'''
-        returnValue = False
-        setDone = False
-        expirationLocalTime = self._getLocalTimeFromEpoch(self.planExpiration)
-        print(f'Tuleva suunnitelma, joka vanhenee {expirationLocalTime}:')
-        for item in self.futurePlan:
-            planTimeLocal = self._getLocalTimeFromEpoch(item['epochMs'])
-            if epoch > item['epochMs']and not setDone:
-                print(f'Aika: {planTimeLocal}, Lämmitystarve: {item['result']} (VOIMASSA NYT)')
-                returnValue = item['result']
-                setDone = True
-            else:
-                print(f'Aika: {planTimeLocal}, Lämmitystarve: {item['result']}.')
-        if not setDone:
+        self.plan.logPlan(epoch)
+        demand = self.plan.getDemand(epoch)
+        if demand is None:
             print('Ei löytynyt sopivaa aikaväliä tulevasta suunnitelmasta, ' \
                   'käytetään backup-tunteja.')
             hour = time.localtime(epoch // 1000).tm_hour
-            backupHours = self._getApiConfiguration()['BackupHours']
-            if hour in backupHours:
-                returnValue = True
-        return returnValue
-
-    def getHeatingDemand(self) -> bool:
-        '''Get heating demand from future plan or fetch new plan if needed.'''
-        timestamp = time.time()
+            return hour in self.config.backupHours
+        return demand
+
+    def getNextPlanChange(self, timestamp: float) -> float:
+        '''Get epoch seconds when heating demand changes next according to the current
+        plan. Inside the pre-heat window demand can change on every slot. Returns None if
+        there is no plan.'''
+        if self.plan is None:
+            return None
         timeMillis = int(timestamp * 1000)
-        if timeMillis > self.planExpiration or not self.futurePlan:
-            gotNewPlan = self._getNewPlan()
-            if not gotNewPlan:
-                print('api-spot-hinta.fi:stä ei saatu tarvittavia tietoja. ' \
-                      'Käytetään asetettuja backup-tunteja.')
-                hour = time.localtime(timestamp).tm_hour
-                backupHours = self._getApiConfiguration()['BackupHours']
-                if hour in backupHours:
-                    return True
-                return False
-        return self._getHeatingValuesFromFuturePlan(timeMillis)
-
-    def _getNewPlan(self) -> bool:
-        '''Get new heating plan from api-spot-hinta.fi.'''
-        url = 'https://api.spot-hinta.fi/SmartHeating'
-        data = self._getApiConfiguration()
-        attempts = 3
-        gotResponse = False
-        for attempt in range(attempts):
-            try:
-                response = httpx.post(url, json=data, timeout=20)
-                if response.status_code == 200:
-                    gotResponse = True
-                    responseJson = response.json()
-                    self.futurePlan = responseJson['PlanAhead']
-                    self.planExpiration = responseJson['EpochMsExpiration']
-                    print(f'Saatiin uusi suunnitelma, voimasssa '
-                          f'{self._getLocalTimeFromEpoch(self.planExpiration)} asti.\n' \
-                          f'Vuorokauden keskilämpötila {responseJson['AverageTemperature']} C.')
-                else:
-                    print(f'Saatiin koodi {response.status_code}. Päättele siitä.')
-            except (httpx.RequestError, httpx.HTTPStatusError) as err:
-                print(f'api-spot-hinta.fi ei vastannut, virhe: {err}. Yritetään 10 sekunnin ' \
-                      f'päästä uudelleen. Yritys {attempt + 1} / {attempts}')
-                time.sleep(10)
-            else:
-                return gotResponse
-        return gotResponse
+        change = self.plan.getNextChange(timeMillis)
+        window = self._getPreheatWindow(timeMillis, self.config.maxPreheat * 60 // 900)
+        if window is not None:
+            nextSlot = (timeMillis // SLOT_MILLIS + 1) * SLOT_MILLIS
+            change = min(change, max(window[0], nextSlot))
+        return change / 1000
+
+    def _getOutdoorTemperature(self) -> float:
+        '''Get outdoor temperature of the plan or of the region in the local planner.'''
+        if self.plan is not None and self.plan.averageTemperature is not None:
+            return float(self.plan.averageTemperature)
+        temperature = self.planCache.localPlanner.temperatures.get(self.apiPayload.get('Region'))
+        return float(temperature) if temperature is not None else None
+
+    def _getPreheatWindow(self, timeMillis: int, slots: int) -> tuple[int, int]:
+        '''Get (start, heating start) epoch milliseconds of the pre-heat window of the next
+        planned heating, which is twice the pre-heat time long. Returns None if heating is
+        on, pre-heating is not in use or the model has not learned the room yet.'''
+        if slots <= 0 or self.plan is None or not self.thermal.isReady() \
+                or self.plan.getDemand(timeMillis) is not False:
+            return None
+        heatingStart = self.plan.getNextChange(timeMillis)
+        if heatingStart >= self.plan.expiration:
+            return None
+        return heatingStart - 2 * slots * SLOT_MILLIS, heatingStart
+
+    def _getPreheatDemand(self, timestamp: float) -> bool:
+        '''Check if heating should start before the next planned heating so that the room
+        has reached tempHigh when it starts. The predicted pre-heat time is spent in the
+        cheapest slots of the pre-heat window.'''
+        maxSlots = self.config.maxPreheat * 60 // 900
+        if maxSlots <= 0 or self.roomTemperature is None:
+            return False
+        outdoor = self._getOutdoorTemperature()
+        if outdoor is None:
+            return False
+        hours = self.thermal.getPreheatTime(self.roomTemperature, self._getTemps().high, outdoor)
+        slots = maxSlots if hours is None else min(maxSlots, math.ceil(hours / SLOT_HOURS))
+        timeMillis = int(timestamp * 1000)
+        window = self._getPreheatWindow(timeMillis, slots)
+        currentStart = timeMillis - timeMillis % SLOT_MILLIS
+        if window is None or currentStart < window[0]:
+            return False
+        starts = list(range(window[0], window[1], SLOT_MILLIS))
+        prices = self.planCache.localPlanner.getPrices(self.apiPayload.get('Region'), starts)
+        return currentStart in selectPreheatSlots(starts, prices, slots)
+
+    def _getBackupDemand(self, timestamp: float) -> bool:
+        '''Get heating demand from configured backup hours.'''
+        print('api-spot-hinta.fi:stä ei saatu tarvittavia tietoja. ' \
+              'Käytetään asetettuja backup-tunteja.')
+        hour = time.localtime(timestamp).tm_hour
+        return hour in self.config.backupHours
+
+    def getPlannedDemand(self, timestamp: float) -> bool:
+        '''Get heating demand of the current plan or backup hours without fetching a plan.'''
+        timeMillis = int(timestamp * 1000)
+        demand = self.plan.getDemand(timeMillis) if self.plan is not None else None
+        if demand is None:
+            return time.localtime(timestamp).tm_hour in self.config.backupHours
+        return demand or self._getPreheatDemand(timestamp)
+
+    def getHeatingFlexibility(self, timestamp: float) -> int:
+        '''Get number of slots without heating left in the current plan. Heating can be
+        moved into them without heating less than planned.'''
+        if self.plan is None:
+            return 0
+        index = self.plan.getActiveIndex(int(timestamp * 1000))
+        if index < 0:
+            return 0
+        return self.plan.results[index + 1:].count(0)
+
+    async def getHeatingDemandAsync(self, timestamp: float = None) -> bool:
+        '''Get heating demand for given time without blocking the event loop.'''
+        if timestamp is None:
+            timestamp = time.time()
+        if not await self.refreshPlanAsync(timestamp):
+            return self._getBackupDemand(timestamp)
+        return self._getHeatingValuesFromFuturePlan(int(timestamp * 1000)) \
+            or self._reportPreheat(timestamp)
+
+    def _reportPreheat(self, timestamp: float) -> bool:
+        '''Get pre-heat demand and tell when it is on.'''
+        if not self._getPreheatDemand(timestamp):
+            return False
+        print(f'Esilämmitetään laitetta {self.getName()}, huone on {self.roomTemperature} C ' \
+              'ja suunniteltu lämmitys alkaa pian.')
+        return True
+
+    async def refreshPlanAsync(self, timestamp: float) -> bool:
+        '''Get plan valid at given time from shared plan cache. The cache fetches a new plan
+        from api-spot-hinta.fi only if no device has done it already.'''
+        plan = await self.planCache.getPlanAsync(self.apiPayload, timestamp)
+        return self._applyPlan(plan)
+
+    def _applyPlan(self, plan: HeatingPlan) -> bool:
+        '''Take plan from the cache into use. Returns False if there is no valid plan.'''
+        if plan is None:
+            return False
+        self.plan = plan
+        return True
 
     def _getCurrentTemperature(self, status: dict) -> float:
         '''Get current temperature from status dictionary.'''
         return status['parameters']['heatingSetpoint']
 
-    def adjustTempSetpoint(self, status: dict, heating: bool) -> None:
-        '''Adjust temperature setpoint based on current status and heating demand.'''
+    async def adjustTempSetpointAsync(self, status: dict, heating: bool,
+                                      timestamp: float = None) -> bool:
+        '''Adjust temperature setpoint without blocking the event loop. If status is None the
+        cached setpoint is trusted and nothing is written when it already matches.'''
         temps = self._getTemps()
-        currentTemp = self._getCurrentTemperature(status)
+        if status is None:
+            currentTemp = self.setpointState.setpoint
+        else:
+            currentTemp = self._getCurrentTemperature(status)
+            self.setpointState.confirmRead(currentTemp,
+                                           time.time() if timestamp is None else timestamp)
         if heating: #heating on
-            return self._setTemp(temps.high, currentTemp)
-        return self._setTemp(temps.low, currentTemp)
+            return await self._setTempAsync(temps.high, currentTemp)
+        return await self._setTempAsync(temps.low, currentTemp)
+
+    def _getStatusUrl(self) -> str:
+        '''Get url for status query.'''
+        return 'http://' + self.getIpAddress() + '/api/status'
 
-    def _getStatusResponse(self) -> httpx.Response:
-        '''Get response for status query from device.'''
-        url = 'http://' + self.getIpAddress() + '/api/status'
-        response = httpx.get(url)
+    async def _getStatusResponseAsync(self) -> httpx.Response:
+        '''Get response for status query from device without blocking the event loop.'''
+        client = self.clients.getAsyncClient(DEVICE)
+        response = await client.get(self._getStatusUrl())
         return response
 
-    def getCurrentStatus(self) -> dict:
-        '''Get current status from device.'''
-        attempts = 5
-        responseJson = None
-        for attempt in range(attempts):
-            try:
-                response = self._getStatusResponse()
-                if response.status_code == 200:
-                    responseJson = response.json()
-                    self.printStatus(responseJson)
-                else:
-                    print(f'Laite vastasi koodilla {response.status_code}')
-            except (httpx.RequestError, httpx.HTTPStatusError) as err:
-                print(f'Laitteeseen ei saatu yhteyttä, virhe: {err}. Yritetään 5 sekunnin ' \
-                      f'päästä uudelleen. Yritys {attempt + 1} / {attempts}')
-                time.sleep(5)
-            else:
-                return responseJson
+    def _handleStatusResponse(self, response: httpx.Response) -> dict:
+        '''Parse and print status response. Returns None if device did not answer 200.'''
+        if response.status_code != 200:
+            print(f'Laite vastasi koodilla {response.status_code}')
+            return None
+        responseJson = response.json()
+        self.printStatus(responseJson)
+        self._recordStatus(responseJson)
         return responseJson
 
-    def _setTemp(self, newTemp: float, oldTemp: float) -> bool:
-        '''Set new temperature to device.'''
+    def _recordStatus(self, responseJson: dict) -> None:
+        '''Store room, floor and setpoint temperatures of status response to history.'''
+        try:
+            roomTemp, floorTemp, setpoint = self._getHistorySample(responseJson)
+        except KeyError:
+            return
+        now = time.time()
+        self.history.append(self.getName(), now, roomTemp, floorTemp, setpoint)
+        if roomTemp is not None:
+            self.roomTemperature = roomTemp
+            self.thermal.addSample(now, roomTemp, setpoint, self._getOutdoorTemperature())
+
+    async def getCurrentStatusAsync(self) -> dict:
+        '''Get current status from device without blocking the event loop.'''
+        start = time.perf_counter()
+        try:
+            response = await self._runWithRetriesAsync(self._getStatusResponseAsync)
+        except (httpx.RequestError, httpx.HTTPStatusError) as err:
+            print(f'Laitteeseen ei saatu yhteyttä, virhe: {err}')
+            return None
+        finally:
+            self.metrics.phaseSeconds.observe(time.perf_counter() - start, STATUS_READ)
+        return self._handleStatusResponse(response)
+
+    def _handleSetTempResponse(self, response: httpx.Response, newTemp: float) -> None:
+        '''Print result of setpoint write.'''
+        self.metrics.setpointWrites.inc(self.getName(), str(response.status_code))
+        if response.status_code == 200:
+            print(f'Laitteeseen asetettiin uusi lämpötila {newTemp} astetta.')
+            now = time.time()
+            self.history.append(self.getName(), now, setpoint=newTemp)
+            self.thermal.addSetpoint(now, newTemp)
+        else:
+            print(f'Laite vastasi koodilla {response.status_code}')
+
+    async def _setTempAsync(self, newTemp: float, oldTemp: float) -> bool:
+        '''Set new temperature to device without blocking the event loop.'''
         if newTemp == oldTemp:
             print(f'Ei tarvetta muuttaa lämpötilaa! Vanha ja uusi on samat {oldTemp} astetta.')
+            self.metrics.skippedWrites.inc(self.getName())
             return True
-        attempts = 5
-        for attempt in range(attempts):
-            try:
-                response = self.sendTempToDevice(newTemp)
-                if response.status_code == 200:
-                    print(f'Laitteeseen asetettiin uusi lämpötila {newTemp} astetta.')
-                else:
-                    print(f'Laite vastasi koodilla {response.status_code}')
-            except (httpx.RequestError, httpx.HTTPStatusError) as err:
-                print(f'Laitteeseen ei saatu yhteyttä, virhe: {err}. Yritetään 5 sekunnin ' \
-                      f'päästä uudelleen. Yritys {attempt + 1} / {attempts}')
-                time.sleep(5)
-            else:
-                return True
-        return False
+        start = time.perf_counter()
+        try:
+            response = await self._runWithRetriesAsync(lambda: self.sendTempToDeviceAsync(newTemp))
+        except (httpx.RequestError, httpx.HTTPStatusError) as err:
+            print(f'Laitteeseen ei saatu yhteyttä, virhe: {err}')
+            self.metrics.setpointWrites.inc(self.getName(), 'error')
+            self.setpointState.invalidate()
+            return False
+        finally:
+            self.metrics.phaseSeconds.observe(time.perf_counter() - start, SETPOINT_WRITE)
+        self._handleSetTempResponse(response, newTemp)
+        if response.status_code == 200:
+            self.setpointState.confirmWrite(newTemp, time.time())
+        else:
+            self.setpointState.invalidate()
+        return True
 
     def plotHistory(self) -> None:
         '''Plot history of temperature changes.'''
+        print(self.history.renderHistory(self.getName()))
+
+    def _getHistorySample(self, responseJson: dict) -> tuple[float, float, float]:
+        '''Get room, floor and setpoint temperatures from status response.'''
         # This should be implemented in subclasses
         raise NotImplementedError
 
@@ -196,8 +327,8 @@ class Device:
         # This should be implemented in subclasses
         raise NotImplementedError
 
-    def sendTempToDevice(self, newTemp: float) -> httpx.Response:
-        '''Send new temperature to device.'''
+    async def sendTempToDeviceAsync(self, newTemp: float) -> httpx.Response:
+        '''Send new temperature to device without blocking the event loop.'''
         # This should be implemented in subclasses
         raise NotImplementedError
 
@@ -6,14 +6,25 @@ import os
 
 import httpx
 
-from apis.homeassistant import HomeAssistantClient  # pylint: disable=import-error
+from apis.homeassistant import (STATE_MODES, HomeAssistantClient,  # pylint: disable=import-error
+                                HomeAssistantStateMirror, getSharedStateMirror)
+from apis.httpclients import HOME_ASSISTANT, ClientPool  # pylint: disable=import-error
+from apis.retry import RetryEngine  # pylint: disable=import-error
+from apis.smartheating import PlanCache  # pylint: disable=import-error
+from devices.config import DeviceConfig  # pylint: disable=import-error
 from devices.device import Device  # pylint: disable=import-error
+from metrics.registry import MetricsRegistry  # pylint: disable=import-error
+from storage.history import HistoryStore  # pylint: disable=import-error
 
 class HeatPump(Device):
     '''Class for heat pump device connected to HA.'''
-    def __init__(self, configPath: os.PathLike):
-        super().__init__(configPath)
+    def __init__(self, configPath: os.PathLike, config: DeviceConfig = None,
+                 planCache: PlanCache = None, clients: ClientPool = None,
+                 history: HistoryStore = None, retries: RetryEngine = None,
+                 metrics: MetricsRegistry = None):
+        super().__init__(configPath, config, planCache, clients, history, retries, metrics)
         self.client = self._initHomeAssistantClient()
+        self.mirror = self._initStateMirror()
 
     def printStatus(self, responseJson: dict) -> None:
         '''Print current status of the heat pump.'''
@@ -24,9 +35,18 @@ class HeatPump(Device):
         except KeyError:
             print("Error: Could not retrieve status information from response.")
 
-    def plotHistory(self) -> None:
-        '''Plot history of heat pump data.'''
-        print('\n\n')
+    def _getHistorySample(self, responseJson: dict) -> tuple[float, float, float]:
+        '''Get room and setpoint temperatures from status response.'''
+        return (responseJson['attributes']['current_temperature'], None,
+                responseJson['attributes']['temperature'])
+
+    def _getHostClass(self) -> str:
+        '''Requests go to Home Assistant.'''
+        return HOME_ASSISTANT
+
+    def _getHostKey(self) -> str:
+        '''All heat pumps share the breaker of the Home Assistant instance.'''
+        return self.client.baseUrl if self.client is not None else 'homeassistant'
 
     def _initHomeAssistantClient(self) -> HomeAssistantClient:
         '''Initialize session to Home Assistant.'''
@@ -36,12 +56,28 @@ class HeatPump(Device):
             print('HA_URL tai HA_TOKEN ympäristömuuttujaa '\
                   'ei ole asetettu. Lämpöpumppua ei voida ohjata.')
             return None
-        client = HomeAssistantClient(url, token)
+        client = HomeAssistantClient(url, token, self.clients)
         return client
 
-    def sendTempToDevice(self, newTemp: float) -> httpx.Response:
-        '''Send new temperature to heat pump.'''
-        return self.client.setTemperature(self.ipAddress, newTemp)
+    def _initStateMirror(self) -> HomeAssistantStateMirror:
+        '''Initialize shared state mirror according to HA_STATE_MODE environment variable.
+        Mode single queries every entity separately, bulk fetches all climate entities with
+        one request and websocket keeps the states up to date with a subscription.'''
+        mode = os.getenv('HA_STATE_MODE', 'bulk')
+        if mode not in STATE_MODES:
+            print(f'Tuntematon HA_STATE_MODE {mode}, käytetään bulk-tilaa.')
+            mode = 'bulk'
+        if self.client is None or mode == 'single':
+            return None
+        mirror = getSharedStateMirror(self.client, useWebsocket=mode == 'websocket')
+        mirror.track(self.getIpAddress())
+        return mirror
+
+    async def sendTempToDeviceAsync(self, newTemp: float) -> httpx.Response:
+        '''Send new temperature to heat pump without blocking the event loop.'''
+        if self.mirror is not None:
+            return await self.mirror.setTemperatureAsync(self.getIpAddress(), newTemp)
+        return await self.client.setTemperatureAsync(self.getIpAddress(), newTemp)
 
     def _checkValidResponse(self, response: httpx.Response) -> None:
         '''Check if the response from Home Assistant is valid.'''
@@ -53,9 +89,13 @@ class HeatPump(Device):
         except KeyError as exc:
             raise httpx.RequestError('Ei validia JSONia') from exc
 
-    def _getStatusResponse(self) -> httpx.Response:
-        '''Get response for status query from device.'''
-        response = self.client.getStatus(self.ipAddress)
+    async def _getStatusResponseAsync(self) -> httpx.Response:
+        '''Get response for status query from device without blocking the event loop.'''
+        if self.mirror is None:
+            response = await self.client.getStatusAsync(self.getIpAddress())
+        else:
+            state = await self.mirror.getStateAsync(self.getIpAddress())
+            response = httpx.Response(200, json=state) if state else httpx.Response(404)
         self._checkValidResponse(response)
         return response
 
@@ -3,13 +3,16 @@
 
 import httpx
 
+from apis.httpclients import DEVICE # pylint: disable=import-error
+from devices.config import DeviceConfig # pylint: disable=import-error
 from devices.device import Device # pylint: disable=import-error
 
 class Panel(Device):
     '''Class for panel device.'''
 
-    def __init__(self, configPath: str):
-        super().__init__(configPath)
+    def _applyConfig(self, config: DeviceConfig) -> None:
+        '''Take configuration into use. Panels are always controlled by their own sensor.'''
+        super()._applyConfig(config)
         self.sensorMode = False
 
     def printStatus(self, responseJson: dict) -> None:
@@ -21,13 +24,18 @@ class Panel(Device):
         except KeyError:
             print('Ei saatu kunnon vastausta patterilta.')
 
-    def plotHistory(self):
-        '''Plot history of panel data.'''
-        print('\n\n')
+    def _getHistorySample(self, responseJson: dict) -> tuple[float, float, float]:
+        '''Get room and setpoint temperatures from status response. Panel has no floor sensor.'''
+        return (responseJson['roomTemperature'], None,
+                responseJson['parameters']['heatingSetpoint'])
 
-    def sendTempToDevice(self, newTemp: float) -> httpx.Response:
-        '''Send new temperature to panel.'''
-        url = f'http://{self.getIpAddress()}/api/parameters?heatingSetpoint' \
-              f'={newTemp}&panelMode=1&sensorMode={self.sensorMode}'
-        response = httpx.post(url, timeout=10)
+    def _getSetpointUrl(self, newTemp: float) -> str:
+        '''Get url for setting new temperature to panel.'''
+        return f'http://{self.getIpAddress()}/api/parameters?heatingSetpoint' \
+               f'={newTemp}&panelMode=1&sensorMode={self.sensorMode}'
+
+    async def sendTempToDeviceAsync(self, newTemp: float) -> httpx.Response:
+        '''Send new temperature to panel without blocking the event loop.'''
+        client = self.clients.getAsyncClient(DEVICE)
+        response = await client.post(self._getSetpointUrl(newTemp))
         return response
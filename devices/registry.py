@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+'''Module for device driver registry. A driver is a class derived from Device that is
+selected by the type field of the configuration. The registry keeps "module:Class"
+references and imports a driver only when the first device of its type is created, so
+start-up does not slow down as drivers are added. Drivers of installed packages are found
+from the heatingcontrol.drivers entry point group and others can be given with the
+DEVICE_DRIVERS environment variable, for example "shelly=shellydriver:ShellyRelay".'''
+
+import importlib
+import os
+from importlib.metadata import entry_points
+from pathlib import Path
+
+from devices.config import DeviceConfig, loadDeviceConfig # pylint: disable=import-error
+from devices.device import Device # pylint: disable=import-error
+
+DRIVER_GROUP = 'heatingcontrol.drivers'
+BUILTIN_DRIVERS = {
+    'panel': 'devices.panel:Panel',
+    'thermostat': 'devices.thermostat:Thermostat',
+    'heatpump': 'devices.heatpump:HeatPump',
+}
+
+def parseDriverReferences(text: str) -> dict[str, str]:
+    '''Parse "type=module:Class,type=module:Class". Raises ValueError if an item is invalid.'''
+    references = {}
+    for item in filter(None, (item.strip() for item in text.split(','))):
+        deviceType, _, reference = item.partition('=')
+        if not deviceType or ':' not in reference:
+            raise ValueError(f'Virheellinen ajuri {item}, muoto on tyyppi=moduuli:Luokka')
+        references[deviceType.strip()] = reference.strip()
+    return references
+
+class DriverRegistry:
+    '''Device types and their lazily imported driver classes.'''
+
+    def __init__(self, references: dict[str, str] = None, group: str = DRIVER_GROUP) -> None:
+        self.references = dict(BUILTIN_DRIVERS if references is None else references)
+        self.group = group
+        self.drivers = {}
+        self.entryPoints = None
+
+    def register(self, deviceType: str, driver: type | str) -> None:
+        '''Register driver class or "module:Class" reference for device type.'''
+        self.drivers.pop(deviceType, None)
+        if isinstance(driver, str):
+            self.references[deviceType] = driver
+        else:
+            self.drivers[deviceType] = driver
+
+    def _getEntryPoints(self) -> dict:
+        '''Get driver entry points of installed packages. Packages are searched only once
+        and only when a type has no registered driver.'''
+        if self.entryPoints is None:
+            self.entryPoints = {entryPoint.name: entryPoint
+                                for entryPoint in entry_points(group=self.group)}
+        return self.entryPoints
+
+    def getTypes(self) -> list[str]:
+        '''Get all known device types without importing their drivers.'''
+        return sorted(set(self.references) | set(self.drivers) | set(self._getEntryPoints()))
+
+    def getDriver(self, deviceType: str) -> type:
+        '''Get driver class of device type, importing it on first use. Raises KeyError if the
+        type is unknown and ImportError or AttributeError if the driver cannot be loaded.'''
+        driver = self.drivers.get(deviceType)
+        if driver is not None:
+            return driver
+        reference = self.references.get(deviceType)
+        if reference is not None:
+            moduleName, _, className = reference.partition(':')
+            driver = getattr(importlib.import_module(moduleName), className)
+        else:
+            entryPoint = self._getEntryPoints().get(deviceType)
+            if entryPoint is None:
+                raise KeyError(deviceType)
+            driver = entryPoint.load()
+        self.drivers[deviceType] = driver
+        return driver
+
+    def createDevice(self, path: Path, config: DeviceConfig = None) -> Device:
+        '''Create device with the driver of its type. Raises ConfigError if the configuration
+        is invalid. Returns None if the type is unknown or its driver cannot be loaded.'''
+        config = config if config is not None else loadDeviceConfig(path)
+        try:
+            driver = self.getDriver(config.type)
+        except KeyError:
+            print(f'Tiedostossa {path} on tuntematon laitetyyppi {config.type}, objektia ei luoda.')
+            return None
+        except (ImportError, AttributeError) as err:
+            print(f'Laitetyypin {config.type} ajuria ei voitu ladata, virhe: {err}')
+            return None
+        return driver(path, config)
+
+_SHARED_REGISTRY = None
+
+def getSharedDriverRegistry() -> DriverRegistry:
+    '''Get process-wide driver registry with the drivers of DEVICE_DRIVERS.'''
+    global _SHARED_REGISTRY # pylint: disable=global-statement
+    if _SHARED_REGISTRY is None:
+        _SHARED_REGISTRY = DriverRegistry()
+        for deviceType, reference in parseDriverReferences(
+                os.getenv('DEVICE_DRIVERS', '')).items():
+            _SHARED_REGISTRY.register(deviceType, reference)
+    return _SHARED_REGISTRY
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+'''Module for cached setpoint state of a device. The last confirmed setpoint lets the
+control loop skip status reads and writes while nothing has changed.'''
+
+from dataclasses import dataclass
+
+@dataclass(slots=True)
+class SetpointState:
+    '''Last setpoint known to be in the device and when it was confirmed.'''
+    setpoint: float = None
+    writtenAt: float = 0.0
+    readAt: float = 0.0
+    suspect: bool = True
+
+    def needsReadback(self, now: float, interval: float) -> bool:
+        '''Check if the setpoint has to be read from the device before it can be trusted.'''
+        return self.suspect or self.setpoint is None or now - self.readAt >= interval
+
+    def confirmRead(self, setpoint: float, now: float) -> None:
+        '''Store setpoint read from the device.'''
+        self.setpoint = setpoint
+        self.readAt = now
+        self.suspect = False
+
+    def confirmWrite(self, setpoint: float, now: float) -> None:
+        '''Store setpoint that the device accepted.'''
+        self.setpoint = setpoint
+        self.writtenAt = now
+
+    def invalidate(self) -> None:
+        '''Mark cached setpoint unreliable, for example after a failed write.'''
+        self.suspect = True
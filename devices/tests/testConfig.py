@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+'''Module for unit test for device configuration.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s devices/tests -p "testConfig.py"
+'''
+
+import dataclasses
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+from devices.config import ConfigError, loadDeviceConfig, reloadIfChanged # pylint: disable=import-error
+
+class TestConfig(unittest.TestCase):
+    '''Unit tests for configuration loading.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.path = Path(self.tmpDir.name) / 'room.json'
+        shutil.copy('devices/tests/test_config.json', self.path)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def _writeConfig(self, deviceChanges: dict = None, apiChanges: dict = None) -> None:
+        '''Write modified test configuration.'''
+        with open('devices/tests/test_config.json', 'r', encoding='utf-8') as jsonFile:
+            parsedData = json.load(jsonFile)
+        parsedData[0].update(deviceChanges or {})
+        parsedData[1].update(apiChanges or {})
+        with open(self.path, 'w', encoding='utf-8') as jsonFile:
+            json.dump(parsedData, jsonFile)
+
+    def testLoadValidConfig(self):
+        '''Valid configuration is parsed into immutable object.'''
+        config = loadDeviceConfig(self.path)
+        self.assertEqual(config.name, 'default')
+        self.assertEqual(config.tempHigh, 22.0)
+        self.assertEqual(config.backupHours, (0, 1, 2, 3, 4, 5, 6, 21, 22, 23))
+        self.assertEqual(config.getApiPayload()['NightHours'], [22, 23, 0, 1, 2, 3, 4, 5, 6])
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            config.tempHigh = 30.0
+
+    def testInvalidFieldsFail(self):
+        '''Missing or invalid fields raise ConfigError.'''
+        invalid = [
+            ({'tempLow': 'kylmä'}, None),
+            ({'tempLow': 25.0}, None),
+            (None, {'HeatingPercentage_Zero': 140}),
+            (None, {'BackupHours': [0, 24]}),
+        ]
+        for deviceChanges, apiChanges in invalid:
+            self._writeConfig(deviceChanges, apiChanges)
+            with self.assertRaises(ConfigError):
+                loadDeviceConfig(self.path)
+
+    def testSensorModeIsRequiredOnlyFromThermostats(self):
+        '''Panels and heat pumps accept false or a missing sensorMode.'''
+        for deviceChanges in ({'type': 'panel', 'sensorMode': False},
+                              {'type': 'heatpump', 'sensorMode': None}):
+            self._writeConfig(deviceChanges)
+            self.assertEqual(loadDeviceConfig(self.path).sensorMode, deviceChanges['sensorMode'])
+        for sensorMode in (False, None):
+            self._writeConfig({'type': 'thermostat', 'sensorMode': sensorMode})
+            with self.assertRaises(ConfigError):
+                loadDeviceConfig(self.path)
+
+    def testReloadOnlyWhenModified(self):
+        '''Configuration is reloaded only when mtime changes.'''
+        config = loadDeviceConfig(self.path)
+        self.assertIs(reloadIfChanged(config), config)
+        self._writeConfig({'tempHigh': 23.0})
+        os.utime(self.path, (config.mtime + 10, config.mtime + 10))
+        reloaded = reloadIfChanged(config)
+        self.assertEqual(reloaded.tempHigh, 23.0)
+
+if __name__ == '__main__':
+    unittest.main()
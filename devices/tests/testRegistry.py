@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''Module for unit test for DriverRegistry class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s devices/tests -p "testRegistry.py"
+'''
+
+import dataclasses
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from devices.config import loadDeviceConfig # pylint: disable=import-error
+from devices.registry import DriverRegistry, parseDriverReferences # pylint: disable=import-error
+from devices.thermostat import Thermostat # pylint: disable=import-error
+
+CONFIG_PATH = Path('devices/tests/test_config.json')
+DRIVER_SOURCE = '''
+from devices.thermostat import Thermostat
+
+class ShellyRelay(Thermostat):
+    """Driver of a third-party package."""
+'''
+
+class TestDriverRegistry(unittest.TestCase):
+    '''Unit tests for DriverRegistry class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        Path(self.tmpDir.name, 'shellydriver.py').write_text(DRIVER_SOURCE, encoding='utf-8')
+        sys.path.insert(0, self.tmpDir.name)
+        self.config = loadDeviceConfig(CONFIG_PATH)
+
+    def tearDown(self):
+        sys.path.remove(self.tmpDir.name)
+        sys.modules.pop('shellydriver', None)
+        self.tmpDir.cleanup()
+
+    def testDriverIsImportedOnFirstUse(self):
+        '''Registering a driver does not import it, creating the first device does.'''
+        registry = DriverRegistry()
+        registry.register('shelly', 'shellydriver:ShellyRelay')
+        self.assertNotIn('shellydriver', sys.modules)
+        config = dataclasses.replace(self.config, type='shelly')
+        device = registry.createDevice(CONFIG_PATH, config)
+        self.assertIn('shellydriver', sys.modules)
+        self.assertEqual(type(device).__name__, 'ShellyRelay')
+        self.assertIsInstance(device, Thermostat)
+        self.assertIs(registry.getDriver('shelly'), type(device))
+
+    def testEntryPointsAreSearchedOnlyForUnknownTypes(self):
+        '''Installed packages are searched once and only when needed.'''
+        entryPoint = MagicMock()
+        entryPoint.name = 'shelly'
+        entryPoint.load.return_value = Thermostat
+        with patch('devices.registry.entry_points', return_value=[entryPoint]) as mockFind:
+            registry = DriverRegistry()
+            self.assertIsInstance(registry.createDevice(CONFIG_PATH, self.config), Thermostat)
+            mockFind.assert_not_called()
+            self.assertIs(registry.getDriver('shelly'), Thermostat)
+            with self.assertRaises(KeyError):
+                registry.getDriver('tuntematon')
+            mockFind.assert_called_once_with(group='heatingcontrol.drivers')
+            self.assertIn('shelly', registry.getTypes())
+
+    @patch('builtins.print')
+    def testUnknownOrBrokenDriverCreatesNothing(self, mockPrint):
+        '''Unknown type and failing import are reported and no device is created.'''
+        with patch('devices.registry.entry_points', return_value=[]):
+            registry = DriverRegistry({'thermostat': 'shellydriver:Puuttuu'})
+            self.assertIsNone(registry.createDevice(CONFIG_PATH, self.config))
+            registry.register('thermostat', 'eiolemassa:Ajuri')
+            self.assertIsNone(registry.createDevice(CONFIG_PATH, self.config))
+            registry = DriverRegistry({})
+            self.assertIsNone(registry.createDevice(CONFIG_PATH, self.config))
+        messages = [call.args[0] for call in mockPrint.call_args_list]
+        self.assertEqual(len(messages), 3)
+        self.assertIn('tuntematon laitetyyppi thermostat', messages[2])
+
+    def testParseDriverReferences(self):
+        '''DEVICE_DRIVERS lists type=module:Class items.'''
+        self.assertEqual(parseDriverReferences('shelly=shellydriver:ShellyRelay, x=a.b:C'),
+                         {'shelly': 'shellydriver:ShellyRelay', 'x': 'a.b:C'})
+        self.assertEqual(parseDriverReferences(''), {})
+        with self.assertRaises(ValueError):
+            parseDriverReferences('shelly=shellydriver')
+
+if __name__ == '__main__':
+    unittest.main()
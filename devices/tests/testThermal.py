@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+'''Module for unit test for ThermalModel class and pre-heating.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s devices/tests -p "testThermal.py"
+'''
+
+import dataclasses
+import math
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+from apis.smartheating import HeatingPlan # pylint: disable=import-error
+from devices.thermal import ThermalModel, selectPreheatSlots # pylint: disable=import-error
+from devices.thermostat import Thermostat # pylint: disable=import-error
+from storage.history import HistoryStore # pylint: disable=import-error
+
+SLOT = 15 * 60 * 1000
+START = 1_700_000_100_000 - 1_700_000_100_000 % SLOT
+
+def simulateRoom(model: ThermalModel, loss: float, gain: float, hours: int,
+                 isHeating=lambda slot: (slot // 16) % 2 == 0, readSlots: int = 1) -> None:
+    '''Feed model with a room whose thermostat gets a high or low setpoint every slot.
+    Written setpoints are recorded and the room is read every readSlots slots.'''
+    room = 20.0
+    setpoint = None
+    for minute in range(hours * 60):
+        slot, offset = divmod(minute, 15)
+        outdoor = -5.0 + 5.0 * math.sin(minute / 1440 * 2 * math.pi)
+        if offset == 0:
+            if slot % readSlots == 0:
+                model.addSample(minute * 60.0, room, setpoint, outdoor)
+            newSetpoint = 30.0 if isHeating(slot) else 5.0
+            if newSetpoint != setpoint:
+                setpoint = newSetpoint
+                model.addSetpoint(minute * 60.0, setpoint)
+        room += (loss * (outdoor - room) + (gain if setpoint > room else 0.0)) / 60
+
+class TestThermalModel(unittest.TestCase):
+    '''Unit tests for ThermalModel class.'''
+
+    def testLearnsRatesOfRoom(self):
+        '''Recursive least squares recovers loss and gain from readings.'''
+        model = ThermalModel()
+        self.assertFalse(model.isReady())
+        simulateRoom(model, 0.1, 3.0, 48)
+        self.assertTrue(model.isReady())
+        loss, gain, offset = model.theta
+        self.assertAlmostEqual(loss, 0.1, delta=0.002)
+        self.assertAlmostEqual(gain, 3.0, delta=0.01)
+        self.assertAlmostEqual(offset, 0.0, delta=0.02)
+
+    def testHourlyReadingsWithSlotSetpoints(self):
+        '''Setpoints written between hourly readings give the heated share of the hour.'''
+        # Six hours of 30/30 or 45/15 heating alternate with six hours off
+        for onSlots in (2, 3):
+            model = ThermalModel()
+            simulateRoom(model, 0.1, 3.0, 96, readSlots=4,
+                         isHeating=lambda slot, onSlots=onSlots: (slot // 24) % 2 == 0
+                         and slot % 4 < onSlots)
+            loss, gain, offset = model.theta
+            self.assertAlmostEqual(loss, 0.1, delta=0.005)
+            self.assertAlmostEqual(gain, 3.0, delta=0.2)
+            self.assertAlmostEqual(offset, 0.0, delta=0.1)
+
+    def testHeatedShare(self):
+        '''Share follows the written setpoints and holding the setpoint is skipped.'''
+        model = ThermalModel()
+        changes = [(0.0, 22.0), (1800.0, 18.0), (2700.0, 22.0)]
+        share = model._getHeatedShare( # pylint: disable=protected-access
+            (0.0, 20.0, 22.0), changes, 3600.0, 20.5)
+        self.assertEqual(share, 0.75)
+        model.addSample(0.0, 20.0, 22.0, 0.0)
+        for change in changes:
+            model.addSetpoint(*change)
+        self.assertTrue(model.addSample(3600.0, 20.5, 22.0, 0.0))
+        # Room reaches the new setpoint of 21 C, so the thermostat was holding it
+        model.addSetpoint(5400.0, 21.0)
+        self.assertFalse(model.addSample(7200.0, 21.0, 21.0, 0.0))
+        self.assertEqual(model.samples, 1)
+        self.assertEqual(model.setpoints, [])
+
+    def testPreheatTime(self):
+        '''Pre-heat time follows the exponential approach to the balance temperature.'''
+        model = ThermalModel()
+        model.theta = [0.1, 4.0, 0.0]
+        self.assertAlmostEqual(model.getPreheatTime(20.0, 22.0, 0.0), 10 * math.log(20 / 18))
+        self.assertEqual(model.getPreheatTime(23.0, 22.0, 0.0), 0.0)
+        self.assertIsNone(model.getPreheatTime(20.0, 22.0, -25.0))
+
+    def testStateRoundTrip(self):
+        '''Restored model predicts as the original one.'''
+        model = ThermalModel()
+        simulateRoom(model, 0.1, 3.0, 12)
+        restored = ThermalModel()
+        restored.restoreState(model.getState())
+        self.assertEqual(restored.getRate(20.0, 0.0, True), model.getRate(20.0, 0.0, True))
+        self.assertEqual(restored.samples, model.samples)
+
+    def testSelectPreheatSlots(self):
+        '''Cheapest slots are picked, the last ones if there are no prices.'''
+        starts = [0, 1, 2, 3, 4]
+        self.assertEqual(selectPreheatSlots(starts, [5.0, 1.0, 3.0, 1.0, 9.0], 2), {1, 3})
+        self.assertEqual(selectPreheatSlots(starts, None, 2), {3, 4})
+        self.assertEqual(selectPreheatSlots(starts, None, 0), set())
+
+class TestPreheat(unittest.TestCase):
+    '''Unit tests for pre-heating of Device class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.planCache = MagicMock()
+        self.planCache.localPlanner.getPrices.return_value = None
+        self.device = Thermostat(configPath='devices/tests/test_config.json',
+                                 planCache=self.planCache,
+                                 history=HistoryStore(self.tmpDir.name))
+        self.device.config = dataclasses.replace(self.device.config, maxPreheat=120)
+        # Heating is off for 12 slots and then on for 4 slots
+        results = [False] * 12 + [True] * 4
+        epochs = [START + index * SLOT for index in range(16)]
+        self.device.plan = HeatingPlan.fromResponse({
+            'PlanAhead': [{'epochMs': epoch, 'result': result}
+                          for epoch, result in zip(epochs, results)],
+            'EpochMsExpiration': START + 16 * SLOT, 'AverageTemperature': 0.0})
+        # 20 -> 22 C takes 1.05 hours, which is 5 slots in a window of 10 slots
+        self.device.thermal.theta = [0.1, 4.0, 0.0]
+        self.device.thermal.samples = 100
+        self.device.roomTemperature = 20.0
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def _getDemand(self, slot: int) -> bool:
+        return self.device.getPlannedDemand((START + slot * SLOT + 60_000) / 1000)
+
+    def testPreheatsInLastSlotsWithoutPrices(self):
+        '''Heating starts predicted time before the planned heating.'''
+        self.assertEqual([self._getDemand(slot) for slot in range(13)],
+                         [False] * 7 + [True] * 6)
+
+    def testPreheatsInCheapestSlots(self):
+        '''Pre-heat time is spent in the cheapest slots of the window.'''
+        self.planCache.localPlanner.getPrices.return_value = \
+            [1.0, 9.0, 1.0, 9.0, 1.0, 9.0, 1.0, 9.0, 1.0, 9.0]
+        self.assertEqual([self._getDemand(slot) for slot in range(2, 12)],
+                         [True, False] * 5)
+
+    def testNoPreheatUntilModelIsReady(self):
+        '''Unknown room or disabled pre-heating follows the plan.'''
+        self.device.thermal.samples = 0
+        self.assertFalse(self._getDemand(11))
+        self.device.thermal.samples = 100
+        self.device.config = dataclasses.replace(self.device.config, maxPreheat=0)
+        self.assertFalse(self._getDemand(11))
+
+    def testSchedulerWakesUpInsidePreheatWindow(self):
+        '''Next change is the start of the window and then every slot inside it.'''
+        self.device.config = dataclasses.replace(self.device.config, maxPreheat=60)
+        self.assertEqual(self.device.getNextPlanChange((START + 60_000) / 1000),
+                         (START + 4 * SLOT) / 1000)
+        self.assertEqual(self.device.getNextPlanChange((START + 5 * SLOT + 60_000) / 1000),
+                         (START + 6 * SLOT) / 1000)
+        self.assertEqual(self.device.getNextPlanChange((START + 13 * SLOT) / 1000),
+                         (START + 16 * SLOT) / 1000)
+
+    def testNoOutdoorLookupWithoutPreheat(self):
+        '''Disabled pre-heating or unknown room returns before the outdoor temperature.'''
+        with patch.object(self.device, '_getOutdoorTemperature') as mockOutdoor:
+            self.device.config = dataclasses.replace(self.device.config, maxPreheat=0)
+            self.assertFalse(self._getDemand(11))
+            self.device.config = dataclasses.replace(self.device.config, maxPreheat=120)
+            self.device.roomTemperature = None
+            self.assertFalse(self._getDemand(11))
+        mockOutdoor.assert_not_called()
+
+    def testWrittenSetpointsFeedModel(self):
+        '''Successful setpoint write is recorded for the heated share.'''
+        self.device.thermal = ThermalModel()
+        self.device._handleSetTempResponse( # pylint: disable=protected-access
+            httpx.Response(200), 22.0)
+        self.device._handleSetTempResponse( # pylint: disable=protected-access
+            httpx.Response(500), 18.0)
+        self.assertEqual([setpoint for _, setpoint in self.device.thermal.setpoints], [22.0])
+
+    def testLearnsFromStatusReadings(self):
+        '''Room temperature of status response feeds the model.'''
+        self.device.thermal = ThermalModel()
+        self.device._recordStatus( # pylint: disable=protected-access
+            {'parameters': {'heatingSetpoint': 22.0},
+             'internalTemperature': 20.5, 'floorTemperature': 24.0})
+        self.assertEqual(self.device.roomTemperature, 20.5)
+        self.assertEqual(self.device.thermal.last[1:], (20.5, 22.0))
+
+if __name__ == '__main__':
+    unittest.main()
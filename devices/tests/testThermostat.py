@@ -4,16 +4,24 @@ Run with command in the main directory of the project:
 python3 -m unittest discover -s devices/tests -p "testThermostat.py"
 '''
 
+import asyncio
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 from devices.thermostat import Thermostat # pylint: disable=import-error
+from storage.history import HistoryStore # pylint: disable=import-error
 
 class TestThermostat(unittest.TestCase):
     '''Unit tests for Thermostat class.'''
 
     def setUp(self):
         '''Set up a Thermostat instance for testing.'''
-        self.thermostat = Thermostat(configPath="devices/tests/test_config.json")
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.thermostat = Thermostat(configPath="devices/tests/test_config.json",
+                                     history=HistoryStore(self.tmpDir.name))
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
 
     @patch('devices.thermostat.Thermostat.printTemps')
     def testPrintStatus(self, mockPrintTemps):
@@ -30,19 +38,18 @@ class TestThermostat(unittest.TestCase):
             mockPrintTemps.assert_called_once_with(22.5, 21.0)
             mockPrint.assert_any_call('lattia: 24.0 C')
 
-    @patch('httpx.post')
-    def testSendTempToDevice(self, mockPost):
-        '''Test the sendTempToDevice method of Thermostat.'''
+    @patch('httpx.AsyncClient.post')
+    def testSendTempToDeviceAsync(self, mockPost):
+        '''Test the sendTempToDeviceAsync method of Thermostat.'''
         mockResponse = MagicMock()
         mockPost.return_value = mockResponse
 
         newTemp = 23.0
-        response = self.thermostat.sendTempToDevice(newTemp)
+        response = asyncio.run(self.thermostat.sendTempToDeviceAsync(newTemp))
 
         mockPost.assert_called_once_with(
             f'http://{self.thermostat.getIpAddress()}/api/parameters?' \
-            f'heatingSetpoint=23.0&operatingMode=1&sensorMode=2',
-            timeout=10
+            f'heatingSetpoint=23.0&operatingMode=1&sensorMode=2'
         )
         self.assertEqual(response, mockResponse)
 
@@ -50,7 +57,20 @@ class TestThermostat(unittest.TestCase):
         '''Test the plotHistory method of Thermostat.'''
         with patch('builtins.print') as mockPrint:
             self.thermostat.plotHistory()
-            mockPrint.assert_called_once_with('\n\n')
+            mockPrint.assert_called_once_with('Laitteelle default ei ole historiatietoja.')
+
+        responseJson = {
+            'parameters': {'heatingSetpoint': 22.5},
+            'internalTemperature': 21.0,
+            'floorTemperature': 24.0
+        }
+        with patch('builtins.print') as mockPrint:
+            self.thermostat._recordStatus(responseJson) # pylint: disable=protected-access
+            self.thermostat.plotHistory()
+            rendered = mockPrint.call_args.args[0]
+        self.assertIn('huone  21.0- 21.0 C', rendered)
+        self.assertIn('lattia  24.0- 24.0 C', rendered)
+        self.assertIn('asetus  22.5- 22.5 C', rendered)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+'''Module for online thermal model of a room. The room is modelled as
+
+    dT/dt = loss * (outdoor - room) + gain * heating + offset    (°C per hour)
+
+where heating is the share of time the thermostat was heating. The three parameters are
+learned with recursive least squares from consecutive room temperature readings. Readings
+can be an hour apart while the setpoint changes every slot, so the heating share comes from
+the setpoints written between the readings. Every sample costs a fixed amount of work, so
+the model is updated inside the control tick. The model predicts how long heating takes to
+reach a target temperature.'''
+
+import math
+
+SLOT_HOURS = 0.25
+
+class ThermalModel:
+    '''Recursive least squares estimate of the heating and cooling rates of one room.'''
+
+    def __init__(self, forgetting: float = 0.995, minimumSamples: int = 12,
+                 maxInterval: float = 3.0, hysteresis: float = 0.2) -> None:
+        self.forgetting = forgetting
+        self.minimumSamples = minimumSamples
+        self.maxInterval = maxInterval
+        self.hysteresis = hysteresis
+        self.theta = [0.0, 0.0, 0.0]
+        self.covariance = [[1000.0 if row == column else 0.0 for column in range(3)]
+                           for row in range(3)]
+        self.samples = 0
+        self.last = None
+        self.setpoints = []
+
+    def _update(self, inputs: list[float], rate: float) -> None:
+        '''One recursive least squares step with exponential forgetting.'''
+        covariance = self.covariance
+        weighted = [sum(covariance[row][column] * inputs[column] for column in range(3))
+                    for row in range(3)]
+        denominator = self.forgetting + sum(inputs[row] * weighted[row] for row in range(3))
+        gains = [value / denominator for value in weighted]
+        error = rate - sum(self.theta[row] * inputs[row] for row in range(3))
+        self.theta = [self.theta[row] + gains[row] * error for row in range(3)]
+        self.covariance = [[(covariance[row][column] - gains[row] * weighted[column])
+                            / self.forgetting for column in range(3)] for row in range(3)]
+        self.samples += 1
+
+    def addSetpoint(self, timestamp: float, setpoint: float) -> None:
+        '''Record setpoint written to the device between readings.'''
+        oldest = timestamp - self.maxInterval * 3600
+        self.setpoints = [change for change in self.setpoints if change[0] >= oldest]
+        self.setpoints.append((timestamp, setpoint))
+
+    def _getHeatedShare(self, previous: tuple, changes: list[tuple], timestamp: float,
+                        room: float) -> float:
+        '''Get share of the time between readings when the setpoint was above the room.
+        Room temperature in between is interpolated. Returns None if the room was within
+        the hysteresis of the setpoint at some point, because the thermostat was then
+        holding the setpoint and heating an unknown part of the time.'''
+        previousTime, previousRoom, setpoint = previous
+        duration = timestamp - previousTime
+        segments = []
+        start = previousTime
+        for changeTime, newSetpoint in sorted(changes):
+            if changeTime >= timestamp:
+                break
+            if changeTime > start:
+                segments.append((start, changeTime, setpoint))
+                start = changeTime
+            setpoint = newSetpoint
+        segments.append((start, timestamp, setpoint))
+        heated = 0.0
+        for start, end, setpoint in segments:
+            if setpoint is None:
+                return None
+            differences = [setpoint - previousRoom - (room - previousRoom) \
+                           * (moment - previousTime) / duration for moment in (start, end)]
+            if min(differences) > self.hysteresis:
+                heated += end - start
+            elif max(differences) >= -self.hysteresis:
+                return None
+        return heated / duration
+
+    def addSample(self, timestamp: float, room: float, setpoint: float,
+                  outdoor: float) -> bool:
+        '''Learn from the change since the previous reading. The setpoint of the previous
+        reading and the setpoints written after it tell how large share of the time the
+        room was heated. Readings where the thermostat was holding the setpoint are skipped.
+        Returns True if the model was updated.'''
+        previous = self.last
+        changes = self.setpoints
+        self.last = (timestamp, room, setpoint)
+        # Setpoint written right after the reading belongs to the next interval
+        self.setpoints = [change for change in changes if change[0] >= timestamp]
+        if previous is None or room is None or outdoor is None or previous[1] is None:
+            return False
+        hours = (timestamp - previous[0]) / 3600
+        if not 0.05 <= hours <= self.maxInterval:
+            return False
+        share = self._getHeatedShare(previous, changes, timestamp, room)
+        if share is None:
+            return False
+        self._update([outdoor - (previous[1] + room) / 2, share, 1.0],
+                     (room - previous[1]) / hours)
+        return True
+
+    def isReady(self) -> bool:
+        '''Check if enough samples have been seen and the parameters are physical.'''
+        loss, gain, _ = self.theta
+        return self.samples >= self.minimumSamples and loss >= 0 and gain > 0
+
+    def getRate(self, room: float, outdoor: float, heating: bool) -> float:
+        '''Predict temperature change in °C per hour.'''
+        loss, gain, offset = self.theta
+        return loss * (outdoor - room) + (gain if heating else 0.0) + offset
+
+    def getPreheatTime(self, room: float, target: float, outdoor: float) -> float:
+        '''Predict hours of heating needed to warm room to target. Returns 0 if the room is
+        warm enough and None if the target cannot be reached.'''
+        if room >= target:
+            return 0.0
+        loss, gain, offset = self.theta
+        if loss <= 1e-6:
+            rate = gain + offset
+            return (target - room) / rate if rate > 0 else None
+        # Exponential approach to the temperature where losses equal the heating power
+        balance = outdoor + (gain + offset) / loss
+        if balance <= target:
+            return None
+        return math.log((balance - room) / (balance - target)) / loss
+
+    def getState(self) -> dict:
+        '''Get parameters for persisting.'''
+        return {'theta': self.theta, 'covariance': self.covariance, 'samples': self.samples,
+                'last': self.last, 'setpoints': self.setpoints}
+
+    def restoreState(self, state: dict) -> None:
+        '''Restore parameters stored by getState.'''
+        self.theta = list(state['theta'])
+        self.covariance = [list(row) for row in state['covariance']]
+        self.samples = state['samples']
+        self.last = tuple(state['last']) if state.get('last') else None
+        self.setpoints = [tuple(change) for change in state.get('setpoints', [])]
+
+def selectPreheatSlots(starts: list[int], prices: list[float], count: int) -> set[int]:
+    '''Pick the cheapest count slots of the window before heating starts. Ties prefer the
+    later slot because heat is lost over time. Without prices the last slots are picked.'''
+    if count <= 0:
+        return set()
+    if prices is None:
+        return set(starts[-count:])
+    order = sorted(range(len(starts)), key=lambda index: (prices[index], -index))
+    return {starts[index] for index in order[:count]}
@@ -3,15 +3,12 @@
 
 import httpx
 
+from apis.httpclients import DEVICE # pylint: disable=import-error
 from devices.device import Device # pylint: disable=import-error
 
 class Thermostat(Device):
     '''Thermostat class inherits from Device class.'''
 
-    def __init__(self, configPath: str):
-        super().__init__(configPath)
-        self.sensorMode = 2
-
     def printStatus(self, responseJson: dict) -> None:
         '''Print current status of the thermostat.'''
         try:
@@ -22,13 +19,18 @@ class Thermostat(Device):
         except KeyError:
             print('Ei saatu kunnon vastausta termostaatilta.')
 
-    def plotHistory(self) -> None:
-        '''Plot history of thermostat data.'''
-        print('\n\n')
+    def _getHistorySample(self, responseJson: dict) -> tuple[float, float, float]:
+        '''Get room, floor and setpoint temperatures from status response.'''
+        return (responseJson['internalTemperature'], responseJson['floorTemperature'],
+                responseJson['parameters']['heatingSetpoint'])
+
+    def _getSetpointUrl(self, newTemp: float) -> str:
+        '''Get url for setting new temperature to thermostat.'''
+        return f'http://{self.getIpAddress()}/api/parameters?heatingSetpoint' \
+               f'={newTemp}&operatingMode=1&sensorMode={self.sensorMode}'
 
-    def sendTempToDevice(self, newTemp: float) -> httpx.Response:
-        '''Send new temperature to thermostat.'''
-        url = f'http://{self.getIpAddress()}/api/parameters?heatingSetpoint' \
-              f'={newTemp}&operatingMode=1&sensorMode={self.sensorMode}'
-        response = httpx.post(url, timeout=10)
+    async def sendTempToDeviceAsync(self, newTemp: float) -> httpx.Response:
+        '''Send new temperature to thermostat without blocking the event loop.'''
+        client = self.clients.getAsyncClient(DEVICE)
+        response = await client.post(self._getSetpointUrl(newTemp))
         return response
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+'''Module for fake HeatIt Wifi6 thermostats and Wifi panel heaters. One server simulates
+any number of devices. A device is addressed with a path prefix, so the device ip in the
+configuration is for example 127.0.0.1:8080/dev17.'''
+
+from fakes.server import FakeHttpServer, FaultProfile # pylint: disable=import-error
+
+class FakeHeatItServer(FakeHttpServer):
+    '''Fake HeatIt devices answering /api/status and /api/parameters.'''
+
+    def __init__(self, faults: FaultProfile = None, seed: int = 0) -> None:
+        super().__init__(faults, seed)
+        self.setpoints = {}
+
+    def getDeviceIp(self, deviceId: str) -> str:
+        '''Get value for the ip field of a device configuration.'''
+        return f'{self.address}/{deviceId}'
+
+    async def handle(self, method: str, path: str, query: dict,
+                     body: bytes) -> tuple[int, object]:
+        '''Handle status query and setpoint change.'''
+        deviceId, _, endpoint = path.lstrip('/').partition('/')
+        setpoint = self.setpoints.setdefault(deviceId, 18.0)
+        if method == 'GET' and endpoint == 'api/status':
+            # Both thermostat and panel fields so that one server serves both device types
+            return 200, {
+                'parameters': {'heatingSetpoint': setpoint},
+                'internalTemperature': 21.0,
+                'roomTemperature': 21.0,
+                'floorTemperature': 23.5,
+            }
+        if method == 'POST' and endpoint == 'api/parameters':
+            self.setpoints[deviceId] = float(query['heatingSetpoint'][0])
+            self.requests['setpoint'] += 1
+            return 200, {}
+        return 404, {'message': 'Not found'}
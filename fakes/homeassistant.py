@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+'''Module for local fake Home Assistant server. Serves the REST endpoints used by
+HomeAssistantClient and the subscribe_entities websocket command for tests.'''
+
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from websockets.asyncio.server import serve
+from websockets.exceptions import ConnectionClosed
+
+from fakes.server import FaultProfile # pylint: disable=import-error
+
+class FakeHomeAssistant:
+    '''Fake Home Assistant with climate entities, running in background threads.'''
+
+    def __init__(self, token: str = 'test-token', faults: FaultProfile = None,
+                 seed: int = 0) -> None:
+        self.token = token
+        self.faults = faults if faults is not None else FaultProfile()
+        self.rng = random.Random(seed)
+        self.states = {}
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.subscriptions = []
+        self.httpServer = None
+        self.loop = None
+        self.websocketServer = None
+        self.threads = []
+
+    @property
+    def baseUrl(self) -> str:
+        '''Url of the REST API.'''
+        host, port = self.httpServer.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def websocketUrl(self) -> str:
+        '''Url of the websocket API.'''
+        host, port = self.websocketServer.sockets[0].getsockname()[:2]
+        return f'ws://{host}:{port}/api/websocket'
+
+    def addClimate(self, entityId: str, temperature: float = 20.0,
+                   currentTemperature: float = 20.0) -> None:
+        '''Add climate entity.'''
+        with self.lock:
+            self.states[entityId] = {
+                'entity_id': entityId,
+                'state': 'heat',
+                'attributes': {'temperature': temperature,
+                               'current_temperature': currentTemperature},
+            }
+
+    def setAttributes(self, entityId: str, **attributes) -> None:
+        '''Change entity attributes outside of the API, like a user with a remote control.'''
+        with self.lock:
+            self.states[entityId]['attributes'].update(attributes)
+        self._notify({entityId: attributes})
+
+    def _notify(self, changes: dict) -> None:
+        '''Send changed attributes to websocket subscribers.'''
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self._broadcast(changes), self.loop)
+
+    async def _broadcast(self, changes: dict) -> None:
+        '''Send compressed change event to subscribers of the changed entities.'''
+        for websocket, subscriptionId, entityIds in list(self.subscriptions):
+            diff = {entityId: {'+': {'a': attributes}}
+                    for entityId, attributes in changes.items() if entityId in entityIds}
+            if diff:
+                await websocket.send(json.dumps({'id': subscriptionId, 'type': 'event',
+                                                 'event': {'c': diff}}))
+
+    def drawFault(self) -> str:
+        '''Sleep the configured latency and draw the fault of one request.
+        Returns 'timeout', 'error' or None.'''
+        with self.lock:
+            delay = self.faults.getDelay(self.rng)
+            draw = self.rng.random()
+        time.sleep(delay)
+        if draw < self.faults.timeoutRate:
+            self.requests['timeout'] += 1
+            time.sleep(self.faults.timeoutDelay)
+            return 'timeout'
+        if draw < self.faults.timeoutRate + self.faults.errorRate:
+            self.requests['error'] += 1
+            return 'error'
+        return None
+
+    def handleRest(self, method: str, path: str, body: dict) -> tuple[int, object]:
+        '''Handle REST request. Returns status code and JSON body.'''
+        endpoint = '/api/states/<entity_id>' if path.startswith('/api/states/') else path
+        self.requests[(method, endpoint)] += 1
+        with self.lock:
+            if method == 'GET' and path == '/api/states':
+                return 200, list(self.states.values())
+            if method == 'GET' and path.startswith('/api/states/'):
+                state = self.states.get(path.removeprefix('/api/states/'))
+                return (200, state) if state else (404, {'message': 'Entity not found.'})
+            if method == 'POST' and path == '/api/services/climate/set_temperature':
+                entityIds = body['entity_id']
+                if isinstance(entityIds, str):
+                    entityIds = [entityIds]
+                changed = []
+                for entityId in entityIds:
+                    if entityId in self.states:
+                        self.states[entityId]['attributes']['temperature'] = body['temperature']
+                        changed.append(self.states[entityId])
+        if method == 'POST' and path == '/api/services/climate/set_temperature':
+            self._notify({entityId: {'temperature': body['temperature']}
+                          for entityId in entityIds})
+            return 200, changed
+        return 404, {'message': 'Not found'}
+
+    async def _handleWebsocket(self, websocket) -> None:
+        '''Handle websocket connection: authentication and subscribe_entities.'''
+        await websocket.send(json.dumps({'type': 'auth_required'}))
+        message = json.loads(await websocket.recv())
+        if message.get('access_token') != self.token:
+            await websocket.send(json.dumps({'type': 'auth_invalid'}))
+            return
+        await websocket.send(json.dumps({'type': 'auth_ok'}))
+        try:
+            async for rawMessage in websocket:
+                message = json.loads(rawMessage)
+                if message.get('type') != 'subscribe_entities':
+                    continue
+                self.requests[('WS', 'subscribe_entities')] += 1
+                with self.lock:
+                    entityIds = set(message.get('entity_ids') or self.states)
+                    added = {entityId: {'s': state['state'], 'a': dict(state['attributes'])}
+                             for entityId, state in self.states.items() if entityId in entityIds}
+                self.subscriptions.append((websocket, message['id'], entityIds))
+                await websocket.send(json.dumps({'id': message['id'], 'type': 'result',
+                                                 'success': True, 'result': None}))
+                await websocket.send(json.dumps({'id': message['id'], 'type': 'event',
+                                                 'event': {'a': added}}))
+        except ConnectionClosed:
+            pass
+        finally:
+            self.subscriptions = [subscription for subscription in self.subscriptions
+                                  if subscription[0] is not websocket]
+
+    def _createHandler(self) -> type:
+        '''Create request handler class bound to this fake.'''
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            '''REST request handler.'''
+
+            def _respond(self, method: str) -> None:
+                length = int(self.headers.get('Content-Length') or 0)
+                request = json.loads(self.rfile.read(length)) if length else {}
+                fault = fake.drawFault()
+                if fault == 'timeout':
+                    self.close_connection = True
+                    return
+                if fault == 'error':
+                    status, body = 500, {'message': 'Simuloitu virhe'}
+                elif self.headers.get('Authorization') != f'Bearer {fake.token}':
+                    status, body = 401, {'message': 'Unauthorized'}
+                else:
+                    status, body = fake.handleRest(method, self.path, request)
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self): # pylint: disable=invalid-name
+                self._respond('GET')
+
+            def do_POST(self): # pylint: disable=invalid-name
+                self._respond('POST')
+
+            def log_message(self, *_args): # pylint: disable=arguments-differ
+                pass
+
+        Handler.protocol_version = 'HTTP/1.1'
+        return Handler
+
+    def start(self) -> 'FakeHomeAssistant':
+        '''Start REST and websocket servers in background threads.'''
+        self.httpServer = ThreadingHTTPServer(('127.0.0.1', 0), self._createHandler())
+        self.httpServer.daemon_threads = True
+        httpThread = threading.Thread(target=self.httpServer.serve_forever, daemon=True)
+        httpThread.start()
+        self.threads.append(httpThread)
+
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        async def startWebsocket() -> None:
+            self.websocketServer = await serve(self._handleWebsocket, '127.0.0.1', 0)
+
+        def runLoop() -> None:
+            try:
+                self.loop.run_until_complete(startWebsocket())
+            finally:
+                ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        websocketThread = threading.Thread(target=runLoop, daemon=True)
+        websocketThread.start()
+        self.threads.append(websocketThread)
+        ready.wait()
+        if self.websocketServer is None:
+            raise RuntimeError('Websocket-palvelinta ei voitu käynnistää')
+        return self
+
+    def stop(self) -> None:
+        '''Stop servers.'''
+        self.httpServer.shutdown()
+        self.httpServer.server_close()
+
+        async def closeWebsocket() -> None:
+            self.websocketServer.close()
+            await self.websocketServer.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(closeWebsocket(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        for thread in self.threads:
+            thread.join(timeout=5)
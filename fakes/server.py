@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+'''Module for minimal asyncio HTTP/1.1 server used by the fake devices and APIs. Runs in a
+background thread with its own event loop and supports keep-alive and fault injection.'''
+
+import asyncio
+import json
+import random
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from urllib.parse import parse_qs, urlsplit
+
+@dataclass(slots=True)
+class FaultProfile:
+    '''Latency and failures injected into every response.'''
+    latency: float = 0.0
+    jitter: float = 0.0
+    errorRate: float = 0.0
+    timeoutRate: float = 0.0
+    timeoutDelay: float = 30.0
+
+    def getDelay(self, rng: random.Random) -> float:
+        '''Get delay of one response.'''
+        return max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter))
+
+class FakeHttpServer:
+    '''Base class for fake servers. Subclasses implement handle().'''
+
+    def __init__(self, faults: FaultProfile = None, seed: int = 0) -> None:
+        self.faults = faults if faults is not None else FaultProfile()
+        self.rng = random.Random(seed)
+        self.requests = Counter()
+        self.loop = None
+        self.server = None
+        self.thread = None
+
+    @property
+    def address(self) -> str:
+        '''Host and port of the server.'''
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f'{host}:{port}'
+
+    async def handle(self, method: str, path: str, query: dict,
+                     body: bytes) -> tuple[int, object]:
+        '''Handle request. Returns status code and JSON body.'''
+        raise NotImplementedError
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, body: object) -> None:
+        '''Write JSON response.'''
+        data = json.dumps(body).encode('utf-8')
+        writer.write(f'HTTP/1.1 {status} X\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(data)}\r\n\r\n'.encode('ascii') + data)
+        await writer.drain()
+
+    async def _handleConnection(self, reader: asyncio.StreamReader,
+                                writer: asyncio.StreamWriter) -> None:
+        '''Serve requests of one keep-alive connection.'''
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine:
+                    break
+                method, target, _ = requestLine.decode('ascii').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                parts = urlsplit(target)
+                self.requests[method] += 1
+                await asyncio.sleep(self.faults.getDelay(self.rng))
+                draw = self.rng.random()
+                if draw < self.faults.timeoutRate:
+                    self.requests['timeout'] += 1
+                    await asyncio.sleep(self.faults.timeoutDelay)
+                    break
+                if draw < self.faults.timeoutRate + self.faults.errorRate:
+                    self.requests['error'] += 1
+                    await self._respond(writer, 500, {'message': 'Simuloitu virhe'})
+                    continue
+                status, responseBody = await self.handle(
+                    method, parts.path, parse_qs(parts.query), body)
+                await self._respond(writer, status, responseBody)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self) -> 'FakeHttpServer':
+        '''Start server in a background thread.'''
+        ready = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        async def startServer() -> None:
+            self.server = await asyncio.start_server(self._handleConnection, '127.0.0.1', 0,
+                                                     backlog=1024)
+
+        def runLoop() -> None:
+            try:
+                self.loop.run_until_complete(startServer())
+            finally:
+                ready.set()
+            self.loop.run_forever()
+            self.loop.close()
+
+        self.thread = threading.Thread(target=runLoop, daemon=True)
+        self.thread.start()
+        ready.wait()
+        if self.server is None:
+            raise RuntimeError('Palvelinta ei voitu käynnistää')
+        return self
+
+    def stop(self) -> None:
+        '''Stop server and its thread.'''
+        async def closeServer() -> None:
+            self.server.close()
+            # Connections held open by simulated timeouts are cancelled
+            pending = [task for task in asyncio.all_tasks()
+                       if task is not asyncio.current_task()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(closeServer(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+'''Module for fake api-spot-hinta.fi SmartHeating endpoint. Plans are deterministic
+for the payload, so devices with identical parameters get identical plans.'''
+
+import hashlib
+import json
+import time
+
+from fakes.server import FakeHttpServer, FaultProfile # pylint: disable=import-error
+
+SLOT_MILLIS = 15 * 60 * 1000
+
+class FakeSmartHeating(FakeHttpServer):
+    '''Fake SmartHeating endpoint answering POST /SmartHeating.'''
+
+    def __init__(self, faults: FaultProfile = None, seed: int = 0,
+                 planHours: float = 12.0) -> None:
+        super().__init__(faults, seed)
+        self.planHours = planHours
+
+    @property
+    def url(self) -> str:
+        '''Url to give to PlanCache.'''
+        return f'http://{self.address}/SmartHeating'
+
+    def createPlan(self, payload: dict, now: float) -> dict:
+        '''Create plan of quarter hour slots from the current slot until expiration.
+        Share of heating slots follows HeatingPercentage_Zero of the payload.'''
+        seed = hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).digest()
+        percentage = payload.get('HeatingPercentage_Zero', 50)
+        start = int(now * 1000) // SLOT_MILLIS * SLOT_MILLIS
+        slots = int(self.planHours * 4)
+        planAhead = [{'epochMs': start + index * SLOT_MILLIS,
+                      'result': seed[index % len(seed)] * 100 // 256 < percentage}
+                     for index in range(slots)]
+        return {'PlanAhead': planAhead,
+                'EpochMsExpiration': start + slots * SLOT_MILLIS,
+                'AverageTemperature': 0.0}
+
+    async def handle(self, method: str, path: str, query: dict,
+                     body: bytes) -> tuple[int, object]:
+        '''Handle plan request.'''
+        if method == 'POST' and path == '/SmartHeating':
+            self.requests['plan'] += 1
+            return 200, self.createPlan(json.loads(body), time.time())
+        return 404, {'message': 'Not found'}
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+'''Module for structured logs. With LOG_FORMAT=json every log record is written as one JSON
+object per line, including the fields given with extra=, so logs can be filtered by device
+or phase. LOG_LEVEL selects how much is logged.'''
+
+import json
+import logging
+import os
+import sys
+
+# Attributes every LogRecord has, everything else was given with extra=
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message'}
+
+class JsonFormatter(logging.Formatter):
+    '''Formats log records as single-line JSON objects.'''
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': round(record.created, 3), 'level': record.levelname,
+                 'logger': record.name, 'message': record.getMessage()}
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def configureLogging(level: str = None, logFormat: str = None) -> None:
+    '''Configure root logger from arguments or LOG_LEVEL and LOG_FORMAT (text or json).'''
+    level = level or os.getenv('LOG_LEVEL', 'WARNING')
+    logFormat = logFormat or os.getenv('LOG_FORMAT', 'text')
+    if logFormat == 'json':
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        logging.basicConfig(level=level, handlers=[handler], force=True)
+    else:
+        logging.basicConfig(level=level)
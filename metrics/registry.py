@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+'''Module for in-process metrics. Counters and histograms are plain dictionaries of label
+tuples, so recording a value in the control loop costs a dictionary lookup and an addition.
+Metrics are rendered in the Prometheus text format only when they are scraped.'''
+
+from bisect import bisect_left
+
+# Phases of the control cycle
+STATUS_READ = 'status_read'
+PLAN_FETCH = 'plan_fetch'
+SETPOINT_WRITE = 'setpoint_write'
+CONTROL = 'control'
+
+# Results of plan cache lookups
+HIT = 'hit'
+SHARED = 'shared'
+MISS = 'miss'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _formatLabels(labelNames: tuple, labels: tuple, extra: str = '') -> str:
+    '''Format label set as {name="value",...}.'''
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelNames, labels)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+def _escape(value: str) -> str:
+    '''Escape label value for the text format.'''
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _formatValue(value: float) -> str:
+    '''Format sample value, integers without decimals.'''
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+class Counter:
+    '''Monotonic counter with labels.'''
+
+    def __init__(self, name: str, helpText: str, labelNames: tuple = ()) -> None:
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = labelNames
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        '''Increase counter of label values.'''
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def get(self, *labels) -> float:
+        '''Get current value of label values.'''
+        return self.values.get(labels, 0.0)
+
+    def render(self) -> list[str]:
+        '''Render counter in the text format.'''
+        lines = [f'# HELP {self.name} {self.helpText}', f'# TYPE {self.name} counter']
+        for labels, value in sorted(self.values.items()):
+            lines.append(f'{self.name}{_formatLabels(self.labelNames, labels)} '
+                         f'{_formatValue(value)}')
+        return lines
+
+class Histogram:
+    '''Histogram with fixed buckets. Bucket counts are cumulated only when rendered.'''
+
+    def __init__(self, name: str, helpText: str, labelNames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.helpText = helpText
+        self.labelNames = labelNames
+        self.buckets = tuple(buckets)
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, value: float, *labels) -> None:
+        '''Record one observation of label values.'''
+        counts = self.counts.get(labels)
+        if counts is None:
+            counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            self.sums[labels] = 0.0
+        counts[bisect_left(self.buckets, value)] += 1
+        self.sums[labels] += value
+
+    def getCount(self, *labels) -> int:
+        '''Get number of observations of label values.'''
+        return sum(self.counts.get(labels, ()))
+
+    def render(self) -> list[str]:
+        '''Render histogram in the text format.'''
+        lines = [f'# HELP {self.name} {self.helpText}', f'# TYPE {self.name} histogram']
+        for labels, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), counts):
+                cumulative += count
+                bucket = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+                lines.append(f'{self.name}_bucket'
+                             f'{_formatLabels(self.labelNames, labels, bucket)} {cumulative}')
+            labelText = _formatLabels(self.labelNames, labels)
+            lines.append(f'{self.name}_sum{labelText} {_formatValue(self.sums[labels])}')
+            lines.append(f'{self.name}_count{labelText} {cumulative}')
+        return lines
+
+class Gauge:
+    '''Gauge whose value is computed by a function when rendered.'''
+
+    def __init__(self, name: str, helpText: str, function) -> None:
+        self.name = name
+        self.helpText = helpText
+        self.function = function
+
+    def render(self) -> list[str]:
+        '''Render gauge in the text format.'''
+        return [f'# HELP {self.name} {self.helpText}', f'# TYPE {self.name} gauge',
+                f'{self.name} {_formatValue(self.function())}']
+
+class MetricsRegistry:
+    '''Metrics of the controller. Metrics of the control loop are attributes so that the
+    hot path does not look them up by name.'''
+
+    def __init__(self) -> None:
+        self.metrics = {}
+        self.phaseSeconds = self.histogram(
+            'heating_phase_seconds', 'Duration of control cycle phases in seconds.',
+            ('phase',))
+        self.retries = self.counter(
+            'heating_retries_total', 'Retried requests per device or host.', ('target',))
+        self.timeouts = self.counter(
+            'heating_timeouts_total', 'Timed out requests and device deadlines per device ' \
+            'or host.', ('target',))
+        self.circuitRejections = self.counter(
+            'heating_circuit_rejections_total', 'Requests refused by an open circuit ' \
+            'breaker per device or host.', ('target',))
+        self.skippedWrites = self.counter(
+            'heating_skipped_writes_total', 'Setpoint writes skipped because the device ' \
+            'already had the setpoint.', ('device',))
+        self.setpointWrites = self.counter(
+            'heating_setpoint_writes_total', 'Setpoint writes per device and result.',
+            ('device', 'result'))
+        self.controlResults = self.counter(
+            'heating_control_cycles_total', 'Control cycles per device and result.',
+            ('device', 'result'))
+        self.planLookups = self.counter(
+            'heating_plan_cache_lookups_total', 'Plan cache lookups by result: hit, shared ' \
+            'in-flight fetch or miss.', ('result',))
+        self.localPlans = self.counter(
+            'heating_local_plans_total', 'Plans computed locally because the API failed.')
+        self.gauge('heating_plan_cache_hit_ratio',
+                   'Share of plan lookups served without a request of their own.',
+                   self.getPlanHitRatio)
+
+    def _register(self, metric):
+        '''Register metric, returning the existing one with the same name.'''
+        return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, helpText: str, labelNames: tuple = ()) -> Counter:
+        '''Get or create counter.'''
+        return self._register(Counter(name, helpText, labelNames))
+
+    def histogram(self, name: str, helpText: str, labelNames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        '''Get or create histogram.'''
+        return self._register(Histogram(name, helpText, labelNames, buckets))
+
+    def gauge(self, name: str, helpText: str, function) -> Gauge:
+        '''Get or create gauge computed by function.'''
+        return self._register(Gauge(name, helpText, function))
+
+    def getPlanHitRatio(self) -> float:
+        '''Share of plan lookups that were hits or joined a fetch of another device.'''
+        served = self.planLookups.get(HIT) + self.planLookups.get(SHARED)
+        total = served + self.planLookups.get(MISS)
+        return served / total if total else 0.0
+
+    def render(self) -> str:
+        '''Render all metrics in the Prometheus text format.'''
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+_SHARED_REGISTRY = None
+
+def getSharedMetrics() -> MetricsRegistry:
+    '''Get process-wide metrics registry.'''
+    global _SHARED_REGISTRY # pylint: disable=global-statement
+    if _SHARED_REGISTRY is None:
+        _SHARED_REGISTRY = MetricsRegistry()
+    return _SHARED_REGISTRY
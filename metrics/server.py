@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+'''Module for the local /metrics endpoint. A minimal HTTP/1.1 server on the event loop of
+the controller renders the registry for Prometheus on each scrape.'''
+
+import asyncio
+
+from metrics.registry import MetricsRegistry, getSharedMetrics # pylint: disable=import-error
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_METRICS_PORT = 9464
+
+class MetricsServer:
+    '''Serves GET /metrics from the registry.'''
+
+    def __init__(self, registry: MetricsRegistry = None, host: str = '127.0.0.1',
+                 port: int = DEFAULT_METRICS_PORT) -> None:
+        self.registry = registry if registry is not None else getSharedMetrics()
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        '''Answer one request and close the connection.'''
+        try:
+            requestLine = await asyncio.wait_for(reader.readline(), 10.0)
+            while (await asyncio.wait_for(reader.readline(), 10.0)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = requestLine.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, contentType = '200 OK', CONTENT_TYPE
+                body = self.registry.render().encode('utf-8')
+            else:
+                status, contentType, body = '404 Not Found', 'text/plain', b'Not Found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {contentType}\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'
+                         .encode('latin-1') + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self) -> None:
+        '''Start listening. Port 0 selects a free port.'''
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        '''Stop listening.'''
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def runForever(self) -> None:
+        '''Serve until cancelled. If the port cannot be bound, control runs without metrics.'''
+        try:
+            await self.start()
+        except OSError as err:
+            print(f'Mittareita ei voitu julkaista portissa {self.port}, virhe: {err}. ' \
+                  'Säätö jatkuu ilman mittareita.')
+            return
+        print(f'Mittarit ovat saatavilla osoitteessa http://{self.host}:{self.port}/metrics')
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
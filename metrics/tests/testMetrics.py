@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+'''Module for unit test for metrics registry, endpoint and JSON logs.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s metrics/tests -p "testMetrics.py"
+'''
+
+import asyncio
+import json
+import logging
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+import httpx
+
+from apis.smartheating import PlanCache # pylint: disable=import-error
+from devices.thermostat import Thermostat # pylint: disable=import-error
+from metrics.logs import JsonFormatter # pylint: disable=import-error
+from metrics.registry import (HIT, MISS, SETPOINT_WRITE, SHARED, STATUS_READ, # pylint: disable=import-error
+                              MetricsRegistry)
+from metrics.server import MetricsServer # pylint: disable=import-error
+
+class TestMetricsRegistry(unittest.TestCase):
+    '''Unit tests for MetricsRegistry class.'''
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def testHistogramRendersCumulativeBuckets(self):
+        '''Buckets are cumulative and end with +Inf, sum and count.'''
+        histogram = self.registry.histogram('test_seconds', 'Test.', ('phase',), (0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, 'read')
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{phase="read",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{phase="read",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{phase="read",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_sum{phase="read"} 6.05', lines)
+        self.assertIn('test_seconds_count{phase="read"} 4', lines)
+
+    def testCountersAndHitRatio(self):
+        '''Shared in-flight fetches count as served lookups.'''
+        for result in (HIT, HIT, SHARED, MISS):
+            self.registry.planLookups.inc(result)
+        self.registry.skippedWrites.inc('olohuone "iso"')
+        text = self.registry.render()
+        self.assertIn('heating_plan_cache_hit_ratio 0.75', text)
+        self.assertIn('heating_skipped_writes_total{device="olohuone \\"iso\\""} 1', text)
+        self.assertIn('# TYPE heating_phase_seconds histogram', text)
+
+    def testObserveIsCheap(self):
+        '''Recording is fast enough to be done on every request of every device.'''
+        histogram = self.registry.phaseSeconds
+        start = time.perf_counter()
+        for _ in range(100_000):
+            histogram.observe(0.02, STATUS_READ)
+        self.assertLess((time.perf_counter() - start) / 100_000, 20e-6)
+
+    def testJsonFormatterIncludesExtraFields(self):
+        '''Fields given with extra= end up in the JSON object.'''
+        record = logging.LogRecord('control.engine', logging.INFO, __file__, 1,
+                                   'control cycle', None, None)
+        record.device = 'olohuone'
+        record.seconds = 0.25
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual((entry['level'], entry['message'], entry['device'], entry['seconds']),
+                         ('INFO', 'control cycle', 'olohuone', 0.25))
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+    '''Metrics recorded by devices, plan cache and endpoint.'''
+
+    @patch('builtins.print')
+    async def testDeviceRecordsPhasesAndSkippedWrites(self, _mockPrint):
+        '''Status read and setpoint write are timed and unchanged setpoint is counted.'''
+        registry = MetricsRegistry()
+        device = Thermostat("devices/tests/test_config.json", planCache=MagicMock(),
+                            history=MagicMock(), metrics=registry)
+        device.sendTempToDeviceAsync = MagicMock(
+            side_effect=lambda temp: asyncio.sleep(0, httpx.Response(200)))
+        device._getStatusResponseAsync = MagicMock( # pylint: disable=protected-access
+            side_effect=lambda: asyncio.sleep(0, httpx.Response(
+                200, json={'parameters': {'heatingSetpoint': 18.0}})))
+        status = await device.getCurrentStatusAsync()
+        await device.adjustTempSetpointAsync(status, True)
+        await device.adjustTempSetpointAsync(None, True)
+        self.assertEqual(registry.phaseSeconds.getCount(STATUS_READ), 1)
+        self.assertEqual(registry.phaseSeconds.getCount(SETPOINT_WRITE), 1)
+        self.assertEqual(registry.setpointWrites.get('default', '200'), 1)
+        self.assertEqual(registry.skippedWrites.get('default'), 1)
+
+    @patch('builtins.print')
+    async def testPlanCacheCountsSharedFetches(self, _mockPrint):
+        '''Concurrent lookups of the same payload are one miss and shared lookups.'''
+        registry = MetricsRegistry()
+        now = time.time()
+        plan = {'PlanAhead': [{'epochMs': int(now * 1000), 'result': True}],
+                'EpochMsExpiration': int((now + 3600) * 1000), 'AverageTemperature': 0.0}
+
+        async def post(*_args, **_kwargs):
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json=plan)
+        clients = MagicMock()
+        clients.getAsyncClient.return_value.post = post
+        cache = PlanCache(cachePath=None, clients=clients, metrics=registry)
+        await asyncio.gather(*(cache.getPlanAsync({'Region': 'FI'}, now) for _ in range(3)))
+        await cache.getPlanAsync({'Region': 'FI'}, now)
+        self.assertEqual([registry.planLookups.get(result) for result in (MISS, SHARED, HIT)],
+                         [1, 2, 1])
+
+    async def testEndpointServesMetrics(self):
+        '''GET /metrics returns the text format and other paths 404.'''
+        registry = MetricsRegistry()
+        registry.retries.inc('olohuone')
+        server = MetricsServer(registry, port=0)
+        await server.start()
+        try:
+            async with httpx.AsyncClient() as client:
+                response = await client.get(f'http://127.0.0.1:{server.port}/metrics')
+                missing = await client.get(f'http://127.0.0.1:{server.port}/')
+        finally:
+            await server.close()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('heating_retries_total{target="olohuone"} 1', response.text)
+        self.assertEqual(missing.status_code, 404)
+
+    @patch('builtins.print')
+    async def testTakenPortDoesNotStopControl(self, mockPrint):
+        '''Server on a port in use reports the error and returns without raising.'''
+        first = MetricsServer(MetricsRegistry(), port=0)
+        await first.start()
+        try:
+            second = MetricsServer(MetricsRegistry(), port=first.port)
+            await asyncio.wait_for(second.runForever(), 5.0)
+        finally:
+            await first.close()
+        self.assertIsNone(second.server)
+        self.assertIn(str(first.port), mockPrint.call_args.args[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,96 +1,128 @@
 #!/usr/bin/env python3
 '''Main module for heating optimization'''
 
-import json
-import time
+import asyncio
+import os
 from pathlib import Path
 
-import schedule
-
+from apis.prices import getSharedSeriesUpdater # pylint: disable=import-error
+from control.configwatcher import DEFAULT_CONFIG_PATH, ConfigWatcher, scanConfigs # pylint: disable=import-error
+from control.engine import ControlEngine # pylint: disable=import-error
+from control.loadbalancer import LoadBalancer # pylint: disable=import-error
+from control.scheduler import EventScheduler # pylint: disable=import-error
+from control.supervisor import SHARD_BY_SITE, Supervisor, WorkerContext # pylint: disable=import-error
+from devices.config import ConfigError, loadDeviceConfig # pylint: disable=import-error
 from devices.device import Device # pylint: disable=import-error
-from devices.panel import Panel # pylint: disable=import-error
-from devices.thermostat import Thermostat # pylint: disable=import-error
-from devices.heatpump import HeatPump # pylint: disable=import-error
-
-def setHeating(target: Device) -> None:
-    '''Set heating based on current status and api-spot-hinta.fi data.'''
-    #Printataan perustiedot
-    name = target.getName()
-    timestamp = time.localtime(time.time())
-    strTime = time.strftime('%H:%M:%S (%a %d %b)', timestamp)
-    print(f'Kello on {strTime}. Asetetaan säädöt kohteeseen: {name}')
-
-    #Käydään hakemassa tämän hetkinen tilanne termarilta
-    status = target.getCurrentStatus()
-    if not status:
-        print('Laitteeseen ei saatu yhteyttä ja säätöä ei jatketa. Yritetään ' \
-              'tunnin päästä uudelleen.')
-        return
-
-    #Käydään hakemassa API:lta lämmityksen tarve
-    heating = target.getHeatingDemand()
-    #Asetetaan lämmitys seuraavalle tunnille saatujen tietojen perusteella
-    successful = target.adjustTempSetpoint(status, heating)
-    if not successful:
-        print('Lämpötilan asettaminen laitteeseen epäonnistui.')
-    else:
-        target.plotHistory()
-
-def getDeviceType(file) -> str:
-    '''Get device type from configuration file.'''
-    with open(file, 'r', encoding='utf-8') as jsonFile:
-        data = jsonFile.read()
-    parsedData = json.loads(data)
-    return parsedData[0]['type']
+from devices.registry import getSharedDriverRegistry # pylint: disable=import-error
+from metrics.logs import configureLogging # pylint: disable=import-error
+from metrics.server import DEFAULT_METRICS_PORT, MetricsServer # pylint: disable=import-error
+from storage.journal import StateJournal, getSharedStateJournal # pylint: disable=import-error
 
 def createObject(file: Path) -> Device:
-    '''Create device object based on configuration file.'''
-    deviceType = getDeviceType(file)
-    match deviceType:
-        case 'panel':
-            device = Panel(file)
-        case 'thermostat':
-            device = Thermostat(file)
-        case 'heatpump':
-            device = HeatPump(file)
-        case _:
-            print(f'Tiedostossa {file} on tuntematon laitetyyppi {deviceType}, objektia ei luoda.')
-            return None
-    return device
+    '''Create device object based on configuration file. The driver of the device type is
+    imported on first use. Raises ConfigError if the configuration is invalid.'''
+    return getSharedDriverRegistry().createDevice(file)
 
-def readConfigs(devices: list) -> list[Device]:
-    '''Read configuration files and create device objects.'''
+def readConfigs(devices: list, accept=None) -> list[Device]:
+    '''Read configuration files and create device objects. Optional accept(path) selects
+    the files of one worker process.'''
     devices.clear()
-    configPath = 'configs/'
-    filelist = Path(configPath).rglob('*.json')
-    for file in filelist:
-        if 'default.json' in str(file):
-            continue
+    errors = []
+    for file in scanConfigs(DEFAULT_CONFIG_PATH, accept):
         print(f'Löytyi konfiguraatiotiedosto: {file}. Luodaan sille objekti ja ajastetaan säätö.')
-        device = createObject(file)
-        devices.append(device)
+        try:
+            device = createObject(file)
+        except ConfigError as err:
+            errors.append(err)
+            continue
+        if device is not None:
+            devices.append(device)
+    if errors:
+        for err in errors:
+            print(f'Virheellinen konfiguraatio: {err}')
+        raise SystemExit('Korjaa konfiguraatiotiedostot ennen käynnistystä.')
     return devices
 
+def validateConfigs() -> int:
+    '''Validate configuration files without creating device objects. Returns number of
+    files.'''
+    errors = []
+    files = scanConfigs(DEFAULT_CONFIG_PATH)
+    for file in files:
+        try:
+            loadDeviceConfig(file)
+        except ConfigError as err:
+            errors.append(err)
+    if errors:
+        for err in errors:
+            print(f'Virheellinen konfiguraatio: {err}')
+        raise SystemExit('Korjaa konfiguraatiotiedostot ennen käynnistystä.')
+    return len(files)
+
+async def runService(scheduler: EventScheduler, watcher: ConfigWatcher,
+                     metricsServer: MetricsServer = None, worker: WorkerContext = None) -> None:
+    '''Run scheduler, configuration watcher, metrics endpoint and heartbeat of worker
+    process together.'''
+    services = [scheduler.runForever(), watcher.runForever()]
+    if metricsServer is not None:
+        services.append(metricsServer.runForever())
+    if worker is not None:
+        services.append(worker.runHeartbeat(watcher))
+    await asyncio.gather(*services)
+
+def getMetricsPort() -> int:
+    '''Get port of the metrics endpoint, 0 if it is disabled.'''
+    # Mittarit Prometheukselle osoitteessa http://127.0.0.1:9464/metrics, METRICS_PORT=0 poistaa
+    return int(os.getenv('METRICS_PORT', str(DEFAULT_METRICS_PORT)))
+
+def runController(devices: list[Device], journal: StateJournal, metricsPort: int,
+                  worker: WorkerContext = None) -> None:
+    '''Control given devices until the process is stopped.'''
+    #Ajetaan säätö kohteille silloin, kun suunnitelma muuttuu tai vanhenee
+    # SITE_POWER_CAP rajoittaa yhtä aikaa lämmittävien laitteiden yhteistehoa (W)
+    # Työprosessit jakavat saman rajan
+    powerCap = os.getenv('SITE_POWER_CAP')
+    budget = worker.getPowerBudget() if worker is not None else None
+    loadBalancer = LoadBalancer(float(powerCap), budget=budget) if powerCap else None
+    engine = ControlEngine(devices, loadBalancer=loadBalancer, journal=journal)
+    # Edellisen ajon suunnitelmat, asetetut lämpötilat ja katkaisijat jatkavat ilman kyselyjä
+    restored = engine.restoreState()
+    if restored:
+        print(f'Palautettiin {restored} laitteen tila edellisestä ajosta.')
+    scheduler = EventScheduler(engine, series=getSharedSeriesUpdater())
+    # Lisätyt, poistetut ja muutetut konfiguraatiot otetaan käyttöön ilman
+    # uudelleenkäynnistystä
+    watcher = ConfigWatcher(scheduler, createObject,
+                            accept=worker.owns if worker is not None else None)
+    metricsServer = MetricsServer(port=metricsPort) if metricsPort else None
+    asyncio.run(runService(scheduler, watcher, metricsServer, worker))
+
+def runWorker(worker: WorkerContext) -> None:
+    '''Entry point of a worker process started by the supervisor.'''
+    configureLogging()
+    devices = readConfigs([], worker.owns)
+    print(f'Työprosessi {worker.index} ohjaa {len(devices)} laitetta.')
+    basePort = getMetricsPort()
+    journal = StateJournal(Path(f'cache/state-{worker.index}.journal'))
+    runController(devices, journal, basePort + 1 + worker.index if basePort else 0, worker)
+
 def main() -> None:
     '''Main function to run the heating optimization.'''
+    # LOG_LEVEL=DEBUG tulostaa mm. koko lämmityssuunnitelman, LOG_FORMAT=json kirjoittaa
+    # lokit JSON-riveinä
+    configureLogging()
+    # WORKERS jakaa laitteet useammalle prosessille sivustoittain (SHARD_MODE=site) tai
+    # tiedostoittain (SHARD_MODE=hash)
+    workers = int(os.getenv('WORKERS', '1'))
+    if workers > 1:
+        count = validateConfigs()
+        print(f'Jaetaan {count} laitetta {workers} työprosessille.')
+        Supervisor(workers, runWorker, mode=os.getenv('SHARD_MODE', SHARD_BY_SITE)).runForever()
+        return
     devices = []
     # Luodaan objektit jokaiselle ohjattavalle kohteelle. Annetaan nimet ja IP-osoitteet
     devices = readConfigs(devices)
-    #Ajastetaan säätöfunktio jokaiselle kohteelle
-    baseTime = 10
-    for device in devices:
-        schedule.every().hour.at(f'01:{baseTime}').do(setHeating, device)
-        schedule.every().hour.at(f'16:{baseTime}').do(setHeating, device)
-        schedule.every().hour.at(f'31:{baseTime}').do(setHeating, device)
-        schedule.every().hour.at(f'46:{baseTime}').do(setHeating, device)
-        baseTime += 2
-    schedule.run_all()
-    while True:
-        schedule.run_pending()
-        time.sleep(30)
-
-
-
+    runController(devices, getSharedStateJournal(), getMetricsPort())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+'''Module for dry-run replays. Spot prices and outdoor temperatures recorded in the series
+store and room temperatures recorded in the history store are replayed against a simulated
+clock for configuration variants, such as a different HeatingPercentage_*,
+MinimumHeatingTime or tempHigh. Plans come from the local planner, heating decisions from
+Device and room temperatures from the thermal model learned from the history of every
+device. Energy, cost and comfort are reported for each variant. Nothing is sent to devices
+or APIs.
+Run with command in the main directory of the project:
+python3 -m simulation.replay --days 30 --variant "viileämpi:tempHigh=21"
+'''
+
+import argparse
+import json
+import math
+import re
+import time
+from bisect import bisect_right
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from apis.localplanner import SLOT_MILLIS, LocalPlanner, PriceSeries # pylint: disable=import-error
+from apis.smartheating import HeatingPlan, PlanCache, getPayloadKey # pylint: disable=import-error
+from control.configwatcher import DEFAULT_CONFIG_PATH, scanConfigs # pylint: disable=import-error
+from devices.config import ConfigError, DeviceConfig, parseDeviceConfig # pylint: disable=import-error
+from devices.device import Device # pylint: disable=import-error
+from devices.thermal import SLOT_HOURS, ThermalModel # pylint: disable=import-error
+from metrics.registry import MetricsRegistry # pylint: disable=import-error
+from storage.history import DEFAULT_HISTORY_PATH, HistoryStore # pylint: disable=import-error
+from storage.series import DEFAULT_SERIES_PATH, PRICE, TEMPERATURE, SeriesStore # pylint: disable=import-error
+
+BASELINE = 'nykyinen'
+# Fields of the first object of the configuration, the rest go to the API payload
+DEVICE_FIELDS = ('tempLow', 'tempHigh', 'power', 'maxPreheat')
+# Outdoor temperature points are hourly, older points are not used for a slot
+MAX_TEMPERATURE_AGE = 3 * 3600 * 1000
+# Prices may end before the current slot, a longer gap means the series is too short
+MAX_COVERAGE_GAP = 3600 * 1000
+
+@dataclass
+class Variant:
+    '''Named configuration fields that replace the recorded ones on every device.'''
+    name: str
+    overrides: dict = field(default_factory=dict)
+
+    def apply(self, parsedData: list, path: Path) -> DeviceConfig:
+        '''Create validated configuration of the variant from parsed configuration file.
+        Raises ConfigError if a replaced value is invalid.'''
+        device, api = dict(parsedData[0]), dict(parsedData[1])
+        for key, value in self.overrides.items():
+            if key in device or key in DEVICE_FIELDS:
+                device[key] = value
+            else:
+                api[key] = value
+        return parseDeviceConfig([device, api, *parsedData[2:]], path)
+
+def parseVariant(text: str) -> Variant:
+    '''Parse variant "name:field=value,field=value". Values are JSON, other text is taken
+    as a string.'''
+    name, _, fields = text.partition(':')
+    overrides = {}
+    for item in re.split(r',(?=\s*[A-Za-z_]\w*=)', fields) if fields.strip() else []:
+        key, separator, value = item.partition('=')
+        if not separator:
+            raise ValueError(f'Muunnelman {name} kentältä {key} puuttuu arvo')
+        try:
+            overrides[key.strip()] = json.loads(value)
+        except ValueError:
+            overrides[key.strip()] = value.strip()
+    return Variant(name.strip(), overrides)
+
+def stepRoom(model: ThermalModel, room: float, setpoint: float,
+             outdoor: float) -> tuple[float, float]:
+    '''Advance room temperature by one slot under a thermostat that heats at full power
+    below its setpoint and then holds the setpoint. Returns the new room temperature and
+    the heated share of the slot.'''
+    _, gain, _ = model.theta
+    hold = min(1.0, max(0.0, -model.getRate(setpoint, outdoor, False) / gain))
+    if room < setpoint:
+        rate = model.getRate(room, outdoor, True)
+        if rate * SLOT_HOURS <= setpoint - room:
+            return room + rate * SLOT_HOURS, 1.0
+        reached = (setpoint - room) / (rate * SLOT_HOURS)
+        return setpoint, reached + (1.0 - reached) * hold
+    rate = model.getRate(room, outdoor, False)
+    if room + rate * SLOT_HOURS >= setpoint:
+        return room + rate * SLOT_HOURS, 0.0
+    reached = (room - setpoint) / (-rate * SLOT_HOURS)
+    return setpoint, (1.0 - reached) * hold
+
+@dataclass
+class VariantResult:
+    '''Energy and comfort of one variant summed over devices. Temperatures are counted
+    only for devices whose thermal model is ready.'''
+    name: str
+    devices: int = 0
+    heatingHours: float = 0.0
+    energy: float = 0.0
+    cost: float = 0.0
+    hours: float = 0.0
+    temperatureHours: float = 0.0
+    minTemperature: float = math.inf
+    discomfort: float = 0.0
+
+    def getMeanTemperature(self) -> float:
+        '''Get time-weighted mean room temperature, NaN if no room was simulated.'''
+        return self.temperatureHours / self.hours if self.hours else math.nan
+
+    def toDict(self) -> dict:
+        '''Get result for JSON output.'''
+        result = asdict(self)
+        result['meanTemperature'] = self.getMeanTemperature()
+        return result
+
+@dataclass(frozen=True, slots=True)
+class _Region:
+    '''Recorded series of one region. Outdoor temperatures are aligned to price slots.'''
+    name: str
+    epochs: memoryview
+    prices: memoryview
+    temperatureEpochs: memoryview
+    temperatures: memoryview
+    outdoors: list
+    days: list
+    dayTemperatures: dict
+
+    def getOutdoor(self, epochMillis: int) -> float:
+        '''Get recorded outdoor temperature at given time, None if there is none.'''
+        index = bisect_right(self.temperatureEpochs, epochMillis) - 1
+        if index < 0 or epochMillis - self.temperatureEpochs[index] > MAX_TEMPERATURE_AGE:
+            return None
+        return self.temperatures[index]
+
+class Replay:
+    '''Simulates devices over recorded series for many variants at once. Variants share
+    the price rankings of the planner, identical plans and the thermal model of the
+    device, so adding a variant costs only its own control loop.'''
+
+    def __init__(self, series: SeriesStore, history: HistoryStore, start: float, end: float,
+                 fitDays: float = 14.0) -> None:
+        self.series = series
+        self.history = history
+        self.start = start
+        self.end = end
+        self.fitDays = fitDays
+        self.metrics = MetricsRegistry()
+        self.planner = LocalPlanner()
+        self.planCache = PlanCache(cachePath=None, localPlanner=self.planner,
+                                   metrics=self.metrics)
+        self.regions = {}
+        self.plans = {}
+        self.batchCache = {}
+
+    def _loadRegion(self, region: str) -> _Region:
+        '''Give recorded prices of region to the planner. Returns None if there are none.'''
+        if region in self.regions:
+            return self.regions[region]
+        startMillis, endMillis = int(self.start * 1000), int(self.end * 1000)
+        epochs, prices = self.series.query(PRICE, region, startMillis, endMillis)
+        if not len(epochs):
+            self.regions[region] = None
+            return None
+        covered = epochs[-1] + SLOT_MILLIS - epochs[0]
+        if endMillis - startMillis - covered > MAX_COVERAGE_GAP:
+            print(f'Varoitus: alueelle {region} on tallennettu hintoja vain ' \
+                  f'{covered / 86400_000:.1f} päivältä, pyydettiin ' \
+                  f'{(endMillis - startMillis) / 86400_000:.1f} päivää. Kasvata ' \
+                  'SERIES_RETENTION_DAYS-arvoa, jotta simulointi kattaa koko jakson.')
+        self.planner.setPrices(region, PriceSeries(epochs, prices))
+        temperatureEpochs, temperatures = self.series.query(
+            TEMPERATURE, region, startMillis - int(self.fitDays * 86400_000) - MAX_TEMPERATURE_AGE,
+            endMillis)
+        data = _Region(region, epochs, prices, temperatureEpochs, temperatures, [],
+                       list(self.planner.calendars[region].days), {})
+        data.outdoors.extend(data.getOutdoor(epoch) for epoch in epochs)
+        dayValues = {}
+        for day, outdoor in zip(data.days, data.outdoors):
+            if outdoor is not None:
+                dayValues.setdefault(day, []).append(outdoor)
+        data.dayTemperatures.update({day: sum(values) / len(values)
+                                     for day, values in dayValues.items()})
+        self.regions[region] = data
+        return data
+
+    def _fitModel(self, name: str, region: _Region) -> tuple[ThermalModel, float]:
+        '''Learn thermal model of device from its history. Returns the model and the room
+        temperature at the start of the replay, None if it is not known.'''
+        model = ThermalModel()
+        room = None
+        for timestamp, roomTemp, _, setpoint in self.history.read(
+                name, self.start - self.fitDays * 86400, self.end):
+            if math.isnan(roomTemp):
+                # Setpoint writes between readings give the heated share of the interval
+                if not math.isnan(setpoint):
+                    model.addSetpoint(timestamp, setpoint)
+                continue
+            model.addSample(timestamp, roomTemp, None if math.isnan(setpoint) else setpoint,
+                            region.getOutdoor(timestamp * 1000))
+            if timestamp <= self.start or room is None:
+                room = roomTemp
+        return model, room
+
+    def _getPlan(self, payload: dict, region: _Region) -> HeatingPlan:
+        '''Get plan of the whole replay. Devices and variants with the same payload share it.'''
+        key = getPayloadKey(payload)
+        plan = self.plans.get(key)
+        if plan is None:
+            demand = self.planner.computeDemand(payload, region.dayTemperatures, self.batchCache)
+            plan = HeatingPlan.fromResponse({
+                'PlanAhead': [{'epochMs': epoch, 'result': bool(result)}
+                              for epoch, result in zip(region.epochs, demand)],
+                'EpochMsExpiration': region.epochs[-1] + SLOT_MILLIS,
+                'AverageTemperature': None})
+            self.plans[key] = plan
+        return plan
+
+    def _simulate(self, device: Device, region: _Region, model: ThermalModel, room: float,
+                  comfort: float, result: VariantResult) -> None:
+        '''Run control decisions of device on every slot and accumulate the result.'''
+        low, high = device.config.tempLow, device.config.tempHigh
+        power = device.getPower() / 1000
+        day = None
+        if room is None:
+            room = low
+        result.devices += 1
+        for index, epoch in enumerate(region.epochs):
+            if region.days[index] != day:
+                day = region.days[index]
+                self.planner.setTemperature(region.name, region.dayTemperatures.get(day))
+            # The tick runs right after the slot has started
+            device.roomTemperature = room
+            heating = device.getPlannedDemand((epoch + 1000) / 1000)
+            outdoor = region.outdoors[index]
+            if model is None or outdoor is None:
+                share = 1.0 if heating else 0.0
+            else:
+                room, share = stepRoom(model, room, high if heating else low, outdoor)
+                result.hours += SLOT_HOURS
+                result.temperatureHours += room * SLOT_HOURS
+                result.minTemperature = min(result.minTemperature, room)
+                result.discomfort += max(0.0, comfort - room) * SLOT_HOURS
+            energy = power * share * SLOT_HOURS
+            result.heatingHours += share * SLOT_HOURS
+            result.energy += energy
+            result.cost += energy * region.prices[index] / 100
+
+    def run(self, configs: list[tuple[Path, list]],
+            variants: list[Variant]) -> list[VariantResult]:
+        '''Replay every device for every variant. Configurations are (path, parsed JSON)
+        pairs. Comfort is measured against the recorded tempLow of the device.'''
+        results = [VariantResult(variant.name) for variant in variants]
+        for path, parsedData in configs:
+            try:
+                recorded = parseDeviceConfig(parsedData, path)
+            except ConfigError as err:
+                print(f'Virheellinen konfiguraatio: {err}')
+                continue
+            device = Device(path, recorded, planCache=self.planCache, history=self.history,
+                            metrics=self.metrics)
+            model, room = None, None
+            for variant, result in zip(variants, results):
+                try:
+                    device.reloadConfig(variant.apply(parsedData, path))
+                except ConfigError as err:
+                    print(f'Muunnelmaa {variant.name} ei voitu käyttää: {err}')
+                    continue
+                region = self._loadRegion(device.apiPayload.get('Region'))
+                if region is None:
+                    print(f'Alueelle {device.apiPayload.get('Region')} ei ole tallennettu ' \
+                          f'hintoja, laitetta {recorded.name} ei simuloida.')
+                    continue
+                if model is None:
+                    model, room = self._fitModel(recorded.name, region)
+                    device.thermal = model
+                    if not model.isReady():
+                        print(f'Laitteen {recorded.name} historiasta ei voitu oppia huoneen ' \
+                              'mallia, huonelämpöä ei simuloida.')
+                device.plan = self._getPlan(device.apiPayload, region)
+                self._simulate(device, region, model if model.isReady() else None, room,
+                               recorded.tempLow, result)
+        return results
+
+def readConfigs(root: Path) -> list[tuple[Path, list]]:
+    '''Read configuration files as parsed JSON.'''
+    configs = []
+    for path in scanConfigs(root):
+        try:
+            with open(path, 'r', encoding='utf-8') as jsonFile:
+                configs.append((path, json.load(jsonFile)))
+        except (OSError, ValueError) as err:
+            print(f'Konfiguraatiota {path} ei voitu lukea, virhe: {err}')
+    return configs
+
+def formatResult(result: VariantResult) -> str:
+    '''Format one result as a table row.'''
+    minimum = '-' if math.isinf(result.minTemperature) else f'{result.minTemperature:.1f}'
+    return (f'{result.name:<16} {result.devices:>7} {result.heatingHours:>9.1f} '
+            f'{result.energy:>9.1f} {result.cost:>9.2f} {result.getMeanTemperature():>8.1f} '
+            f'{minimum:>8} {result.discomfort:>9.1f}')
+
+HEADER = (f'{'muunnelma':<16} {'laitteet':>7} {'lämm. h':>9} {'kWh':>9} {'eur':>9} '
+          f'{'ka C':>8} {'min C':>8} {'alle Ch':>9}')
+
+def main() -> None:
+    '''Parse arguments, replay recorded data for every variant and print results.'''
+    parser = argparse.ArgumentParser(description='Ohjauksen simulointi tallennetulla datalla')
+    parser.add_argument('--days', type=float, default=30.0)
+    parser.add_argument('--end', help='simuloinnin loppupäivä muodossa YYYY-MM-DD, ' \
+                        'oletuksena nykyhetki')
+    parser.add_argument('--variant', type=parseVariant, action='append', default=[],
+                        help='muunnelma muodossa nimi:kenttä=arvo,kenttä=arvo')
+    parser.add_argument('--variants', type=Path,
+                        help='JSON-tiedosto muodossa {"nimi": {"kenttä": arvo}}')
+    parser.add_argument('--fit-days', type=float, default=14.0,
+                        help='historiaa huoneen mallin oppimiseen ennen simulointia')
+    parser.add_argument('--configs', type=Path, default=DEFAULT_CONFIG_PATH)
+    parser.add_argument('--series', type=Path, default=DEFAULT_SERIES_PATH)
+    parser.add_argument('--history', type=Path, default=DEFAULT_HISTORY_PATH)
+    parser.add_argument('--json', type=Path, help='tallenna tulokset JSON-tiedostoon')
+    args = parser.parse_args()
+
+    end = time.mktime(time.strptime(args.end, '%Y-%m-%d')) if args.end else time.time()
+    variants = [Variant(BASELINE)] + args.variant
+    if args.variants:
+        with open(args.variants, 'r', encoding='utf-8') as jsonFile:
+            variants.extend(Variant(name, overrides)
+                            for name, overrides in json.load(jsonFile).items())
+    replay = Replay(SeriesStore(args.series), HistoryStore(args.history),
+                    end - args.days * 86400, end, args.fit_days)
+    started = time.perf_counter()
+    results = replay.run(readConfigs(args.configs), variants)
+    print(HEADER)
+    for result in results:
+        print(formatResult(result))
+    print(f'Simuloitiin {len(variants)} muunnelmaa {args.days:g} päivältä ' \
+          f'{time.perf_counter() - started:.1f} sekunnissa.')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as jsonFile:
+            json.dump([result.toDict() for result in results], jsonFile, indent=2)
+
+if __name__ == '__main__':
+    main()
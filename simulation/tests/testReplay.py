@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+'''Module for unit test for dry-run replay.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s simulation/tests -p "testReplay.py"
+'''
+
+import json
+import math
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from devices.thermal import ThermalModel # pylint: disable=import-error
+from simulation.replay import (BASELINE, Replay, Variant, parseVariant, # pylint: disable=import-error
+                               stepRoom)
+from storage.history import HistoryStore # pylint: disable=import-error
+from storage.series import PRICE, TEMPERATURE, SeriesStore # pylint: disable=import-error
+
+SLOT = 900
+START = 1_700_000_000 - 1_700_000_000 % 86400
+DAYS = 10
+
+def getOutdoor(timestamp: float) -> float:
+    '''Outdoor temperature with a daily cycle.'''
+    return -5.0 + 4.0 * math.sin(timestamp / 86400 * 2 * math.pi)
+
+def getPrice(timestamp: float) -> float:
+    '''Price is high in the evening.'''
+    return 20.0 if 16 <= timestamp % 86400 // 3600 < 21 else 5.0
+
+class TestReplay(unittest.TestCase):
+    '''Unit tests for Replay class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        root = Path(self.tmpDir.name)
+        self.series = SeriesStore(root / 'series', retentionDays=1000)
+        self.history = HistoryStore(root / 'history')
+        end = START + DAYS * 86400
+        self.series.write(PRICE, 'FI', {int(timestamp * 1000): getPrice(timestamp)
+                                        for timestamp in range(START - 86400, end, SLOT)}, end)
+        self.series.write(TEMPERATURE, 'FI', {int(timestamp * 1000): getOutdoor(timestamp)
+                                              for timestamp in range(START - 7 * 86400, end, 3600)},
+                          end)
+        # Room with loss 0.05 1/h and gain 2 C/h, heated on the night hours
+        truth = ThermalModel()
+        truth.theta = [0.05, 2.0, 0.0]
+        room = 20.0
+        with patch('builtins.print'):
+            for timestamp in range(START - 7 * 86400, START, SLOT):
+                setpoint = 22.0 if timestamp % 86400 // 3600 < 6 else 19.0
+                self.history.append('olohuone', timestamp, room, 25.0, setpoint)
+                room, _ = stepRoom(truth, room, setpoint, getOutdoor(timestamp))
+        with open('devices/tests/test_config.json', 'r', encoding='utf-8') as jsonFile:
+            parsedData = json.load(jsonFile)
+        parsedData[0].update({'name': 'olohuone', 'power': 1000})
+        self.configs = [(Path('configs/olohuone.json'), parsedData)]
+        self.replay = Replay(self.series, self.history, START, end, fitDays=7)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def testParseVariant(self):
+        '''Values are JSON and lists may contain commas.'''
+        variant = parseVariant('yö:NightHours=[22,23,0],tempHigh=21.5,Region=SE3')
+        self.assertEqual(variant.name, 'yö')
+        self.assertEqual(variant.overrides,
+                         {'NightHours': [22, 23, 0], 'tempHigh': 21.5, 'Region': 'SE3'})
+        self.assertEqual(parseVariant('nykyinen').overrides, {})
+
+    def testVariantsChangeEnergyAndComfort(self):
+        '''Lower tempHigh uses less energy and more heating keeps the room warmer.'''
+        with patch('builtins.print'):
+            baseline, cooler, warmer = self.replay.run(self.configs, [
+                Variant(BASELINE), Variant('viileämpi', {'tempHigh': 20.0}),
+                Variant('enemmän', {'HeatingPercentage_Zero': 80,
+                                    'HeatingPercentage_Minus10': 90})])
+        self.assertEqual(baseline.devices, 1)
+        self.assertAlmostEqual(baseline.hours, DAYS * 24)
+        self.assertGreater(baseline.energy, 0)
+        self.assertAlmostEqual(baseline.energy, baseline.heatingHours)
+        self.assertLess(cooler.energy, baseline.energy)
+        self.assertGreater(baseline.cost, 0)
+        self.assertLess(cooler.getMeanTemperature(), baseline.getMeanTemperature())
+        self.assertGreater(warmer.heatingHours, baseline.heatingHours)
+        self.assertGreater(warmer.getMeanTemperature(), baseline.getMeanTemperature())
+        self.assertLessEqual(warmer.discomfort, baseline.discomfort)
+
+    def testInvalidVariantIsSkipped(self):
+        '''Variant that does not pass validation is not simulated.'''
+        with patch('builtins.print') as mockPrint:
+            _, invalid = self.replay.run(self.configs, [Variant(BASELINE),
+                                                        Variant('rikki', {'tempLow': 30.0})])
+        self.assertEqual(invalid.devices, 0)
+        self.assertTrue(any('rikki' in call.args[0] for call in mockPrint.call_args_list))
+
+    def testShortSeriesIsWarned(self):
+        '''Replay longer than the recorded prices prints a warning, covered one does not.'''
+        with patch('builtins.print') as mockPrint:
+            self.replay.run(self.configs, [Variant(BASELINE)])
+        self.assertFalse(any('SERIES_RETENTION_DAYS' in call.args[0]
+                             for call in mockPrint.call_args_list))
+        replay = Replay(self.series, self.history, START - 5 * 86400, START + DAYS * 86400,
+                        fitDays=7)
+        with patch('builtins.print') as mockPrint:
+            results = replay.run(self.configs, [Variant(BASELINE)])
+        self.assertTrue(any('SERIES_RETENTION_DAYS' in call.args[0]
+                            for call in mockPrint.call_args_list))
+        self.assertEqual(results[0].devices, 1)
+
+    def testRegionWithoutPricesIsSkipped(self):
+        '''Devices are simulated only where prices have been recorded.'''
+        with patch('builtins.print'):
+            results = self.replay.run(self.configs, [Variant('ruotsi', {'Region': 'SE3'})])
+        self.assertEqual(results[0].devices, 0)
+
+if __name__ == '__main__':
+    unittest.main()
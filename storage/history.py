@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+'''Module for compact on-disk temperature history. Every device has append-only daily
+segments of fixed-width binary records. Segments older than a week are downsampled into
+yearly files of hourly averages, so a year of data for tens of devices stays in a few
+megabytes. Reads memory-map the segments.'''
+
+import math
+import mmap
+import re
+import struct
+import time
+from collections import defaultdict
+from pathlib import Path
+
+# epoch seconds, room temperature, floor temperature, setpoint
+RECORD = struct.Struct('<Ifff')
+DEFAULT_HISTORY_PATH = Path('history')
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+NAN = float('nan')
+
+def _getDeviceKey(deviceName: str) -> str:
+    '''Convert device name to a safe directory name.'''
+    return re.sub(r'[^A-Za-z0-9_-]', '_', deviceName) or '_'
+
+def _mean(values: list[float]) -> float:
+    '''Average of values that are not NaN.'''
+    values = [value for value in values if not math.isnan(value)]
+    return sum(values) / len(values) if values else NAN
+
+def _readRecords(path: Path) -> list[tuple]:
+    '''Read all records of a segment by memory-mapping it.'''
+    size = path.stat().st_size if path.exists() else 0
+    size -= size % RECORD.size # a partially written last record is ignored
+    if size == 0:
+        return []
+    with open(path, 'rb') as segment, \
+            mmap.mmap(segment.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return list(RECORD.iter_unpack(memoryview(mapped)[:size]))
+
+def renderSparkline(values: list[float]) -> str:
+    '''Render values as a line of block characters. Missing values are spaces.'''
+    present = [value for value in values if not math.isnan(value)]
+    if not present:
+        return ''
+    low, high = min(present), max(present)
+    scale = (len(SPARK_CHARS) - 1) / (high - low) if high > low else 0
+    return ''.join(' ' if math.isnan(value) else SPARK_CHARS[round((value - low) * scale)]
+                   for value in values)
+
+class HistoryStore:
+    '''Append-only store of room, floor and setpoint temperatures per device.'''
+
+    def __init__(self, root: Path = DEFAULT_HISTORY_PATH, rawDays: int = 7) -> None:
+        self.root = Path(root)
+        self.rawDays = rawDays
+        self.lastCompaction = {}
+
+    def _getDeviceDir(self, deviceName: str) -> Path:
+        '''Get directory of device segments.'''
+        return self.root / _getDeviceKey(deviceName)
+
+    def append(self, deviceName: str, timestamp: float, roomTemp: float = NAN,
+               floorTemp: float = NAN, setpoint: float = NAN) -> None:
+        '''Append one sample to the daily segment of the device.'''
+        deviceDir = self._getDeviceDir(deviceName)
+        day = time.strftime('%Y%m%d', time.localtime(timestamp))
+        record = RECORD.pack(int(timestamp), *(NAN if value is None else float(value)
+                                               for value in (roomTemp, floorTemp, setpoint)))
+        try:
+            deviceDir.mkdir(parents=True, exist_ok=True)
+            with open(deviceDir / f'raw-{day}.bin', 'ab') as segment:
+                segment.write(record)
+        except OSError as err:
+            print(f'Historiaa ei voitu tallentaa laitteelle {deviceName}, virhe: {err}')
+            return
+        if self.lastCompaction.get(deviceName) != day:
+            self.lastCompaction[deviceName] = day
+            self.compact(deviceName, timestamp)
+
+    def compact(self, deviceName: str, now: float) -> None:
+        '''Downsample raw segments older than rawDays into hourly averages.'''
+        deviceDir = self._getDeviceDir(deviceName)
+        oldestRaw = time.strftime('%Y%m%d', time.localtime(now - self.rawDays * 86400))
+        for rawPath in sorted(deviceDir.glob('raw-*.bin')):
+            if rawPath.stem.removeprefix('raw-') >= oldestRaw:
+                continue
+            hours = defaultdict(list)
+            for record in _readRecords(rawPath):
+                hours[record[0] - record[0] % 3600].append(record)
+            with open(deviceDir / f'hourly-{rawPath.stem[4:8]}.bin', 'ab') as hourly:
+                for hour in sorted(hours):
+                    columns = list(zip(*hours[hour]))
+                    hourly.write(RECORD.pack(hour, *(_mean(column) for column in columns[1:])))
+            rawPath.unlink()
+
+    def read(self, deviceName: str, start: float, end: float) -> list[tuple]:
+        '''Get records between start and end epoch seconds, hourly averages for old data.'''
+        deviceDir = self._getDeviceDir(deviceName)
+        if not deviceDir.exists():
+            return []
+        startYear = time.strftime('%Y', time.localtime(start))
+        endYear = time.strftime('%Y', time.localtime(end))
+        startDay = time.strftime('%Y%m%d', time.localtime(start))
+        endDay = time.strftime('%Y%m%d', time.localtime(end))
+        records = []
+        for path in sorted(deviceDir.glob('hourly-*.bin')):
+            if startYear <= path.stem.removeprefix('hourly-') <= endYear:
+                records.extend(_readRecords(path))
+        for path in sorted(deviceDir.glob('raw-*.bin')):
+            if startDay <= path.stem.removeprefix('raw-') <= endDay:
+                records.extend(_readRecords(path))
+        return sorted(record for record in records if start <= record[0] <= end)
+
+    def renderHistory(self, deviceName: str, now: float = None, hours: int = 24) -> str:
+        '''Render room temperature and setpoint of the last hours as sparklines.'''
+        if now is None:
+            now = time.time()
+        records = self.read(deviceName, now - hours * 3600, now)
+        if not records:
+            return f'Laitteelle {deviceName} ei ole historiatietoja.'
+        buckets = [[] for _ in range(hours * 4)]
+        for record in records:
+            index = min(int((record[0] - (now - hours * 3600)) // 900), len(buckets) - 1)
+            buckets[index].append(record)
+        lines = [f'Historia {deviceName}, viimeiset {hours} h:']
+        for column, label in ((1, 'huone'), (2, 'lattia'), (3, 'asetus')):
+            values = [_mean([record[column] for record in bucket]) for bucket in buckets]
+            present = [value for value in values if not math.isnan(value)]
+            if present:
+                lines.append(f'{label:>7} {min(present):5.1f}-{max(present):5.1f} C '
+                             f'{renderSparkline(values)}')
+        return '\n'.join(lines)
+
+_SHARED_STORE = None
+
+def getSharedHistoryStore() -> HistoryStore:
+    '''Get process-wide history store.'''
+    global _SHARED_STORE # pylint: disable=global-statement
+    if _SHARED_STORE is None:
+        _SHARED_STORE = HistoryStore()
+    return _SHARED_STORE
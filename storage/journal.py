@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''Module for crash-safe controller state. Changes are appended to a journal as JSON lines
+with a checksum, so a crash in the middle of a write loses at most that line. When the journal
+has grown to several times the size of the state it is compacted into a snapshot that
+atomically replaces the old file.'''
+
+import json
+import os
+import zlib
+from pathlib import Path
+
+DEFAULT_JOURNAL_PATH = Path('cache/state.journal')
+
+# Kinds of journal entries
+DEVICE = 'device'
+BREAKER = 'breaker'
+
+def _encodeLine(kind: str, key: str, value: dict) -> bytes:
+    '''Encode entry as "<crc32> <json>\\n". Value None removes the entry.'''
+    payload = json.dumps([kind, key, value], separators=(',', ':'),
+                         ensure_ascii=False).encode('utf-8')
+    return b'%08x ' % zlib.crc32(payload) + payload + b'\n'
+
+def _decodeLine(line: bytes) -> tuple:
+    '''Decode entry. Returns None if the line is torn or corrupted.'''
+    if len(line) < 10 or line[8:9] != b' ' or not line.endswith(b'\n'):
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        kind, key, value = json.loads(payload)
+    except ValueError:
+        return None
+    return kind, key, value
+
+class StateJournal:
+    '''Latest value of every (kind, key), persisted as an append-only journal.'''
+
+    def __init__(self, path: Path = DEFAULT_JOURNAL_PATH, compactFactor: int = 4,
+                 minimumLines: int = 256) -> None:
+        self.path = Path(path)
+        self.compactFactor = compactFactor
+        self.minimumLines = minimumLines
+        self.state = {}
+        self.lines = 0
+        self.fd = None
+        self._load()
+
+    def _load(self) -> None:
+        '''Replay journal. Damaged lines are skipped and a torn last line is cut off so
+        that the next append starts on a line of its own.'''
+        try:
+            with open(self.path, 'rb') as journalFile:
+                data = journalFile.read()
+        except FileNotFoundError:
+            return
+        except OSError as err:
+            print(f'Tilatiedostoa {self.path} ei voitu lukea, virhe: {err}')
+            return
+        for line in data.splitlines(keepends=True):
+            self.lines += 1
+            entry = _decodeLine(line)
+            if entry is None:
+                continue
+            kind, key, value = entry
+            if value is None:
+                self.state.pop((kind, key), None)
+            else:
+                self.state[(kind, key)] = value
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            try:
+                os.truncate(self.path, complete)
+            except OSError as err:
+                print(f'Tilatiedostoa {self.path} ei voitu korjata, virhe: {err}')
+
+    def _open(self) -> int:
+        '''Open journal for appending.'''
+        if self.fd is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self.fd
+
+    def get(self, kind: str, key: str) -> dict:
+        '''Get latest value of entry, None if there is none.'''
+        return self.state.get((kind, key))
+
+    def getAll(self, kind: str) -> dict[str, dict]:
+        '''Get latest values of all entries of kind.'''
+        return {key: value for (entryKind, key), value in self.state.items()
+                if entryKind == kind}
+
+    def record(self, kind: str, key: str, value: dict) -> bool:
+        '''Append value of entry if it changed. Returns True if it was written.'''
+        if self.state.get((kind, key)) == value:
+            return False
+        if value is None:
+            self.state.pop((kind, key), None)
+        else:
+            self.state[(kind, key)] = value
+        try:
+            os.write(self._open(), _encodeLine(kind, key, value))
+        except OSError as err:
+            print(f'Tilatiedostoon {self.path} ei voitu kirjoittaa, virhe: {err}')
+            return False
+        self.lines += 1
+        if self.lines >= max(self.minimumLines, self.compactFactor * len(self.state)):
+            self.compact()
+        return True
+
+    def compact(self) -> None:
+        '''Replace journal with a snapshot of the current state.'''
+        tmpPath = self.path.with_suffix('.tmp')
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmpPath, 'wb') as snapshot:
+                for (kind, key), value in self.state.items():
+                    snapshot.write(_encodeLine(kind, key, value))
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(tmpPath, self.path)
+        except OSError as err:
+            print(f'Tilatiedostoa {self.path} ei voitu tiivistää, virhe: {err}')
+            return
+        self.close()
+        self.lines = len(self.state)
+
+    def close(self) -> None:
+        '''Close journal file.'''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+_SHARED_JOURNAL = None
+
+def getSharedStateJournal() -> StateJournal:
+    '''Get process-wide state journal.'''
+    global _SHARED_JOURNAL # pylint: disable=global-statement
+    if _SHARED_JOURNAL is None:
+        _SHARED_JOURNAL = StateJournal()
+    return _SHARED_JOURNAL
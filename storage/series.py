@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+'''Module for compact on-disk time series of spot prices and outdoor temperature forecasts.
+Every series of a region is one columnar file: a header, a column of epoch milliseconds
+and a column of values. Files are replaced atomically and read by memory-mapping them, so
+queries return memoryviews into the file without copying.'''
+
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from dataclasses import dataclass
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError: # Windows has no flock, the files are then not shared safely
+    fcntl = None
+
+# magic, version, number of points. Native byte order and 16 byte header so that the
+# columns can be cast to memoryviews directly.
+HEADER = struct.Struct('=4sHxxIxxxx')
+MAGIC = b'HCS1'
+VERSION = 1
+DEFAULT_SERIES_PATH = Path('cache/series')
+# Covers the default 30 days of a replay and the 14 days of history before it
+DEFAULT_RETENTION_DAYS = 45.0
+PRICE = 'price'
+TEMPERATURE = 'temperature'
+
+@dataclass(frozen=True, slots=True)
+class SeriesView:
+    '''Read-only columns of one series. Epochs and values are memoryviews into the file.'''
+    epochs: memoryview
+    values: memoryview
+    identity: tuple
+
+    def query(self, start: int, end: int) -> tuple[memoryview, memoryview]:
+        '''Get points with start <= epoch < end without copying.'''
+        first = bisect_left(self.epochs, start)
+        last = bisect_left(self.epochs, end, first)
+        return self.epochs[first:last], self.values[first:last]
+
+    def getLastEpoch(self) -> int:
+        '''Get epoch of the last point. Returns None for empty series.'''
+        return self.epochs[-1] if len(self.epochs) else None
+
+class SeriesStore:
+    '''Store of price and temperature series per region.'''
+
+    def __init__(self, root: Path = DEFAULT_SERIES_PATH,
+                 retentionDays: float = DEFAULT_RETENTION_DAYS) -> None:
+        self.root = Path(root)
+        self.retentionDays = retentionDays
+        self.views = {}
+
+    def _getPath(self, kind: str, region: str) -> Path:
+        '''Get path of series file.'''
+        return self.root / f'{kind}-{region}.bin'
+
+    def write(self, kind: str, region: str, points: dict[int, float], now: float = None) -> None:
+        '''Merge points (epoch milliseconds to value) into series and replace the file
+        atomically. Points older than the retention are dropped.'''
+        if now is None:
+            now = time.time()
+        oldest = int((now - self.retentionDays * 86400) * 1000)
+        path = self._getPath(kind, region)
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            # Worker processes write the same files, the lock keeps their points
+            with open(path.with_suffix('.lock'), 'a', encoding='utf-8') as lockFile:
+                if fcntl is not None:
+                    fcntl.flock(lockFile, fcntl.LOCK_EX)
+                view = self.getSeries(kind, region)
+                merged = {} if view is None else dict(zip(view.epochs, view.values))
+                merged.update(points)
+                epochs = sorted(epoch for epoch in merged if epoch >= oldest)
+                tmpPath = path.with_suffix(f'.{os.getpid()}.tmp')
+                with open(tmpPath, 'wb') as seriesFile:
+                    seriesFile.write(HEADER.pack(MAGIC, VERSION, len(epochs)))
+                    seriesFile.write(struct.pack(f'={len(epochs)}q', *epochs))
+                    seriesFile.write(struct.pack(f'={len(epochs)}d',
+                                                 *(merged[epoch] for epoch in epochs)))
+                os.replace(tmpPath, path)
+        except OSError as err:
+            print(f'Aikasarjaa {path} ei voitu tallentaa, virhe: {err}')
+
+    def getSeries(self, kind: str, region: str) -> SeriesView:
+        '''Get memory-mapped series. Returns None if there is no valid file. The file is
+        mapped again only when it has been replaced.'''
+        path = self._getPath(kind, region)
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        # Every atomic replace creates a new inode
+        identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        view = self.views.get((kind, region))
+        if view is not None and view.identity == identity:
+            return view
+        try:
+            with open(path, 'rb') as seriesFile:
+                mapped = mmap.mmap(seriesFile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as err:
+            print(f'Aikasarjaa {path} ei voitu lukea, virhe: {err}')
+            return None
+        magic, version, count = HEADER.unpack_from(mapped) if len(mapped) >= HEADER.size \
+            else (None, None, 0)
+        end = HEADER.size + count * 16
+        if magic != MAGIC or version != VERSION or len(mapped) < end:
+            print(f'Aikasarjatiedosto {path} on virheellinen.')
+            return None
+        buffer = memoryview(mapped)
+        view = SeriesView(buffer[HEADER.size:HEADER.size + count * 8].cast('q'),
+                          buffer[HEADER.size + count * 8:end].cast('d'), identity)
+        self.views[(kind, region)] = view
+        return view
+
+    def query(self, kind: str, region: str, start: int,
+              end: int) -> tuple[memoryview, memoryview]:
+        '''Get points of series between start and end epoch milliseconds without copying.
+        Returns empty columns if there is no series.'''
+        view = self.getSeries(kind, region)
+        if view is None:
+            return memoryview(b'').cast('q'), memoryview(b'').cast('d')
+        return view.query(start, end)
+
+_SHARED_STORE = None
+
+def getSharedSeriesStore() -> SeriesStore:
+    '''Get process-wide series store.'''
+    global _SHARED_STORE # pylint: disable=global-statement
+    if _SHARED_STORE is None:
+        _SHARED_STORE = SeriesStore(retentionDays=float(
+            os.getenv('SERIES_RETENTION_DAYS', str(DEFAULT_RETENTION_DAYS))))
+    return _SHARED_STORE
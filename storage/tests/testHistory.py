@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+'''Module for unit test for HistoryStore class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s storage/tests -p "testHistory.py"
+'''
+
+import math
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from storage.history import RECORD, HistoryStore, renderSparkline # pylint: disable=import-error
+
+class TestHistoryStore(unittest.TestCase):
+    '''Unit tests for HistoryStore class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.store = HistoryStore(self.tmpDir.name, rawDays=7)
+        self.now = float(int(time.time()) // 3600 * 3600)
+
+    def tearDown(self):
+        self.tmpDir.cleanup()
+
+    def testAppendAndRead(self):
+        '''Samples are stored as fixed-width records and read back in order.'''
+        self.store.append('Olohuone', self.now, 21.0, 24.0, 22.0)
+        self.store.append('Olohuone', self.now + 900, setpoint=18.0)
+        records = self.store.read('Olohuone', self.now - 1, self.now + 1000)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0], (int(self.now), 21.0, 24.0, 22.0))
+        self.assertTrue(math.isnan(records[1][1]))
+        segments = list(Path(self.tmpDir.name, 'Olohuone').glob('raw-*.bin'))
+        self.assertEqual(sum(path.stat().st_size for path in segments), 2 * RECORD.size)
+
+    def testPartialRecordIsIgnored(self):
+        '''Torn write at the end of a segment does not break reading.'''
+        self.store.append('Olohuone', self.now, 21.0, 24.0, 22.0)
+        segment = next(Path(self.tmpDir.name, 'Olohuone').glob('raw-*.bin'))
+        with open(segment, 'ab') as rawFile:
+            rawFile.write(b'\x00\x01\x02')
+        self.assertEqual(len(self.store.read('Olohuone', self.now - 1, self.now + 1)), 1)
+
+    def testOldDataIsDownsampledHourly(self):
+        '''Raw segments older than rawDays become hourly averages.'''
+        old = self.now - 10 * 86400
+        for quarter in range(4):
+            self.store.append('Olohuone', old + quarter * 900, 20.0 + quarter, 24.0, 22.0)
+        self.store.append('Olohuone', self.now, 21.0, 24.0, 22.0)
+        deviceDir = Path(self.tmpDir.name, 'Olohuone')
+        self.assertEqual(len(list(deviceDir.glob('raw-*.bin'))), 1)
+        records = self.store.read('Olohuone', old - 1, old + 3600)
+        self.assertEqual(records, [(int(old), 21.5, 24.0, 22.0)])
+
+    def testRenderSparkline(self):
+        '''Values are scaled between the lowest and highest block.'''
+        self.assertEqual(renderSparkline([18.0, float('nan'), 22.0]), '▁ █')
+        self.assertEqual(renderSparkline([]), '')
+
+if __name__ == '__main__':
+    unittest.main()
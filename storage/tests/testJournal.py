@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+'''Module for unit test for StateJournal class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s storage/tests -p "testJournal.py"
+'''
+
+import tempfile
+import unittest
+from pathlib import Path
+
+from storage.journal import BREAKER, DEVICE, StateJournal # pylint: disable=import-error
+
+class TestStateJournal(unittest.TestCase):
+    '''Unit tests for StateJournal class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.path = Path(self.tmpDir.name) / 'state.journal'
+        self.journal = StateJournal(self.path)
+
+    def tearDown(self):
+        self.journal.close()
+        self.tmpDir.cleanup()
+
+    def _reopen(self) -> StateJournal:
+        self.journal.close()
+        self.journal = StateJournal(self.path)
+        return self.journal
+
+    def testLatestValuesSurviveRestart(self):
+        '''Latest value wins, unchanged values are not appended and None removes.'''
+        self.assertTrue(self.journal.record(DEVICE, 'olohuone', {'setpoint': 18.0}))
+        self.assertTrue(self.journal.record(DEVICE, 'olohuone', {'setpoint': 22.0}))
+        self.assertFalse(self.journal.record(DEVICE, 'olohuone', {'setpoint': 22.0}))
+        self.journal.record(DEVICE, 'sauna', {'setpoint': 5.0})
+        self.journal.record(BREAKER, 'host:laite', {'failures': 3})
+        self.journal.record(DEVICE, 'sauna', None)
+        journal = self._reopen()
+        self.assertEqual(journal.get(DEVICE, 'olohuone'), {'setpoint': 22.0})
+        self.assertIsNone(journal.get(DEVICE, 'sauna'))
+        self.assertEqual(journal.getAll(BREAKER), {'host:laite': {'failures': 3}})
+        self.assertEqual(journal.lines, 5)
+
+    def testTornAndCorruptedLinesAreSkipped(self):
+        '''Crash in the middle of a write loses only the torn line.'''
+        self.journal.record(DEVICE, 'olohuone', {'setpoint': 18.0})
+        self.journal.record(DEVICE, 'keittiö', {'setpoint': 20.0})
+        self.journal.close()
+        data = self.path.read_bytes()
+        firstEnd = data.index(b'\n') + 1
+        corrupted = data[:firstEnd - 3] + b'9' + data[firstEnd - 2:firstEnd]
+        self.path.write_bytes(corrupted + data[firstEnd:-5])
+        journal = self._reopen()
+        self.assertIsNone(journal.get(DEVICE, 'olohuone'))
+        self.assertIsNone(journal.get(DEVICE, 'keittiö'))
+        journal.record(DEVICE, 'sauna', {'setpoint': 5.0})
+        self.assertEqual(self._reopen().get(DEVICE, 'sauna'), {'setpoint': 5.0})
+
+    def testCompactionKeepsState(self):
+        '''Journal is replaced by a snapshot when it grows.'''
+        journal = StateJournal(self.path, compactFactor=2, minimumLines=10)
+        for value in range(25):
+            journal.record(DEVICE, f'huone{value % 3}', {'setpoint': value})
+        journal.close()
+        self.assertLess(len(self.path.read_bytes().splitlines()), 10)
+        journal = self._reopen()
+        self.assertEqual(journal.get(DEVICE, 'huone0'), {'setpoint': 24})
+        self.assertEqual(journal.get(DEVICE, 'huone2'), {'setpoint': 23})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+'''Module for unit test for SeriesStore class.
+Run with command in the main directory of the project:
+python3 -m unittest discover -s storage/tests -p "testSeries.py"
+'''
+
+import mmap
+import multiprocessing
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from storage.series import PRICE, SeriesStore # pylint: disable=import-error
+
+HOUR = 3600_000
+
+def writeHours(root: str, worker: int, now: float) -> None:
+    '''Write every other hour of the day as one worker process.'''
+    store = SeriesStore(Path(root), retentionDays=1)
+    for hour in range(worker, 24, 2):
+        store.write(PRICE, 'FI', {int(now * 1000) + hour * HOUR: float(hour)}, now)
+
+class TestSeriesStore(unittest.TestCase):
+    '''Unit tests for SeriesStore class.'''
+
+    def setUp(self):
+        self.tmpDir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.store = SeriesStore(Path(self.tmpDir.name), retentionDays=1)
+        self.now = 1_700_000_000.0
+        self.start = int(self.now * 1000)
+
+    def tearDown(self):
+        self.store.views.clear()
+        self.tmpDir.cleanup()
+
+    def testWriteMergeAndQuery(self):
+        '''Points are merged, sorted and queried as memoryviews into the mapped file.'''
+        self.store.write(PRICE, 'FI', {self.start + HOUR: 2.0, self.start: 1.0}, self.now)
+        self.store.write(PRICE, 'FI', {self.start + HOUR: 3.0, self.start + 2 * HOUR: 4.0},
+                         self.now)
+        epochs, values = self.store.query(PRICE, 'FI', self.start, self.start + 2 * HOUR)
+        self.assertEqual(list(epochs), [self.start, self.start + HOUR])
+        self.assertEqual(list(values), [1.0, 3.0])
+        self.assertIsInstance(values, memoryview)
+        self.assertIsInstance(values.obj, mmap.mmap)
+        self.assertEqual(self.store.getSeries(PRICE, 'FI').getLastEpoch(), self.start + 2 * HOUR)
+
+    def testRetentionAndMissingSeries(self):
+        '''Old points are dropped and missing series gives empty columns.'''
+        self.store.write(PRICE, 'FI', {self.start - 2 * 86400_000: 1.0, self.start: 2.0},
+                         self.now)
+        epochs, _ = self.store.query(PRICE, 'FI', 0, self.start + HOUR)
+        self.assertEqual(list(epochs), [self.start])
+        epochs, values = self.store.query(PRICE, 'SE3', 0, self.start)
+        self.assertEqual((len(epochs), len(values)), (0, 0))
+
+    def testCorruptFileIsIgnored(self):
+        '''File with wrong header is not used.'''
+        Path(self.tmpDir.name, 'price-FI.bin').write_bytes(b'garbage')
+        with patch('builtins.print'):
+            self.assertIsNone(self.store.getSeries(PRICE, 'FI'))
+
+    def testConcurrentWritersKeepAllPoints(self):
+        '''Processes writing the same series do not lose each other's points.'''
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=writeHours, args=(self.tmpDir.name, worker, self.now))
+                     for worker in range(2)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(30)
+        _, values = self.store.query(PRICE, 'FI', self.start, self.start + 24 * HOUR)
+        self.assertEqual(list(values), [float(hour) for hour in range(24)])
+        self.assertEqual(list(Path(self.tmpDir.name).glob('*.tmp')), [])
+
+if __name__ == '__main__':
+    unittest.main()